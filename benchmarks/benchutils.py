@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+#
+# shared helpers for the snap benchmark harnesses
+#
+
+
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import tracemalloc
+import importlib.machinery
+import importlib.util
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARK_DIR)
+REPORT_FORMAT_VERSION = 1
+
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+
+def load_script_module(script_name):
+    '''Load one of the extensionless scripts in the scripts/ directory
+    (routegen, uwsgen, ...) as a python module.
+    '''
+    script_path = os.path.join(PROJECT_DIR, 'scripts', script_name)
+    loader = importlib.machinery.SourceFileLoader(script_name, script_path)
+    spec = importlib.util.spec_from_loader(script_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    sys.modules[script_name] = module
+    return module
+
+
+def snap_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('snap-micro').version
+    except Exception:
+        return 'unknown'
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return None
+    index = int(round((pct / 100.0) * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+class LatencyRecorder(object):
+    def __init__(self):
+        self.samples = []
+
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        total = sum(ordered)
+        return {'count': len(ordered),
+                'total_seconds': total,
+                'p50_ms': percentile(ordered, 50) * 1000.0 if ordered else None,
+                'p99_ms': percentile(ordered, 99) * 1000.0 if ordered else None,
+                'max_ms': ordered[-1] * 1000.0 if ordered else None}
+
+
+
+class AllocationTracker(object):
+    '''Counts bytes and blocks allocated while a measured block runs,
+    along with the peak traced memory.
+    '''
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._start = tracemalloc.take_snapshot()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = tracemalloc.take_snapshot()
+        self.current_bytes, self.peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated_bytes = 0
+        allocated_blocks = 0
+        for stat in end.compare_to(self._start, 'lineno'):
+            if stat.size_diff > 0:
+                allocated_bytes += stat.size_diff
+            if stat.count_diff > 0:
+                allocated_blocks += stat.count_diff
+        self.allocated_bytes = allocated_bytes
+        self.allocated_blocks = allocated_blocks
+        return False
+
+
+    def summary(self, operations=1):
+        operations = max(operations, 1)
+        return {'allocated_bytes': self.allocated_bytes,
+                'allocated_blocks': self.allocated_blocks,
+                'bytes_per_op': float(self.allocated_bytes) / operations,
+                'blocks_per_op': float(self.allocated_blocks) / operations,
+                'peak_bytes': self.peak_bytes}
+
+
+
+def new_report(benchmark_name, parameters):
+    return {'format_version': REPORT_FORMAT_VERSION,
+            'benchmark': benchmark_name,
+            'snap_version': snap_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'parameters': parameters,
+            'results': []}
+
+
+def write_report(report, filename):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+
+
+def read_report(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+class Stopwatch(object):
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        return False
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+'''Usage: compare.py [--threshold=<pct>] <baseline_report> <current_report>
+          compare.py -h | --help
+
+Compare two benchmark reports produced by the same harness and flag regressions.
+Exits with status 1 if any scenario regressed by more than the threshold.
+
+Options:
+    --threshold=<pct>    allowed slowdown, in percent, before a scenario is flagged [default: 10]
+'''
+
+
+import sys
+from docopt import docopt
+
+import benchutils
+
+
+# metric path -> True if a higher value is better
+COMPARED_METRICS = {
+    ('requests_per_second',): True,
+    ('rows_per_second',): True,
+    ('latency', 'p50_ms'): False,
+    ('latency', 'p99_ms'): False,
+    ('allocations', 'bytes_per_op'): False,
+    ('memory', 'peak_bytes'): False
+}
+
+# result fields which are parameters of a scenario rather than measurements
+SCENARIO_KEYS = ['method', 'content_type', 'width', 'transforms', 'operation', 'converter', 'shape']
+
+
+def scenario_key(result):
+    return tuple((k, result.get(k)) for k in SCENARIO_KEYS if k in result)
+
+
+def lookup_metric(result, path):
+    value = result
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_reports(baseline, current, threshold_pct):
+    baseline_results = dict((scenario_key(r), r) for r in baseline['results'])
+    regressions = []
+    lines = []
+    for result in current['results']:
+        key = scenario_key(result)
+        previous = baseline_results.get(key)
+        if previous is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            old_value = lookup_metric(previous, path)
+            new_value = lookup_metric(result, path)
+            if not old_value or new_value is None:
+                continue
+            change_pct = (new_value - old_value) * 100.0 / old_value
+            regressed = (change_pct < -threshold_pct) if higher_is_better else (change_pct > threshold_pct)
+            line = '%s %s: %.3f -> %.3f (%+.1f%%)%s' % (', '.join('%s=%s' % kv for kv in key),
+                                                        '.'.join(path),
+                                                        old_value,
+                                                        new_value,
+                                                        change_pct,
+                                                        '  REGRESSION' if regressed else '')
+            lines.append(line)
+            if regressed:
+                regressions.append(line)
+    return lines, regressions
+
+
+def main(args):
+    baseline = benchutils.read_report(args['<baseline_report>'])
+    current = benchutils.read_report(args['<current_report>'])
+    if baseline['benchmark'] != current['benchmark']:
+        print('cannot compare a "%s" report with a "%s" report.' % (baseline['benchmark'], current['benchmark']))
+        return 2
+
+    lines, regressions = compare_reports(baseline, current, float(args['--threshold']))
+    print('\n'.join(lines))
+    print('%d regression(s) found.' % len(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(docopt(__doc__)))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''Usage: csv_throughput.py [--rows=<n>] [--wide-columns=<n>] [--output=<file>]
+          csv_throughput.py -h | --help
+
+Measure snap.csvutils throughput on synthetic narrow and wide CSV files containing
+int, float, bool, timestamp and string columns. Reports rows/sec and peak traced
+memory for CSVRecordMap.row_to_dictionary, CSVRecordMap.dictionary_to_row and
+each built-in converter.
+
+Options:
+    --rows=<n>              rows per synthetic file [default: 20000]
+    --wide-columns=<n>      number of columns in the wide file [default: 50]
+    --output=<file>         JSON report filename [default: csv_throughput.json]
+'''
+
+
+import os
+import random
+import shutil
+import tempfile
+import datetime
+import tracemalloc
+
+from docopt import docopt
+
+import benchutils
+from benchutils import Stopwatch
+
+from snap import csvutils
+
+
+# column type -> (python datatype, raw string generator, converter class or None)
+COLUMN_TYPES = [
+    ('int', int, lambda r: str(r.randint(0, 1000000)), csvutils.StringToIntConverter),
+    ('float', float, lambda r: '%.4f' % r.uniform(0, 10000), csvutils.StringToFloatConverter),
+    ('bool', str, lambda r: r.choice(['t', 'f']), csvutils.SingleLetterToBooleanConverter),
+    ('timestamp', str, lambda r: (datetime.datetime(2017, 1, 1) + datetime.timedelta(seconds=r.randint(0, 10**7))).isoformat(),
+     csvutils.DatetimeStringToISOFormatConverter),
+    ('string', str, lambda r: 'value_%d' % r.randint(0, 10**6), None)
+]
+
+CONVERTER_CLASSES = [csvutils.StringToIntConverter,
+                     csvutils.StringToFloatConverter,
+                     csvutils.SingleLetterToBooleanConverter,
+                     csvutils.DatetimeStringToISOFormatConverter,
+                     csvutils.TimestampISOConverter]
+
+
+class SyntheticCSVFile(object):
+    def __init__(self, name, num_columns, num_rows, directory, seed=42):
+        self.name = name
+        self.num_rows = num_rows
+        self.columns = [(COLUMN_TYPES[i % len(COLUMN_TYPES)], 'col_%d' % i) for i in range(num_columns)]
+        self.filename = os.path.join(directory, '%s.csv' % name)
+
+        rng = random.Random(seed)
+        with open(self.filename, 'w') as f:
+            f.write(','.join([col_name for (_, col_name) in self.columns]))
+            f.write('\n')
+            for _ in range(num_rows):
+                f.write(','.join([coltype[2](rng) for (coltype, _) in self.columns]))
+                f.write('\n')
+
+
+    def rows(self):
+        with open(self.filename) as f:
+            f.readline()
+            for line in f:
+                yield line
+
+
+    def values_for_type(self, type_name):
+        index = [i for i, (coltype, _) in enumerate(self.columns) if coltype[0] == type_name][0]
+        return [line.strip().split(',')[index] for line in self.rows()]
+
+
+    def reading_record_map(self):
+        builder = csvutils.CSVRecordMapBuilder()
+        for (coltype, col_name) in self.columns:
+            builder.add_field(col_name, coltype[1])
+        for (coltype, col_name) in self.columns:
+            if coltype[3] and coltype[1] is str:
+                builder.register_converter(coltype[3](), col_name)
+        return builder.build()
+
+
+    def writing_record_map(self):
+        # converted bool columns hold python booleans, which dictionary_to_row formats via str()
+        fields = []
+        for (coltype, col_name) in self.columns:
+            datatype = bool if coltype[0] == 'bool' else coltype[1]
+            fields.append(csvutils.CSVField(col_name, datatype))
+        return csvutils.CSVRecordMap(fields)
+
+
+
+def measure(label_fields, operation, num_items):
+    '''Run <operation> once untraced for throughput and once under tracemalloc
+    for peak memory.
+    '''
+    with Stopwatch() as timer:
+        operation()
+
+    tracemalloc.start()
+    operation()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = dict(label_fields)
+    result.update({'rows': num_items,
+                   'seconds': timer.elapsed,
+                   'rows_per_second': num_items / timer.elapsed if timer.elapsed else None,
+                   'memory': {'peak_bytes': peak_bytes}})
+    return result
+
+
+def benchmark_record_map(csv_file):
+    results = []
+    reading_map = csv_file.reading_record_map()
+
+    def read_all():
+        for row in csv_file.rows():
+            reading_map.row_to_dictionary(row)
+
+    results.append(measure({'shape': csv_file.name, 'operation': 'row_to_dictionary'}, read_all, csv_file.num_rows))
+
+    writing_map = csv_file.writing_record_map()
+    records = [reading_map.row_to_dictionary(row) for row in csv_file.rows()]
+
+    def write_all():
+        for record in records:
+            writing_map.dictionary_to_row(record)
+
+    results.append(measure({'shape': csv_file.name, 'operation': 'dictionary_to_row'}, write_all, csv_file.num_rows))
+    return results
+
+
+def benchmark_converters(csv_file):
+    results = []
+    converter_inputs = {csvutils.StringToIntConverter: csv_file.values_for_type('int'),
+                        csvutils.StringToFloatConverter: csv_file.values_for_type('float'),
+                        csvutils.SingleLetterToBooleanConverter: csv_file.values_for_type('bool'),
+                        csvutils.DatetimeStringToISOFormatConverter: csv_file.values_for_type('timestamp')}
+    converter_inputs[csvutils.TimestampISOConverter] = [datetime.datetime.strptime(v, '%Y-%m-%dT%H:%M:%S')
+                                                        for v in converter_inputs[csvutils.DatetimeStringToISOFormatConverter]]
+
+    for klass in CONVERTER_CLASSES:
+        converter = klass()
+        values = converter_inputs[klass]
+
+        def convert_all():
+            for value in values:
+                converter.convert(value)
+
+        results.append(measure({'shape': csv_file.name, 'operation': 'convert', 'converter': klass.__name__},
+                               convert_all,
+                               len(values)))
+    return results
+
+
+def result_label(result):
+    return '%s %s' % (result['shape'], result.get('converter') or result['operation'])
+
+
+def main(args):
+    num_rows = int(args['--rows'])
+    wide_columns = int(args['--wide-columns'])
+    output_filename = os.path.abspath(args['--output'])
+
+    report = benchutils.new_report('csv_throughput', {'rows': num_rows, 'wide_columns': wide_columns})
+    work_dir = tempfile.mkdtemp(prefix='snap_csvbench_')
+    try:
+        csv_files = [SyntheticCSVFile('narrow', len(COLUMN_TYPES), num_rows, work_dir),
+                     SyntheticCSVFile('wide', wide_columns, num_rows, work_dir)]
+        for csv_file in csv_files:
+            results = benchmark_record_map(csv_file)
+            if csv_file.name == 'narrow':
+                results.extend(benchmark_converters(csv_file))
+            for result in results:
+                print('%-48s %12.1f rows/s   peak %10d B' % (result_label(result),
+                                                             result['rows_per_second'],
+                                                             result['memory']['peak_bytes']))
+            report['results'].extend(results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    benchutils.write_report(report, output_filename)
+    print('benchmark report written to %s' % output_filename)
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
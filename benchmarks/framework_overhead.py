@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+'''Usage: framework_overhead.py [--transforms=<n>] [--widths=<list>] [--requests=<n>] [--alloc-requests=<n>] [--output=<file>]
+          framework_overhead.py -h | --help
+
+Measure the per-request cost of the snap framework itself. For every shape width,
+a synthetic config with <n> GET and <n> POST transforms is generated, the routing
+module is rendered by routegen, the app is built through snap.setup, and requests
+are driven through the Flask WSGI test client.
+
+Options:
+    --transforms=<n>        number of transforms per HTTP method [default: 10]
+    --widths=<list>         comma-separated datashape widths (fields per shape) [default: 1,10,50]
+    --requests=<n>          timed requests per scenario [default: 2000]
+    --alloc-requests=<n>    requests per scenario in the (traced) allocation pass [default: 200]
+    --output=<file>         JSON report filename [default: framework_overhead.json]
+'''
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import importlib
+
+from docopt import docopt
+import jinja2
+import yaml
+
+import benchutils
+from benchutils import LatencyRecorder, AllocationTracker, Stopwatch
+
+from snap import core
+
+
+TRANSFORM_MODULE_CODE = '''
+import json
+from snap import core
+
+{% for name in transform_names %}
+def {{ name }}_func(input_data, service_objects, **kwargs):
+    return core.TransformStatus(json.dumps(input_data))
+{% endfor %}
+'''
+
+
+def encode_json_body(payload):
+    return json.dumps(payload)
+
+
+def encode_form_body(payload):
+    try:
+        from urllib.parse import urlencode
+    except ImportError:
+        from urllib import urlencode
+    return urlencode(payload)
+
+
+MULTIPART_BOUNDARY = 'snapbenchboundary'
+
+
+def encode_multipart_body(payload):
+    parts = []
+    for name, value in payload.items():
+        parts.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (MULTIPART_BOUNDARY, name, value))
+    parts.append('--%s--\r\n' % MULTIPART_BOUNDARY)
+    return ''.join(parts)
+
+
+# one body encoder for each content type the default protocol can decode
+BODY_ENCODERS = {
+    'application/json': encode_json_body,
+    'text/plain': encode_json_body,
+    'text/plain; charset=UTF-8': encode_json_body,
+    'application/x-www-form-urlencoded': encode_form_body,
+    'multipart/form-data': encode_multipart_body
+}
+
+# Content-Type headers which carry more than the decoder's key
+CONTENT_TYPE_HEADERS = {
+    'multipart/form-data': 'multipart/form-data; boundary=%s' % MULTIPART_BOUNDARY
+}
+
+
+def synthetic_payload(width):
+    return dict(('field_%d' % i, 'value_%d' % i) for i in range(width))
+
+
+def synthetic_config(num_transforms, width, project_dir, transform_module):
+    data_shapes = {}
+    transforms = {}
+    for i in range(num_transforms):
+        shape_name = 'shape_%d' % i
+        data_shapes[shape_name] = {'fields': [{'name': 'field_%d' % f,
+                                               'type': 'string',
+                                               'required': f == 0} for f in range(width)]}
+        for method in ['GET', 'POST']:
+            transforms['%s_%d' % (method.lower(), i)] = {'route': '/%s/%d' % (method.lower(), i),
+                                                        'method': method,
+                                                        'input_shape': shape_name,
+                                                        'output_mimetype': 'application/json'}
+
+    return {'globals': {'bind_host': '127.0.0.1',
+                        'port': 5000,
+                        'debug': False,
+                        'logfile': 'bench.log',
+                        'project_directory': project_dir,
+                        'transform_function_module': transform_module,
+                        'service_module': 'bench_services',
+                        'preprocessor_module': 'bench_decode'},
+            'app_name': 'bench',
+            'service_objects': {},
+            'data_shapes': data_shapes,
+            'transforms': transforms}
+
+
+def build_app(num_transforms, width, work_dir):
+    '''Write a synthetic config, transform module and generated routing module
+    to <work_dir>, then import the routing module (which runs snap.setup).
+    '''
+    routegen = benchutils.load_script_module('routegen')
+    transform_module = 'bench_transforms_w%d' % width
+    routing_module = 'bench_routes_w%d' % width
+    yaml_config = synthetic_config(num_transforms, width, work_dir, transform_module)
+
+    config_filename = os.path.join(work_dir, 'bench_w%d.yaml' % width)
+    with open(config_filename, 'w') as f:
+        yaml.dump(yaml_config, f, default_flow_style=False)
+
+    j2env = jinja2.Environment()
+    transform_code = j2env.from_string(TRANSFORM_MODULE_CODE).render(transform_names=yaml_config['transforms'].keys())
+    with open(os.path.join(work_dir, '%s.py' % transform_module), 'w') as f:
+        f.write(transform_code)
+
+    route_gen = routegen.RouteGenerator(yaml_config)
+    routing_code = route_gen.render_routing_module(yaml_config, j2env)
+    with open(os.path.join(work_dir, '%s.py' % routing_module), 'w') as f:
+        f.write(routing_code)
+
+    os.environ['SNAP_CONFIG'] = config_filename
+    if work_dir not in sys.path:
+        sys.path.insert(0, work_dir)
+    module = importlib.import_module(routing_module)
+    return module.app
+
+
+def build_requests(method, num_transforms, width, content_type=None):
+    payload = synthetic_payload(width)
+    requests = []
+    for i in range(num_transforms):
+        path = '/%s/%d' % (method.lower(), i)
+        if method == 'GET':
+            requests.append({'path': path, 'query_string': payload})
+        else:
+            requests.append({'path': path,
+                             'data': BODY_ENCODERS[content_type](payload),
+                             'headers': {'Content-Type': CONTENT_TYPE_HEADERS.get(content_type, content_type)}})
+    return requests
+
+
+def drive(client, method, request_specs, count):
+    latencies = LatencyRecorder()
+    errors = 0
+    call = client.get if method == 'GET' else client.post
+    with Stopwatch() as wall_clock:
+        for n in range(count):
+            spec = request_specs[n % len(request_specs)]
+            with Stopwatch() as timer:
+                response = call(**spec)
+            latencies.record(timer.elapsed)
+            if response.status_code != 200:
+                errors += 1
+    return latencies, errors, wall_clock.elapsed
+
+
+def run_scenario(client, method, content_type, num_transforms, width, num_requests, num_alloc_requests):
+    request_specs = build_requests(method, num_transforms, width, content_type)
+
+    # warm up every route once so that first-hit costs don't skew the numbers
+    drive(client, method, request_specs, len(request_specs))
+
+    latencies, errors, elapsed = drive(client, method, request_specs, num_requests)
+    with AllocationTracker() as allocations:
+        drive(client, method, request_specs, num_alloc_requests)
+
+    result = {'method': method,
+              'content_type': content_type,
+              'width': width,
+              'transforms': num_transforms,
+              'requests': num_requests,
+              'errors': errors,
+              'requests_per_second': num_requests / elapsed if elapsed else None,
+              'latency': latencies.summary(),
+              'allocations': allocations.summary(num_alloc_requests)}
+    return result
+
+
+def scenario_label(result):
+    return '%s %s w=%d' % (result['method'], result['content_type'] or '(query string)', result['width'])
+
+
+def main(args):
+    num_transforms = int(args['--transforms'])
+    widths = [int(w) for w in args['--widths'].split(',')]
+    num_requests = int(args['--requests'])
+    num_alloc_requests = int(args['--alloc-requests'])
+    output_filename = os.path.abspath(args['--output'])
+
+    report = benchutils.new_report('framework_overhead', {'transforms': num_transforms,
+                                                           'widths': widths,
+                                                           'requests': num_requests,
+                                                           'alloc_requests': num_alloc_requests})
+    work_dir = tempfile.mkdtemp(prefix='snap_bench_')
+    original_dir = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        for width in widths:
+            app = build_app(num_transforms, width, work_dir)
+            client = app.test_client()
+
+            scenarios = [('GET', None)]
+            for ctype in sorted(core.default_content_protocol.decoding_map.keys()):
+                if ctype in BODY_ENCODERS:
+                    scenarios.append(('POST', ctype))
+                else:
+                    print('skipping POST %s: no body encoder for it in BODY_ENCODERS' % ctype)
+            for method, content_type in scenarios:
+                result = run_scenario(client, method, content_type, num_transforms, width,
+                                      num_requests, num_alloc_requests)
+                report['results'].append(result)
+                print('%-50s %10.1f req/s   p50 %.3f ms   p99 %.3f ms   %8.0f B/req' % (scenario_label(result),
+                                                                                       result['requests_per_second'],
+                                                                                       result['latency']['p50_ms'],
+                                                                                       result['latency']['p99_ms'],
+                                                                                       result['allocations']['bytes_per_op']))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    benchutils.write_report(report, output_filename)
+    print('benchmark report written to %s' % output_filename)
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
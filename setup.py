@@ -13,14 +13,17 @@ NAME = 'snap'
 VERSION = '0.9.55'
 PACKAGES = find_packages(where='src')
 DEPENDENCIES=['docopt',
-              'Flask',
-              'itsdangerous',
-              'Jinja2',
-              'MarkupSafe',
+              'Flask>=3.1',
+              'itsdangerous>=2.2',
+              'Jinja2>=3.1',
+              'MarkupSafe>=3.0',
               'PyYAML',
-              'SQLAlchemy',
-              'Werkzeug',
+              'SQLAlchemy>=1.4.33',
+              'Werkzeug>=3.1',
               'requests']
+# faster JSON encoding, and MessagePack output; see snap.serialization
+EXTRAS={'orjson': ['orjson'],
+        'msgpack': ['msgpack']}
 
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
@@ -32,9 +35,10 @@ setup(
     author='Dexter Taylor',
     author_email='binarymachineshop@gmail.com',
     platforms=['any'],
-    scripts=['scripts/routegen', 'scripts/uwsgen', 'scripts/snapconfig'],
+    scripts=['scripts/routegen', 'scripts/uwsgen', 'scripts/snapconfig', 'scripts/snapserve', 'scripts/snapreplay'],
     packages=find_packages(),
     install_requires=DEPENDENCIES,
+    extras_require=EXTRAS,
     include_package_data=True,
     test_suite='tests',
     description=('Small Network Applications in Python: a microservices toolkit'),
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#
+# per-route admission control (concurrency limits and token-bucket rate limits)
+# for generated snap handlers
+#
+
+
+import os
+import math
+import json
+import threading
+from snap.core import clock
+from snap.snap import HTTP_SERVICE_UNAVAILABLE
+
+
+HTTP_TOO_MANY_REQUESTS = 429
+DEFAULT_RETRY_AFTER = 1
+ADMISSION_CONFIG_KEYS = ['max_concurrency', 'rate', 'burst', 'retry_after']
+
+
+class InvalidAdmissionConfigException(Exception):
+    def __init__(self, route_name, key):
+        Exception.__init__(self, 'Unknown admission setting "%s" for transform "%s". Valid settings are %s.'
+                           % (key, route_name, ', '.join(ADMISSION_CONFIG_KEYS)))
+
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+
+    def try_acquire(self):
+        '''Take one token. Returns 0 on success, or the number of seconds until
+        a token will be available.
+        '''
+        with self._lock:
+            now = clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+
+class AdmissionRejection(object):
+    def __init__(self, route_name, status_code, retry_after, reason):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = 'Request to "%s" rejected: %s.' % (route_name, reason)
+
+
+    @property
+    def headers(self):
+        return {'Retry-After': str(self.retry_after)}
+
+
+    @property
+    def body(self):
+        return json.dumps({'error_message': self.message, 'error_code': self.status_code})
+
+
+
+class AdmissionController(object):
+    '''Decides, before any request body is read, whether a route can take
+    another request. Rate-limited requests are rejected with a 429 and requests
+    over the concurrency limit with a 503, both carrying a Retry-After value.
+    '''
+
+    def __init__(self, route_name, max_concurrency=None, rate=None, burst=None, retry_after=DEFAULT_RETRY_AFTER):
+        self.route_name = route_name
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_rate_limited = 0
+        self.rejected_over_capacity = 0
+        self._lock = threading.Lock()
+
+
+    def admit(self):
+        '''Returns None if the request is admitted (in which case the caller must
+        call release() when it is done), otherwise an AdmissionRejection.
+        Capacity is checked first, so that a request turned away with a 503
+        does not use up a rate token.
+        '''
+        with self._lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.rejected_over_capacity += 1
+                return AdmissionRejection(self.route_name,
+                                          HTTP_SERVICE_UNAVAILABLE,
+                                          self.retry_after,
+                                          'too many concurrent requests')
+            wait_time = self.bucket.try_acquire() if self.bucket else 0
+            if wait_time:
+                self.rejected_rate_limited += 1
+                return AdmissionRejection(self.route_name,
+                                          HTTP_TOO_MANY_REQUESTS,
+                                          max(1, int(math.ceil(wait_time))),
+                                          'rate limit exceeded')
+            self.in_flight += 1
+            self.admitted += 1
+        return None
+
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+    def release_after(self, body):
+        '''Wraps a streamed response body so that the request keeps its slot
+        until the body has been sent (or the client has gone away).
+        '''
+        return StreamingRelease(self, body)
+
+
+    def stats(self):
+        return {'admitted': self.admitted,
+                'in_flight': self.in_flight,
+                'rejected_rate_limited': self.rejected_rate_limited,
+                'rejected_over_capacity': self.rejected_over_capacity}
+
+
+
+class StreamingRelease(object):
+    def __init__(self, controller, body):
+        self.controller = controller
+        self.body = body
+        self._released = False
+        self._lock = threading.Lock()
+
+
+    def __iter__(self):
+        try:
+            for chunk in self.body:
+                yield chunk
+        finally:
+            self.close()
+
+
+    def close(self):
+        # the WSGI server calls close() whether or not the body was iterated
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        self.controller.release()
+
+
+
+class AdmissionRegistry(object):
+    def __init__(self):
+        self.controllers = {}
+
+
+    def register(self, route_name, **kwargs):
+        for key in kwargs:
+            if key not in ADMISSION_CONFIG_KEYS:
+                raise InvalidAdmissionConfigException(route_name, key)
+        controller = AdmissionController(route_name, **kwargs)
+        self.controllers[route_name] = controller
+        return controller
+
+
+    def stats(self):
+        '''Counters for every route. They are per process, so under a prefork
+        server each worker reports its own (tagged with its pid).
+        '''
+        return {'pid': os.getpid(),
+                'routes': dict((name, c.stats()) for name, c in self.controllers.items())}
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+#
+# production traffic capture, and replay of captured traffic for offline
+# performance testing
+#
+# With a capture section in the config file, generated routing modules record
+# a sample of their requests (unless the section sets enabled: false):
+#
+#   capture:
+#       enabled:        true
+#       directory:      /var/tmp/myservice-capture
+#       sample_rate:    0.01
+#       max_bytes:      50M
+#       backup_count:   5
+#       headers:
+#           - Accept
+#           - X-Snap-Timeout
+#
+# Each worker process appends one JSON record per sampled request to its own
+# log file (capture.<pid>.ndjson), which is rotated when it reaches max_bytes.
+# The snapreplay script sends the records back to a running app and reports
+# latency percentiles.
+#
+
+
+import os
+import glob
+import json
+import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from snap import core
+from snap import common
+
+
+CAPTURE_CONFIG_KEYS = ['enabled', 'directory', 'sample_rate', 'max_bytes', 'backup_count', 'headers']
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_CAPTURE_HEADERS = ['Content-Type', 'Accept', core.DEADLINE_HEADER]
+CAPTURE_FILENAME_TEMPLATE = 'capture.%d.ndjson'
+PERCENTILES = [50, 90, 99]
+
+
+class InvalidCaptureConfigException(Exception):
+    def __init__(self, key):
+        Exception.__init__(self, 'Unrecognized setting "%s" in the capture section; valid settings are %s.'
+                           % (key, ', '.join(CAPTURE_CONFIG_KEYS)))
+
+
+class MissingCaptureDirectoryException(Exception):
+    def __init__(self):
+        Exception.__init__(self, 'The capture section requires a "directory" setting.')
+
+
+def load_capture_settings(yaml_config):
+    '''Validate the capture section of a config file, returning its settings
+    (or None if there is no capture section, or it is not enabled).
+    '''
+    capture_segment = yaml_config.get('capture')
+    if not capture_segment:
+        return None
+    for key in capture_segment:
+        if key not in CAPTURE_CONFIG_KEYS:
+            raise InvalidCaptureConfigException(key)
+    if not capture_segment.get('enabled', True):
+        return None
+    if not capture_segment.get('directory'):
+        raise MissingCaptureDirectoryException()
+    settings = dict(capture_segment)
+    settings.pop('enabled', None)
+    return settings
+
+
+
+class TrafficRecorder(object):
+    '''Records a random sample (sample_rate, 0 to 1) of transform calls, one
+    JSON line per call: time, transform name, method and path, decoded input,
+    the configured headers, response status and latency in milliseconds.
+    '''
+
+    def __init__(self, directory, sample_rate=DEFAULT_SAMPLE_RATE, max_bytes=DEFAULT_MAX_BYTES,
+                 backup_count=DEFAULT_BACKUP_COUNT, headers=None):
+        self.directory = common.load_config_var(directory)
+        self.sample_rate = float(sample_rate)
+        self.max_bytes = core.parse_size(max_bytes) or DEFAULT_MAX_BYTES
+        self.backup_count = int(backup_count)
+        self.headers = headers if headers is not None else DEFAULT_CAPTURE_HEADERS
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+
+    @property
+    def filename(self):
+        return os.path.join(self.directory, CAPTURE_FILENAME_TEMPLATE % os.getpid())
+
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+    def _open(self):
+        # each prefork worker writes its own file, opened after the fork
+        if self._file is None or self._pid != os.getpid():
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.filename, 'a')
+            self._pid = os.getpid()
+        return self._file
+
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        filename = self.filename
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d' % (filename, index)):
+                os.replace('%s.%d' % (filename, index), '%s.%d' % (filename, index + 1))
+        if self.backup_count > 0:
+            os.replace(filename, '%s.1' % filename)
+        else:
+            os.remove(filename)
+
+
+    def record(self, transform_name, http_request, input_data, transform_status, elapsed):
+        '''Record one call, if it is in the sample. elapsed is in seconds.'''
+        if not self.sampled():
+            return
+        status_code = core.HTTP_OK if transform_status.ok else transform_status.get_error_code()
+        record = {'time': time.time(),
+                  'transform': transform_name,
+                  'method': http_request.method,
+                  'path': http_request.path,
+                  'input': input_data,
+                  'headers': dict((name, http_request.headers[name]) for name in self.headers
+                                  if name in http_request.headers),
+                  'status': status_code,
+                  'latency_ms': round(elapsed * 1000, 3)}
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+
+        with self._lock:
+            capture_file = self._open()
+            capture_file.write(line)
+            capture_file.flush()
+            if capture_file.tell() >= self.max_bytes:
+                self._rotate()
+
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+
+
+def read_capture(paths):
+    '''Load the records from capture files (or directories of them), merged
+    across workers and rotated files and ordered by the time they were
+    recorded, so that a replay is the same every time.
+    '''
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(glob.glob(os.path.join(path, 'capture.*.ndjson*')))
+        else:
+            filenames.append(path)
+
+    records = []
+    for filename in sorted(set(filenames)):
+        with open(filename) as capture_file:
+            for line in capture_file:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, int(math.ceil(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def latency_summary(latencies_ms):
+    values = sorted(latencies_ms)
+    summary = {'count': len(values), 'max': values[-1] if values else None}
+    for pct in PERCENTILES:
+        summary['p%d' % pct] = percentile(values, pct)
+    return summary
+
+
+
+def replay_body(record):
+    '''The request arguments which re-encode a captured record's input in its
+    recorded Content-Type: form fields for urlencoded and multipart requests,
+    and otherwise a JSON body (which is what the text/plain decoder reads, too).
+    Uploaded files are not captured, so a multipart replay sends their
+    recorded names as plain fields.
+    '''
+    headers = dict(record.get('headers') or {})
+    content_type = None
+    for name in list(headers):
+        if name.lower() == 'content-type':
+            content_type = headers.pop(name)
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+
+    if mimetype == 'application/x-www-form-urlencoded':
+        return {'data': record['input'], 'headers': headers}
+    if mimetype == 'multipart/form-data':
+        # the client library writes the header, with its own boundary
+        return {'files': dict((name, (None, value if isinstance(value, str) else json.dumps(value)))
+                              for name, value in record['input'].items()),
+                'headers': headers}
+    headers['Content-Type'] = content_type or 'application/json'
+    return {'data': json.dumps(record['input']), 'headers': headers}
+
+
+def http_sender(base_url, timeout=30):
+    '''Returns a function which sends a captured record to the app at base_url
+    (GET and DELETE input as query params, anything else as a body in the
+    recorded Content-Type; see replay_body) and returns the response status.
+    '''
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=64)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    base_url = base_url.rstrip('/')
+
+    def send(record):
+        url = base_url + record['path']
+        if record['method'] in ('GET', 'DELETE'):
+            response = session.request(record['method'], url, params=record['input'],
+                                       headers=dict(record.get('headers') or {}), timeout=timeout)
+        else:
+            response = session.request(record['method'], url, timeout=timeout, **replay_body(record))
+        return response.status_code
+    return send
+
+
+
+class ReplayResult(object):
+    def __init__(self):
+        self.latencies = {}         # transform name -> replayed latencies (ms)
+        self.recorded = {}          # transform name -> captured latencies (ms)
+        self.statuses = {}
+        self.errors = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+
+    def add(self, record, status, latency_ms):
+        with self._lock:
+            self.latencies.setdefault(record['transform'], []).append(latency_ms)
+            self.recorded.setdefault(record['transform'], []).append(record.get('latency_ms') or 0)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status is None:
+                self.errors += 1
+
+
+    def summary(self):
+        all_latencies = [latency for values in self.latencies.values() for latency in values]
+        all_recorded = [latency for values in self.recorded.values() for latency in values]
+        count = len(all_latencies)
+        return {'requests': count,
+                'errors': self.errors,
+                'elapsed': self.elapsed,
+                'throughput': count / self.elapsed if self.elapsed else None,
+                'statuses': dict((str(status), n) for status, n in self.statuses.items()),
+                'replayed': latency_summary(all_latencies),
+                'recorded': latency_summary(all_recorded),
+                'transforms': dict((name, {'replayed': latency_summary(values),
+                                           'recorded': latency_summary(self.recorded[name])})
+                                   for name, values in self.latencies.items())}
+
+
+
+def replay(records, send, rate=None, concurrency=1):
+    '''Send each record (in order) with send(record), which returns a status
+    code. With a rate (requests per second) the records are sent on a fixed
+    schedule, whether or not earlier ones have completed, by up to concurrency
+    threads; otherwise concurrency threads send them back to back. Exceptions
+    raised by send count as errors.
+    '''
+    result = ReplayResult()
+    concurrency = max(1, int(concurrency))
+
+    def timed_send(record, scheduled_at=None):
+        if scheduled_at is not None:
+            delay = scheduled_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        started = time.time()
+        try:
+            status = send(record)
+        except Exception:
+            status = None
+        result.add(record, status, (time.time() - started) * 1000)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate:
+            interval = 1.0 / float(rate)
+            # latency is measured from when a request is actually sent, so a
+            # saturated pool shows up as lower throughput rather than as latency
+            for index, record in enumerate(records):
+                pool.submit(timed_send, record, started + index * interval)
+        else:
+            for record in records:
+                pool.submit(timed_send, record)
+    result.elapsed = time.time() - started
+    return result
+
+
+
+def format_report(summary):
+    lines = ['replayed %d requests in %.2f s (%.1f req/s), %d errors'
+             % (summary['requests'], summary['elapsed'], summary['throughput'] or 0, summary['errors']),
+             'statuses: %s' % ', '.join('%s=%d' % item for item in sorted(summary['statuses'].items())),
+             '',
+             '%-24s %8s %10s %10s %10s %10s' % ('latency (ms)', 'count', 'p50', 'p90', 'p99', 'max')]
+
+    def row(label, stats):
+        values = [stats['p50'], stats['p90'], stats['p99'], stats['max']]
+        return '%-24s %8d %s' % (label, stats['count'],
+                                 ' '.join('%10.1f' % v if v is not None else '%10s' % '-' for v in values))
+
+    lines.append(row('all (replayed)', summary['replayed']))
+    lines.append(row('all (recorded)', summary['recorded']))
+    for name, stats in sorted(summary['transforms'].items()):
+        lines.append(row('%s (replayed)' % name, stats['replayed']))
+        lines.append(row('%s (recorded)' % name, stats['recorded']))
+    return '\n'.join(lines)
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
 
-import yaml
 import os
-import jinja2
 from os.path import expanduser
 import json
+import functools
+import threading
 
 # cross-compatible string type checking for python 2 and 3
 try:
@@ -41,6 +41,7 @@ def read_config_file(filename):
     '''Load a YAML initfile by name, returning a dictionary of its contents
 
     '''
+    import yaml
     config = None
     with open(filename, 'r') as filehandle:
         config = yaml.load(filehandle)
@@ -94,19 +95,111 @@ def jsonpretty(data_dict):
     return json.dumps(data_dict, indent=4, sort_keys=True)
 
 
+# set by snap.setup when the app runs in server mode without debug; template
+# managers which were not told otherwise stop checking templates for changes
+_production_mode = False
+
+
+def set_production_mode(is_production):
+    global _production_mode
+    _production_mode = bool(is_production)
+
+
+def is_production_mode():
+    return _production_mode
+
+
+# functions run in each snap server worker just after it is forked (see
+# snap.server), for per-process state such as background threads
+_worker_start_hooks = []
+
+
+def on_worker_start(func):
+    _worker_start_hooks.append(func)
+    return func
+
+
+def run_worker_start_hooks():
+    for func in _worker_start_hooks:
+        func()
+
+
+
 class JinjaTemplateManager(object):
-    def __init__(self, j2_environment):
+    def __init__(self, j2_environment, auto_reload=None):
         self.environment = j2_environment
+        self.auto_reload = auto_reload
+        self._configured = False
 
 
     def get_template(self, filename):
+        if not self._configured:
+            # decided on first use, since transform modules (and their template
+            # managers) are imported before snap.setup has read the config
+            if self.auto_reload is None:
+                self.environment.auto_reload = not is_production_mode()
+            else:
+                self.environment.auto_reload = self.auto_reload
+            self._configured = True
         return self.environment.get_template(filename)
 
 
+    def render(self, filename, **kwargs):
+        return self.get_template(filename).render(**kwargs)
+
+
+    def stream(self, filename, buffer_size=None, **kwargs):
+        '''Render a template incrementally. The result is an iterable of strings
+        which can be returned as a transform's output data, so that a large
+        page is sent as it renders instead of being built in memory first.
+        '''
+        template_stream = self.get_template(filename).stream(**kwargs)
+        if buffer_size:
+            template_stream.enable_buffering(buffer_size)
+        return template_stream
+
+
 
-def get_template_mgr_for_location(directory):
+def precompile_templates(directory, target_directory):
+    '''Compile every template under <directory> to Python modules in
+    <target_directory>, for use as get_template_mgr_for_location(precompiled_dir=...).
+    '''
+    import jinja2
     j2env = jinja2.Environment(loader=jinja2.FileSystemLoader(directory))
-    return JinjaTemplateManager(j2env)
+    j2env.compile_templates(target_directory, zip=None)
+    return target_directory
+
+
+
+def get_template_mgr_for_location(directory, bytecode_cache_dir=None, precompiled_dir=None, auto_reload=None):
+    '''A template manager for the templates in <directory>.
+
+    bytecode_cache_dir: compiled templates are cached as files here, so that
+    every worker on the host (and every restart) compiles a template only once.
+
+    precompiled_dir: load templates compiled ahead of time by
+    precompile_templates, falling back to <directory> for any not found there.
+
+    auto_reload: whether to check template files for changes; by default,
+    only when not in production mode.
+    '''
+    import jinja2
+    loader = jinja2.FileSystemLoader(directory)
+    if precompiled_dir:
+        loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(precompiled_dir), loader])
+
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        try:
+            os.makedirs(bytecode_cache_dir)
+        except OSError:
+            # already there (possibly just created by another worker)
+            if not os.path.isdir(bytecode_cache_dir):
+                raise
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+    j2env = jinja2.Environment(loader=loader, bytecode_cache=bytecode_cache)
+    return JinjaTemplateManager(j2env, auto_reload)
 
 
 class LocalEnvironment(object):
@@ -195,9 +288,17 @@ class KeywordArgReader(object):
         return self.values.get(name)
 
 
+DEFAULT_GATHER_WORKERS = 16
+
+
 class ServiceObjectRegistry():
-    def __init__(self, service_object_dictionary):
+    def __init__(self, service_object_dictionary, max_gather_workers=None):
         self.services = service_object_dictionary
+        # threads in the pool shared by every scatter_gather call in the process
+        self.max_gather_workers = int(max_gather_workers or DEFAULT_GATHER_WORKERS)
+        self._gather_pool = None
+        self._gather_pid = None
+        self._gather_lock = threading.Lock()
 
 
     def lookup(self, service_object_name):
@@ -206,3 +307,27 @@ class ServiceObjectRegistry():
             raise UnregisteredServiceObjectException(service_object_name)
         return sobj
 
+
+    def call(self, service_object_name, method_name, *args, **kwargs):
+        '''A deferred call of a service object's method, for scatter_gather.'''
+        return functools.partial(getattr(self.lookup(service_object_name), method_name), *args, **kwargs)
+
+
+    def _get_gather_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with self._gather_lock:
+            # pool threads do not survive a fork, so each worker process makes its own
+            if self._gather_pool is None or self._gather_pid != os.getpid():
+                self._gather_pool = ThreadPoolExecutor(max_workers=self.max_gather_workers,
+                                                       thread_name_prefix='snap-gather')
+                self._gather_pid = os.getpid()
+            return self._gather_pool
+
+
+    def scatter_gather(self, calls, timeout=None):
+        '''Run independent service calls concurrently and collect their results;
+        see snap.gather.scatter_gather.
+        '''
+        from snap import gather
+        return gather.scatter_gather(self._get_gather_pool(), calls, timeout)
+
@@ -62,29 +62,64 @@ error_handlers:
           tx_status_code:       HTTP_BAD_REQUEST
 """
 
+# exception handlers registered by every generated routing module, as
+# (exception type, name of the snap.HTTP_* status code) pairs
+ROUTE_ERROR_CODES = [
+    ('snap.NullTransformInputDataException', 'HTTP_BAD_REQUEST'),
+    ('snap.MissingInputFieldException', 'HTTP_BAD_REQUEST'),
+    ('snap.TransformNotImplementedException', 'HTTP_NOT_IMPLEMENTED'),
+    ('core.TransformQueueFullException', 'HTTP_SERVICE_UNAVAILABLE'),
+    ('core.TransformTimeoutException', 'HTTP_GATEWAY_TIMEOUT')
+]
+
 ROUTES = """
 #!/usr/bin/env python
 
 #
 # Generated Flask routing module for SNAP microservice framework
 #
+{%- if compiled %}
+# Compiled: the config, data shapes, error codes and service wiring below were
+# resolved when this module was generated. Regenerate it after changing the
+# YAML config; the config file is not read at startup.
+#
+{%- endif %}
 
 
 
-from flask import Flask, request, Response
+from flask import Flask, request, Response, stream_with_context
 from snap import snap
 from snap import core
-import logging
+from snap import admission
+from snap import serialization
+{%- if capture %}
+from snap import capture
+{%- endif %}
+{%- if job_settings %}
+from snap import jobs
+{%- endif %}
 import json
-import argparse
 import sys
 from snap.loggers import request_logger as log
 
 sys.path.append('{{ project_dir }}')
 
-{%- if transform_module %}
+{%- if transform_module and not lazy_transform_import %}
 import {{ transform_module }} 
 {%- endif %}
+{%- if compiled %}
+{%- for module_name, alias in service_modules %}
+import {{ module_name }}{{ ' as %s' % alias if alias != module_name }}
+{%- endfor %}
+
+COMPILED_CONFIG = {{ compiled_config }}
+
+SERVICE_SPECS = {
+{%- for spec in service_specs %}
+    '{{ spec.name }}': ({{ spec.module_alias }}.{{ spec.classname }}, {{ spec.init_params }}),
+{%- endfor %}
+}
+{%- endif %}
 
 f_runtime = Flask(__name__)
 
@@ -96,28 +131,35 @@ else:
     print('starting SNAP microservice in wsgi mode...')
     f_runtime.config['startup_mode'] = 'server'
 
+{%- if compiled %}
+app = snap.setup_compiled(f_runtime, COMPILED_CONFIG, SERVICE_SPECS)
+
+#-- snap exception handlers ---
+
+xformer = core.Transformer(app.config.get('services'), error_table={{ error_table }})
+
+#------------------------------
+{%- else %}
 app = snap.setup(f_runtime)
 xformer = core.Transformer(app.config.get('services'))
 
 
 #-- snap exception handlers ---
-
-xformer.register_error_code(snap.NullTransformInputDataException, snap.HTTP_BAD_REQUEST)
-xformer.register_error_code(snap.MissingInputFieldException, snap.HTTP_BAD_REQUEST)
-xformer.register_error_code(snap.TransformNotImplementedException, snap.HTTP_NOT_IMPLEMENTED)
+{% for exception_type, code_name in error_codes %}
+xformer.register_error_code({{ exception_type }}, snap.{{ code_name }})
+{%- endfor %}
 
 #------------------------------
+{%- endif %}
 
 
 
 #-- snap data shapes ----------
 
-{% for transform in transforms.values() %}
-{{ transform.input_shape.name }} = core.InputShape("{{transform.input_shape.name}}")
-{%- for field in transform.input_shape.fields %}
-{{ transform.input_shape.name }}.add_field('{{ field.name }}', {{ field.is_required }})
+{% for shape in transforms.values()|map(attribute='input_shape')|unique(attribute='name') %}
+{{ shape.name }} = core.InputShape('{{ shape.name }}', [
+{%- for field in shape.fields %}('{{ field.name }}', {{ field.is_required }}){{ ', ' if not loop.last }}{% endfor %}])
 {%- endfor %}
-{% endfor %}
 
 #------------------------------
 
@@ -125,20 +167,86 @@ xformer.register_error_code(snap.TransformNotImplementedException, snap.HTTP_NOT
 #-- snap transform loading ----
 
 {%- for transform in transforms.values() %}
-xformer.register_transform('{{transform.name}}', {{ transform.input_shape.name }}, {{ transform.function_name }}, '{{ transform.output_type }}')
+{%- if transform.pipeline %}
+{{ transform.name }}_action = xformer.register_pipeline('{{transform.name}}', {{ transform.input_shape.name }}, {{ transform.pipeline }}, '{{ transform.output_type }}'
+{%- elif lazy_transform_import and transform_module %}
+{{ transform.name }}_action = xformer.register_transform('{{transform.name}}', {{ transform.input_shape.name }}, core.LazyFunction('{{ transform_module }}', '{{ transform.name }}_func'), '{{ transform.output_type }}'
+{%- else %}
+{{ transform.name }}_action = xformer.register_transform('{{transform.name}}', {{ transform.input_shape.name }}, {{ transform.function_name }}, '{{ transform.output_type }}'
+{%- endif %}
+{%- if transform.executor != 'inline' %},
+                           executor=core.create_executor('{{ transform.name }}',
+                                                         '{{ transform.executor }}',
+                                                         max_workers={{ transform.max_workers }},
+                                                         max_queue={{ transform.max_queue }})
+{%- endif %}
+{%- if transform.single_flight %},
+                           single_flight=True
+{%- endif %}
+{%- if transform.timeout %},
+                           timeout={{ transform.timeout }}
+{%- endif %})
 {%- endfor %}
 
 #------------------------------
 
 
+#-- snap admission control ----
+
+admission_controllers = admission.AdmissionRegistry()
+{%- for t in transforms.values() %}
+{%- if t.admission %}
+{{ t.name }}_admission = admission_controllers.register('{{ t.name }}', **{{ t.admission }})
+{%- endif %}
+{%- endfor %}
+
+#------------------------------
+{%- if capture %}
+
+
+#-- snap traffic capture ------
+
+recorder = capture.TrafficRecorder(**{{ capture }})
+
+#------------------------------
+{%- endif %}
+{%- if job_settings %}
+
+
+#-- snap async jobs -----------
+
+job_queue = jobs.JobQueue(xformer, **{{ job_settings }})
+# standalone, this process runs jobs; under the snap prefork server, each worker
+# does (other servers' workers start their job threads on first use)
+job_queue.start_in_workers(start_now=(f_runtime.config['startup_mode'] == 'standalone'))
+
+#------------------------------
+{%- endif %}
+
+
 {% for t in transforms.values() %}
 @app.route('{{ t.route }}', methods=[{{ t.methods }}])
 def {{t.name}}({{ ','.join(t.route_variables) }}):
+    {%- if t.admission %}
+    rejection = {{ t.name }}_admission.admit()
+    if rejection:
+        return Response(rejection.body, status=rejection.status_code, mimetype='application/json', headers=rejection.headers)
+    streaming = False
+    {%- endif %}
     try:
+        {%- if capture %}
+        started = core.clock()
+        {%- endif %}
+        {%- if not compiled %}
         if app.debug:
             # dump request headers for easier debugging
             log.info('### HTTP request headers:')
             log.info(request.headers)
+        {%- elif debug %}
+        # dump request headers for easier debugging
+        log.info('### HTTP request headers:')
+        log.info(request.headers)
+        {%- endif %}
 
         input_data = {}
         {%- for route_variable in t.route_variables %}
@@ -146,39 +254,141 @@ def {{t.name}}({{ ','.join(t.route_variables) }}):
         {%- endfor %}
 
         {%- if t.methods == "'POST'" %}
-        request.get_data()
-        input_data.update(core.map_content(request))
-        
-        transform_status = xformer.transform('{{ t.name }}', input_data, headers=request.headers)
+        core.check_body_size(request, '{{ t.name }}', {{ t.max_body_size }})
+        {%- if t.mode != 'async' %}
+        if request.mimetype == core.MIMETYPE_NDJSON:
+            # bulk ingest: one transform call per line, each result streamed back as a line
+            results = stream_with_context(xformer.transform_ndjson({{ t.name + '_action' if compiled else "'%s'" % t.name }},
+                                                                   request.stream,
+                                                                   input_data,
+                                                                   max_body_size={{ t.max_body_size }},
+                                                                   headers=request.headers))
+            {%- if t.admission %}
+            # hold the admission slot until the whole stream has been sent
+            streaming = True
+            results = {{ t.name }}_admission.release_after(results)
+            {%- endif %}
+            return Response(results, status=snap.HTTP_OK, mimetype=core.MIMETYPE_NDJSON)
+        {%- endif %}
+
+        with core.SpooledRequest(request, '{{ t.name }}', {{ t.max_body_size }}) as request_body:
+            {%- if t.project_input %}
+            input_data.update(core.map_content(request_body, projection={{ t.input_shape.name }}.field_names()))
+            {%- else %}
+            input_data.update(core.map_content(request_body))
+            {%- endif %}
+
+            {%- if t.mode == 'async' %}
+            job = job_queue.submit({{ t.name }}_action, input_data, headers=request.headers)
+            {%- else %}
+            # uploaded files are closed with the request body, so transform inside the block
+            {%- if compiled %}
+            transform_status = xformer.run_action({{ t.name }}_action, input_data, headers=request.headers)
+            {%- else %}
+            transform_status = xformer.transform('{{ t.name }}', input_data, headers=request.headers)
+            {%- endif %}
+            {%- endif %}
         {%- elif t.methods == "'GET'" or t.methods == "'DELETE'" %}                
         input_data.update(request.args)
         
+        {%- if t.mode == 'async' %}
+        job = job_queue.submit({{ t.name }}_action,
+                               core.convert_multidict(input_data),
+                               headers=request.headers)
+        {%- elif compiled %}
+        transform_status = xformer.run_action({{ t.name }}_action,
+                                              core.convert_multidict(input_data),
+                                              headers=request.headers)
+        {%- else %}
         transform_status = xformer.transform('{{ t.name }}',
                                              core.convert_multidict(input_data),
                                              headers=request.headers)
+        {%- endif %}
         {%- else %}
         {%- endif %}        
+        {%- if t.mode == 'async' %}
+
+        reply = job_queue.accepted(job)
+        return Response(reply.body, status=reply.status_code, mimetype=reply.mimetype, headers=reply.headers)
+        {%- else %}
+        {%- if capture %}
+        recorder.record('{{ t.name }}', request, input_data, transform_status, core.clock() - started)
+        {%- endif %}
+        {%- if t.output_types|length > 1 %}
+        output_mimetype = serialization.negotiate(request, {{ t.name }}_action.output_mimetypes)
+        {%- elif compiled %}
+        output_mimetype = '{{ t.output_types[0] }}'
+        {%- else %}
         output_mimetype = xformer.target_mimetype_for_transform('{{ t.name }}')
+        {%- endif %}
 
         if transform_status.ok:
-            return Response(transform_status.output_data, status=snap.HTTP_OK, mimetype=output_mimetype)
+            return Response(serialization.encode(transform_status.output_data, output_mimetype),
+                            status=snap.HTTP_OK,
+                            {%- if t.output_types|length > 1 or t.pipeline %}
+                            headers={
+                                {%- if t.output_types|length > 1 %}'Vary': 'Accept'{{ ', ' if t.pipeline }}{% endif %}
+                                {%- if t.pipeline %}'Server-Timing': core.server_timing(transform_status.user_data['stage_timings']){% endif %}},
+                            {%- endif %}
+                            mimetype=output_mimetype)
         return Response(json.dumps(transform_status.user_data), 
                         status=transform_status.get_error_code() or snap.HTTP_DEFAULT_ERRORCODE, 
                         mimetype=output_mimetype) 
+        {%- endif %}
+    {%- if t.methods == "'POST'" %}
+    except core.RequestBodyTooLargeException as err:
+        return Response(json.dumps({'error_message': str(err), 'error_code': snap.HTTP_PAYLOAD_TOO_LARGE}),
+                        status=snap.HTTP_PAYLOAD_TOO_LARGE,
+                        mimetype='application/json')
+    except core.MalformedRequestBodyException as err:
+        return Response(json.dumps({'error_message': str(err), 'error_code': snap.HTTP_BAD_REQUEST}),
+                        status=snap.HTTP_BAD_REQUEST,
+                        mimetype='application/json')
+    {%- endif %}
+    {%- if t.mode == 'async' %}
+    except (core.MissingInputFieldException, jobs.UnsupportedJobInputException) as err:
+        # refused now, rather than queued to fail later
+        return Response(json.dumps({'error_message': str(err), 'error_code': snap.HTTP_BAD_REQUEST}),
+                        status=snap.HTTP_BAD_REQUEST,
+                        mimetype='application/json')
+    {%- endif %}
     except Exception as err:
         log.error("Exception thrown: ", exc_info=1)        
         raise err
+    {%- if t.admission %}
+    finally:
+        if not streaming:
+            {{ t.name }}_admission.release()
+    {%- endif %}
 
 {% endfor %}
 
+{%- if transforms.values()|selectattr('admission')|list %}
+
+@app.route('/smp/admission', methods=['GET'])
+def smp_admission_stats():
+    return Response(json.dumps(admission_controllers.stats()), status=snap.HTTP_OK, mimetype='application/json')
+{%- endif %}
+{%- if job_settings %}
+
+@app.route('/smp/jobs/<string:job_id>', methods=['GET'])
+def smp_job(job_id):
+    reply = job_queue.poll(job_id)
+    return Response(reply.body, status=reply.status_code, mimetype=reply.mimetype, headers=reply.headers)
+{%- endif %}
+
 
 
 if __name__ == '__main__':
     #
-    # If we are loading from command line,
-    # run the Flask app explicitly
+    # If we are loading from command line, run the Flask dev server in debug mode;
+    # otherwise use the snap prefork server with the settings in the "server" section.
     #
-    app.run(host='{{bind_host}}', port={{port}})
+    if app.debug:
+        app.run(host='{{bind_host}}', port={{port}})
+    else:
+        from snap import server
+        server.serve(app, '{{bind_host}}', {{port}}, **app.config['server_settings'])
 
 """
 
@@ -187,15 +397,36 @@ NGINX_CONFIG = """
 # Generated nginx config file for snap endpoints via uWSGI
 #
 
+{%- set upstream_protocol = 'proxy' if tuning.keepalive_upstream else 'uwsgi' %}
+{%- set cache_zone = 'snap_cache' %}
+{%- macro upstream_pass() %}
+            {%- if tuning.keepalive_upstream %}
+            proxy_pass http://{{ nginx_config.name }}_app;
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
+            proxy_set_header Host $host;
+            proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+            proxy_buffer_size {{ tuning.buffer_size }};
+            proxy_read_timeout {{ tuning.harakiri }};
+            {%- else %}
+            include uwsgi_params;
+            uwsgi_pass {{ nginx_config.name }}_app;
+            uwsgi_buffer_size {{ tuning.buffer_size }};
+            uwsgi_read_timeout {{ tuning.harakiri }};
+            {%- endif %}
+{%- endmacro %}
+
 
 user  nobody;
-worker_processes  1;
+worker_processes  {{ tuning.nginx_worker_processes }};
+worker_rlimit_nofile  {{ tuning.worker_rlimit_nofile }};
 
 error_log  logs/error.log;
 pid        logs/nginx.pid;
 
 events {
-    worker_connections  1024;
+    worker_connections  {{ tuning.worker_connections }};
+    multi_accept  on;
 }
 
 
@@ -208,19 +439,50 @@ http {
                       '"$http_user_agent" "$http_x_forwarded_for"';
 
     access_log  logs/access.log  main;
-    tcp_nopush     on;
-    keepalive_timeout  0;
     sendfile        on;
-    client_max_body_size 75M;
-    #keepalive_timeout  65;
+    tcp_nopush      on;
+    tcp_nodelay     on;
+    keepalive_timeout  {{ tuning.keepalive_timeout }};
+    keepalive_requests  {{ tuning.keepalive_requests }};
+    client_max_body_size {{ tuning.client_max_body_size }};
+    {%- if edge_cache_rules %}
+
+    {{ upstream_protocol }}_cache_path {{ tuning.cache_path }} levels=1:2 keys_zone={{ cache_zone }}:{{ tuning.cache_zone_size }} max_size={{ tuning.cache_max_size }} inactive={{ tuning.cache_inactive }} use_temp_path=off;
+    {%- endif %}
+
+    upstream {{ nginx_config.name }}_app {
+        server unix:{{ nginx_config.uwsgi_sockfile }};
+        {%- if tuning.keepalive_upstream %}
+        keepalive {{ tuning.upstream_keepalive }};
+        {%- endif %}
+    }
 
     server {
-        listen       {{ nginx_config.port }};
+        listen       {{ nginx_config.port }} backlog={{ tuning.backlog }};
         server_name  {{ nginx_config.hostname }};
 
+        {%- for rule in edge_cache_rules %}
+
+        # edge cache for transform "{{ rule.transform_name }}"
+        location {{ rule.location_modifier }} {{ rule.location_match }} {
+            {{- upstream_pass() }}
+            {{ upstream_protocol }}_cache {{ cache_zone }};
+            {{ upstream_protocol }}_cache_key "{{ rule.cache_key }}";
+            {%- if rule.bypass_variables %}
+            {{ upstream_protocol }}_cache_bypass {{ rule.bypass_variables }};
+            {{ upstream_protocol }}_no_cache {{ rule.bypass_variables }};
+            {%- endif %}
+            {{ upstream_protocol }}_cache_valid 200 {{ rule.ttl }};
+            {{ upstream_protocol }}_cache_use_stale updating error timeout http_500 http_502 http_503 http_504;
+            {{ upstream_protocol }}_cache_background_update on;
+            {{ upstream_protocol }}_cache_lock on;
+            {{ upstream_protocol }}_cache_lock_timeout {{ tuning.cache_lock_timeout }};
+            add_header X-Cache-Status $upstream_cache_status;
+        }
+        {%- endfor %}
+
         location / {
-            include uwsgi_params;
-            uwsgi_pass unix:{{ nginx_config.uwsgi_sockfile }};
+            {{- upstream_pass() }}
         }
 
         # redirect server error pages to the static page /50x.html
@@ -302,7 +564,11 @@ home = {{ uwsgi_config.python_home }}
 pythonpath = %(base)
 
 #socket file's location
+{%- if tuning.keepalive_upstream %}
+http11-socket = {{ uwsgi_config.socket_dir }}/%n.sock
+{%- else %}
 socket = {{ uwsgi_config.socket_dir }}/%n.sock
+{%- endif %}
 
 #permissions for the socket file
 chmod-socket    = 666
@@ -312,4 +578,17 @@ callable = app
 
 #location of log files
 logto = {{ uwsgi_config.log_dir }}/%n.log
+
+#workers and request handling
+master = true
+processes = {{ tuning.processes }}
+threads = {{ tuning.threads }}
+enable-threads = true
+listen = {{ tuning.backlog }}
+buffer-size = {{ tuning.buffer_size }}
+harakiri = {{ tuning.harakiri }}
+max-requests = {{ tuning.max_requests }}
+{%- if tuning.lazy_apps %}
+lazy-apps = true
+{%- endif %}
 """
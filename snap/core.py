@@ -1,9 +1,18 @@
 #!/user/bin/env python
 
 from snap import common
-import argparse
+from snap import serialization
 import json
 import re
+import codecs
+import contextlib
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 
 
@@ -11,13 +20,30 @@ HTTP_OK = 200
 HTTP_BAD_REQUEST = 400
 HTTP_NOT_FOUND = 404
 HTTP_DEFAULT_ERRORCODE = 400
+HTTP_PAYLOAD_TOO_LARGE = 413
 HTTP_NOT_IMPLEMENTED = 500
+HTTP_GATEWAY_TIMEOUT = 504
 
 MIMETYPE_JSON = 'application/json'
+MIMETYPE_NDJSON = 'application/x-ndjson'
 CONFIG_FILE_ENV_VAR = 'BUTTONIZE_CFG'
 
 ROUTE_VARIABLE_REGEX = re.compile(r'<([a-zA-Z_-]+):([a-zA-Z_-]+)>')
 
+# request bodies larger than this are spooled to a temporary file instead of memory
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# a client may ask for a shorter time budget (in seconds) than the transform's own
+DEADLINE_HEADER = 'X-Snap-Timeout'
+
+try:
+    clock = time.monotonic
+except AttributeError:
+    clock = time.time
+
 
 class MissingDataStatus():
     def __init__(self, field_name):
@@ -53,6 +79,51 @@ class ContentDecodingException(Exception):
         Exception.__init__(self, 'No decoding function has been registered for content-type "%s".' % mime_type)
 
 
+class UnknownExecutorTypeException(Exception):
+    def __init__(self, executor_type):
+        Exception.__init__(self, 'Unknown transform executor type "%s". Valid executor types are %s.' 
+                           % (executor_type, ', '.join(EXECUTOR_TYPES)))
+
+
+class TransformQueueFullException(Exception):
+    def __init__(self, transform_name):
+        Exception.__init__(self, 'The executor for transform "%s" is at capacity; the request was rejected.' % transform_name)
+
+
+class TransformTimeoutException(Exception):
+    def __init__(self, transform_name, timeout):
+        Exception.__init__(self, 'Transform "%s" did not complete within its %.3f second time budget.' 
+                           % (transform_name, timeout))
+
+
+class PipelineStageOutputException(Exception):
+    def __init__(self, stage_name, output):
+        Exception.__init__(self, 'Pipeline stage "%s" returned %s; stages must output a JSON object (dict).'
+                           % (stage_name, output.__class__.__name__))
+
+
+class RequestBodyTooLargeException(Exception):
+    def __init__(self, transform_name, max_body_size):
+        Exception.__init__(self, 'The request body for transform "%s" exceeds the limit of %d bytes.' 
+                           % (transform_name, max_body_size))
+
+
+class MalformedRequestBodyException(ValueError):
+    '''A request body which cannot be decoded; generated routes answer it with a 400.'''
+    def __init__(self, reason):
+        ValueError.__init__(self, 'Failed to decode JSON object: %s' % reason)
+
+
+class RemoteTransformException(Exception):
+    '''Stands in for an exception raised by a transform running in a process pool.
+    The original exception type is kept by name, so that the Transformer's
+    error table still applies to it.
+    '''
+    def __init__(self, error_type, message):
+        Exception.__init__(self, message)
+        self.error_type = error_type
+
+
 def is_sequence(arg):
     return (not hasattr(arg, "strip") and
             hasattr(arg, "__getitem__") or
@@ -71,6 +142,10 @@ def convert_multidict(md):
 
 
 class ContentProtocol(object):
+    '''Maps request content types to decoder functions. POST bodies reach
+    decoders as a SpooledRequest, not a Flask request; see SpooledRequest for
+    the attributes available to them.
+    '''
     def __init__(self):
         self.decoding_map = {}        
 
@@ -82,18 +157,375 @@ class ContentProtocol(object):
 
     def decode(self, http_request):
         ctype = http_request.headers['Content-Type']
-        func = self.decoding_map.get(ctype)
+        # an exact match first, then the bare mimetype (without charset, boundary etc.)
+        func = self.decoding_map.get(ctype) or self.decoding_map.get(http_request.mimetype)
         if not func:
             raise ContentDecodingException(ctype)        
         return func(http_request)
 
     
 
+def parse_size(value):
+    '''A byte count from an int or a string such as "512K" or "10M".'''
+    if value is None or isinstance(value, int):
+        return value
+    value = str(value).strip().upper()
+    if value[-1:] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def check_body_size(http_request, transform_name, max_body_size):
+    '''Rejects an oversized upload from its Content-Length, before any of it is read.'''
+    if max_body_size and (http_request.content_length or 0) > max_body_size:
+        raise RequestBodyTooLargeException(transform_name, max_body_size)
+
+
+
+class SpooledRequest(object):
+    '''A request whose body has been copied, in chunks, into a buffer which
+    rolls over to a temporary file above spool_threshold bytes. It offers the
+    parts of the Flask request which decoders use (headers, mimetype, args,
+    data, get_data(), json, get_json(), form, files), with the body read from
+    the spooled stream; decoders in a custom ContentProtocol should stick to
+    these.
+
+    The size limit is enforced on the Content-Length up front and again while
+    copying, for chunked uploads which do not declare a length.
+    '''
+
+    def __init__(self, http_request, transform_name, max_body_size=None, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+        check_body_size(http_request, transform_name, max_body_size)
+        self.headers = http_request.headers
+        self.args = http_request.args
+        self.mimetype = http_request.mimetype
+        self.mimetype_params = http_request.mimetype_params
+        self.stream = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        self.spool_threshold = spool_threshold
+        self.content_length = 0
+        self._form = None
+
+        while True:
+            chunk = http_request.stream.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.content_length += len(chunk)
+            if max_body_size and self.content_length > max_body_size:
+                self.close()
+                raise RequestBodyTooLargeException(transform_name, max_body_size)
+            self.stream.write(chunk)
+        self.stream.seek(0)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        if self._form is not None:
+            for upload in self._form[1].values():
+                upload.close()
+        self.stream.close()
+
+
+    @property
+    def data(self):
+        self.stream.seek(0)
+        return self.stream.read()
+
+
+    @contextlib.contextmanager
+    def buffer(self):
+        '''The body as a bytes-like object: a read-only mmap of the spool file
+        once the body has been spooled to disk, so that it is not read into
+        memory, or the bytes of a small body.
+        '''
+        if self.content_length <= self.spool_threshold:
+            yield self.data
+            return
+        import mmap
+        self.stream.flush()
+        body = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield body
+        finally:
+            body.close()
+
+
+    def get_data(self, as_text=False):
+        data = self.data
+        return data.decode(self.charset) if as_text else data
+
+
+    @property
+    def charset(self):
+        return self.mimetype_params.get('charset', 'utf-8')
+
+
+    @property
+    def json(self):
+        # the body as JSON whatever its content type (the text/plain decoder relies on this)
+        return self.get_json(force=True)
+
+
+    def get_json(self, force=False, silent=False):
+        '''As Flask's: None unless the body is JSON (or force is set), and
+        None rather than a 400 for a malformed body if silent is set.
+        '''
+        if not self.content_length or not (force or self.mimetype == MIMETYPE_JSON or self.mimetype.endswith('+json')):
+            return None
+        try:
+            return json.loads(self.data.decode(self.charset))
+        except ValueError as err:
+            if silent:
+                return None
+            raise MalformedRequestBodyException(err)
+
+
+    def _parse_form(self):
+        if self._form is None:
+            from werkzeug.formparser import FormDataParser
+            self.stream.seek(0)
+            _, form, files = FormDataParser().parse(self.stream, self.mimetype, self.content_length, self.mimetype_params)
+            self._form = (form, files)
+        return self._form
+
+
+    @property
+    def form(self):
+        return self._parse_form()[0]
+
+
+    @property
+    def files(self):
+        return self._parse_form()[1]
+
+    
+
+# JSON syntax for project_json, which skips over the values of unwanted fields
+# with these patterns instead of decoding them. Repeated groups are bounded,
+# so that the regex engine never keeps backtracking state for a whole long
+# array or string: runs of scalar items are skipped a batch at a time, and
+# strings with many escapes are skipped by _skip_json_string.
+_JSON_WS = r'[ \t\n\r]*'
+_JSON_STRING_PART = r'[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*){0,%d}'
+_JSON_STRING = '"%s"' % (_JSON_STRING_PART % 64)
+_JSON_SCALAR = (_JSON_STRING + r'|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+                r'|true|false|null|NaN|-?Infinity')
+_JSON_RUN_LENGTH = 1024
+_JSON_SMALL_CONTAINER = 64
+
+
+def _json_small_containers(item):
+    # arrays and objects of up to _JSON_SMALL_CONTAINER items matching <item>
+    items = r'(?:%s)(?:%s,%s(?:%s)){0,%d}' % (item, _JSON_WS, _JSON_WS, item, _JSON_SMALL_CONTAINER - 1)
+    member = r'%s%s:%s(?:%s)' % (_JSON_STRING, _JSON_WS, _JSON_WS, item)
+    members = r'%s(?:%s,%s%s){0,%d}' % (member, _JSON_WS, _JSON_WS, member, _JSON_SMALL_CONTAINER - 1)
+    return r'\[%s(?:%s%s)?\]|\{%s(?:%s%s)?\}' % (_JSON_WS, items, _JSON_WS, _JSON_WS, members, _JSON_WS)
+
+# scalars, and small containers of scalars nested up to two deep, which the
+# patterns skip without returning to Python
+_JSON_ITEM = _JSON_SCALAR + '|' + _json_small_containers(_JSON_SCALAR + '|' + _json_small_containers(_JSON_SCALAR))
+
+# the groups of the value and delimiter patterns
+_JSON_ARRAY, _JSON_OBJECT, _JSON_LONG_STRING = 1, 2, 3
+_JSON_COMMA = 3
+
+
+class _JSONSyntax(object):
+    '''The project_json patterns, compiled for str or for bytes documents.'''
+
+    def __init__(self, kind):
+        def compile(pattern):
+            return re.compile(pattern if kind is str else pattern.encode('ascii'))
+
+        self.quote = '"' if kind is str else b'"'
+        self.whitespace = compile(_JSON_WS)
+        self.value = compile(r'(?:%s)|(\[)|(\{)|(")' % _JSON_ITEM)
+        self.string_part = compile(_JSON_STRING_PART % _JSON_RUN_LENGTH)
+        self.delimiter = compile(r'%s(?:(\])|(\})|(,))%s' % (_JSON_WS, _JSON_WS))
+        self.key = compile(r'(%s)%s:%s' % (_JSON_STRING, _JSON_WS, _JSON_WS))
+        self.colon = compile(r'%s:%s' % (_JSON_WS, _JSON_WS))
+        self.object_start = compile(r'%s\{%s' % (_JSON_WS, _JSON_WS))
+        self.empty = {_JSON_ARRAY: compile(_JSON_WS + r'\]'),
+                      _JSON_OBJECT: compile(_JSON_WS + r'\}')}
+        self.runs = {_JSON_ARRAY: compile(r'(?:(?:%s)%s,%s){0,%d}'
+                                          % (_JSON_ITEM, _JSON_WS, _JSON_WS, _JSON_RUN_LENGTH)),
+                     _JSON_OBJECT: compile(r'(?:%s%s:%s(?:%s)%s,%s){0,%d}'
+                                           % (_JSON_STRING, _JSON_WS, _JSON_WS, _JSON_ITEM, _JSON_WS, _JSON_WS,
+                                              _JSON_RUN_LENGTH))}
+
+
+_json_syntax = {str: _JSONSyntax(str), bytes: _JSONSyntax(bytes)}
+_json_decoder = json.JSONDecoder()
+
+
+def _skip_json_string(text, pos, syntax):
+    # the position just past the string whose opening quote is at <pos>
+    start = pos
+    pos += 1
+    while True:
+        end = syntax.string_part.match(text, pos).end()
+        if text[end:end + 1] == syntax.quote:
+            return end + 1
+        if end == pos:
+            raise ValueError('unterminated or invalid string at %d' % start)
+        pos = end
+
+
+def _skip_json_key(text, pos, syntax):
+    # (the position just past a field name, the position of its value)
+    match = syntax.key.match(text, pos)
+    if match:
+        return match.end(1), match.end()
+    if text[pos:pos + 1] != syntax.quote:
+        raise ValueError('expected a field name at %d' % pos)
+    end = _skip_json_string(text, pos, syntax)
+    match = syntax.colon.match(text, end)
+    if not match:
+        raise ValueError('expected ":" at %d' % end)
+    return end, match.end()
+
+
+def _skip_json_item(text, pos, container, syntax):
+    # the position of the next value in a container, past its field name in an object
+    while True:
+        end = syntax.runs[container].match(text, pos).end()
+        if end == pos:
+            break
+        pos = end
+    if container == _JSON_OBJECT:
+        pos = _skip_json_key(text, pos, syntax)[1]
+    return pos
+
+
+def _skip_json_value(text, pos, syntax):
+    '''The position just past the JSON value starting at <pos>. The value is
+    checked against the JSON grammar but not built.
+    '''
+    containers = []
+    while True:
+        match = syntax.value.match(text, pos)
+        if not match:
+            raise ValueError('expected a value at %d' % pos)
+        pos = match.end()
+        if match.lastindex == _JSON_LONG_STRING:
+            pos = _skip_json_string(text, match.start(), syntax)
+        elif match.lastindex:
+            container = match.lastindex
+            empty = syntax.empty[container].match(text, pos)
+            if empty:
+                pos = empty.end()
+            else:
+                containers.append(container)
+                pos = _skip_json_item(text, syntax.whitespace.match(text, pos).end(), container, syntax)
+                continue
+
+        while containers:
+            match = syntax.delimiter.match(text, pos)
+            if not match or match.lastindex not in (_JSON_COMMA, containers[-1]):
+                raise ValueError('expected "," or "%s" at %d' % (']' if containers[-1] == _JSON_ARRAY else '}', pos))
+            pos = match.end()
+            if match.lastindex == _JSON_COMMA:
+                pos = _skip_json_item(text, pos, containers[-1], syntax)
+                break
+            containers.pop()
+        else:
+            return pos
+
+
+def _decode_json_value(text, pos, syntax):
+    if isinstance(text, str):
+        return _json_decoder.raw_decode(text, pos)
+    end = _skip_json_value(text, pos, syntax)
+    return json.loads(text[pos:end]), end
+
+
+def project_json(text, field_names):
+    '''Decodes only the named top-level fields of the JSON object in <text>
+    (a str, or UTF-8 bytes or a buffer such as an mmap). It accepts exactly the
+    documents json.loads accepts, and a field which appears twice takes its
+    last value, as with json.loads. The values of all other fields are checked
+    but skipped over without being built.
+    '''
+    syntax = _json_syntax[str if isinstance(text, str) else bytes]
+    wanted = set(field_names)
+    result = {}
+    pos = 0
+    if not isinstance(text, str) and text[:3] == codecs.BOM_UTF8:
+        pos = 3
+    match = syntax.object_start.match(text, pos)
+    if not match:
+        raise ValueError('expected a JSON object')
+    pos = match.end()
+    empty = syntax.empty[_JSON_OBJECT].match(text, pos)
+    if empty:
+        pos = empty.end()
+    else:
+        while True:
+            key_end, value_pos = _skip_json_key(text, pos, syntax)
+            key = json.loads(text[pos:key_end])
+            pos = value_pos
+            if key in wanted:
+                result[key], pos = _decode_json_value(text, pos, syntax)
+            else:
+                pos = _skip_json_value(text, pos, syntax)
+
+            match = syntax.delimiter.match(text, pos)
+            if not match or match.lastindex == _JSON_ARRAY:
+                raise ValueError('expected "," or "}" at %d' % pos)
+            pos = match.end()
+            if match.lastindex == _JSON_OBJECT:
+                break
+
+    pos = syntax.whitespace.match(text, pos).end()
+    if pos != len(text):
+        raise ValueError('extra data at %d' % pos)
+    return result
+
+
+def check_utf8(buffer, chunk_size=SPOOL_CHUNK_SIZE):
+    '''Raises UnicodeDecodeError unless <buffer> is valid UTF-8, decoding it a
+    chunk at a time so that the whole body is never held as a str.
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for offset in range(0, len(buffer), chunk_size):
+        decoder.decode(buffer[offset:offset + chunk_size])
+    decoder.decode(b'', final=True)
+
+
 def decode_json(http_request):
     return http_request.json
 
 
+def decode_json_projected(http_request, field_names):
+    charset = (getattr(http_request, 'charset', None) or 'utf-8').lower()
+    try:
+        if charset not in ('utf-8', 'utf8'):
+            body = http_request.get_data(as_text=True)
+            return project_json(body, field_names) if body else {}
+        if isinstance(http_request, SpooledRequest):
+            with http_request.buffer() as body:
+                if not len(body):
+                    return {}
+                check_utf8(body)
+                return project_json(body, field_names)
+        body = http_request.get_data()
+        if not body:
+            return {}
+        check_utf8(body)
+        return project_json(body, field_names)
+    except ValueError as err:
+        raise MalformedRequestBodyException(err)
+
+
 def decode_text_plain(http_request):
+    if isinstance(http_request, SpooledRequest):
+        return http_request.json or {}
     if http_request.data:
         return json.loads(http_request.data)
     return {}
@@ -103,16 +535,83 @@ def decode_form_urlenc(http_request):
     return convert_multidict(http_request.form)
 
 
+def decode_multipart(http_request):
+    '''Form fields as strings; uploaded files as werkzeug FileStorage objects,
+    whose contents stay on disk (or in memory, if small) until read.
+    '''
+    form = http_request.form
+    input_data = dict((name, ','.join(form.getlist(name))) for name in form)
+    for name in http_request.files:
+        input_data[name] = http_request.files[name]
+    return input_data
+
+
 default_content_protocol = ContentProtocol()
 default_content_protocol.update('application/json', decode_json)
 default_content_protocol.update('text/plain', decode_text_plain)
 default_content_protocol.update('application/x-www-form-urlencoded', decode_form_urlenc)
 default_content_protocol.update('text/plain; charset=UTF-8', decode_text_plain)
-
-def map_content(http_request):
+default_content_protocol.update('multipart/form-data', decode_multipart)
+
+def map_content(http_request, projection=None):
+    '''Decode a request body. If <projection> (a list of field names, normally
+    an InputShape's field_names()) is given, JSON bodies are decoded with
+    project_json, keeping only those top-level fields.
+    '''
+    if projection and http_request.mimetype == MIMETYPE_JSON:
+        return decode_json_projected(http_request, projection)
     return default_content_protocol.decode(http_request)
         
 
+def iter_ndjson(stream, transform_name=None, max_body_size=None):
+    '''Yields (line_number, record) for each non-blank line of a newline-delimited
+    JSON stream, reading one line at a time. Lines which are not valid JSON
+    yield a ValueError in place of the record.
+
+    If max_body_size is set, RequestBodyTooLargeException is raised as soon as
+    more than that many bytes have been read; this is the only limit on
+    chunked bodies, which declare no Content-Length.
+    '''
+    line_number = 0
+    bytes_read = 0
+    while True:
+        if max_body_size:
+            # never read more than one byte past the limit, even for a single line
+            line = stream.readline(max_body_size - bytes_read + 1)
+        else:
+            line = stream.readline()
+        if not line:
+            break
+        bytes_read += len(line)
+        if max_body_size and bytes_read > max_body_size:
+            raise RequestBodyTooLargeException(transform_name, max_body_size)
+        line_number += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield (line_number, json.loads(line.decode('utf-8')))
+        except ValueError as err:
+            yield (line_number, err)
+
+
+def ndjson_line(line_number, transform_status):
+    '''One line of an NDJSON response: the transform output for a successful
+    call, otherwise an error record tagged with the input line number.
+    '''
+    if transform_status.ok:
+        output = transform_status.output_data
+        if not isinstance(output, (str, bytes)):
+            output = serialization.encode(output, MIMETYPE_JSON)
+    else:
+        output = json.dumps({'line': line_number,
+                             'error_code': transform_status.get_error_code() or HTTP_DEFAULT_ERRORCODE,
+                             'error_message': transform_status.get_userdata('error_message')})
+    if isinstance(output, str):
+        output = output.encode('utf-8')
+    return output.rstrip(b'\n') + b'\n'
+
+
 def utf8_encode(raw_input_data):
     input_data = {}
     for key in raw_input_data:
@@ -166,9 +665,12 @@ class DataField():
     
     
 class InputShape():
-    def __init__(self, name):
+    def __init__(self, name, fields=None):
+        '''fields: optional (field name, is_required) pairs, so that a shape can be
+        built in one step; more can be added with add_field().
+        '''
         self.name = name
-        self.fields = []
+        self.fields = [DataField(field_name, is_required) for field_name, is_required in fields or []]
        
     def add_field(self, field_name, is_required=False):
         self.fields.append(DataField(field_name, is_required))
@@ -186,18 +688,280 @@ class InputShape():
         return [f.name for f in self.fields]
     
 
+class Deadline(object):
+    '''The time budget for one transform call. Transforms receive it as
+    kwargs['deadline'] and can check() it between steps to give up early;
+    service objects can get it from current_deadline() and use timeout_for() to
+    bound their own socket or query timeouts.
+    '''
+
+    def __init__(self, transform_name, timeout):
+        self.transform_name = transform_name
+        self.timeout = float(timeout)
+        self.expires_at = clock() + self.timeout
+
+
+    def remaining(self):
+        return max(0.0, self.expires_at - clock())
+
+
+    @property
+    def expired(self):
+        return clock() >= self.expires_at
+
+
+    def check(self):
+        if self.expired:
+            raise TransformTimeoutException(self.transform_name, self.timeout)
+
+
+    def timeout_for(self, default=None):
+        '''The remaining budget, capped at <default> if one is given.'''
+        if default is None:
+            return self.remaining()
+        return min(default, self.remaining())
+
+
+
+_deadline_state = threading.local()
+
+
+def current_deadline():
+    '''The Deadline of the transform running on this thread, or None.'''
+    return getattr(_deadline_state, 'deadline', None)
+
+
+def run_with_deadline(deadline, func):
+    '''Call func (with no arguments) with <deadline> as the current_deadline()
+    of this thread.
+    '''
+    previous_deadline = current_deadline()
+    _deadline_state.deadline = deadline
+    try:
+        return func()
+    finally:
+        _deadline_state.deadline = previous_deadline
+
+
+def requested_timeout(headers):
+    '''The client's time budget from the DEADLINE_HEADER, or None if absent or malformed.'''
+    if headers is None:
+        return None
+    value = headers.get(DEADLINE_HEADER)
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if timeout > 0 else None
+
+
+def create_deadline(transform_name, transform_timeout=None, requested_timeout=None):
+    timeouts = [t for t in (transform_timeout, requested_timeout) if t]
+    if not timeouts:
+        return None
+    return Deadline(transform_name, min(timeouts))
+
+
+EXECUTOR_TYPES = ['inline', 'thread', 'process']
+DEFAULT_THREAD_POOL_WORKERS = 4
+
+
+class InlineExecutor(object):
+    '''Runs a transform on the calling (request) thread.'''
+
+    def run(self, action, input_data, service_object_registry, **kwargs):
+        return action.execute(input_data, service_object_registry, **kwargs)
+
+
+
+class PooledExecutor(object):
+    '''Base class for executors which offload transforms to a pool. At most
+    max_workers + max_queue calls may be running or waiting at once; beyond that
+    the call is rejected with a TransformQueueFullException instead of queueing.
+
+    The pool is created on first use, and re-created in a forked child, so that
+    executors built at import time in a prefork master work in every worker.
+    '''
+
+    def __init__(self, transform_name, max_workers, max_queue=None):
+        self.transform_name = transform_name
+        self.max_workers = max_workers
+        self.max_queue = max_workers if max_queue is None else max_queue
+        self._pool = None
+        self._pool_pid = None
+        self._capacity = None
+        self._lock = threading.Lock()
+
+
+    def _create_pool(self):
+        raise NotImplementedError()
+
+
+    def _submit(self, pool, action, input_data, service_object_registry, **kwargs):
+        raise NotImplementedError()
+
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = self._create_pool()
+                self._pool_pid = os.getpid()
+                self._capacity = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+            return self._pool
+
+
+    def _wait(self, future, **kwargs):
+        deadline = kwargs.get('deadline')
+        if deadline is None:
+            return future.result()
+        try:
+            return future.result(timeout=deadline.remaining())
+        except FutureTimeoutError:
+            # frees the slot if the call never started; a running call is left
+            # to notice the expired deadline itself
+            future.cancel()
+            raise TransformTimeoutException(self.transform_name, deadline.timeout)
+
+
+    def run(self, action, input_data, service_object_registry, **kwargs):
+        pool = self._get_pool()
+        capacity = self._capacity
+        if not capacity.acquire(False):
+            raise TransformQueueFullException(self.transform_name)
+        try:
+            future = self._submit(pool, action, input_data, service_object_registry, **kwargs)
+        except:
+            capacity.release()
+            raise
+        future.add_done_callback(lambda f: capacity.release())
+        return self._wait(future, **kwargs)
+
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+
+class ThreadPoolTransformExecutor(PooledExecutor):
+    def __init__(self, transform_name, max_workers=None, max_queue=None):
+        PooledExecutor.__init__(self, transform_name, max_workers or DEFAULT_THREAD_POOL_WORKERS, max_queue)
+
+
+    def _create_pool(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+
+    def _submit(self, pool, action, input_data, service_object_registry, **kwargs):
+        return pool.submit(action.execute, input_data, service_object_registry, **kwargs)
+
+
+
+# Actions and services for process-pool transforms, by transform name. Pool
+# processes are forked from the worker that owns the pool, so they inherit these
+# and only the transform name and input data have to be pickled.
+_process_pool_actions = {}
+
+
+def _execute_in_process(transform_name, input_data, kwargs):
+    action, service_object_registry = _process_pool_actions[transform_name]
+    try:
+        return (True, action.execute(input_data, service_object_registry, **kwargs))
+    except Exception as err:
+        return (False, getattr(err, 'error_type', err.__class__.__name__), str(err))
+
+
+class ProcessPoolTransformExecutor(PooledExecutor):
+    def __init__(self, transform_name, max_workers=None, max_queue=None):
+        PooledExecutor.__init__(self, transform_name, max_workers or multiprocessing.cpu_count(), max_queue)
+
+
+    def _create_pool(self):
+        # imported here since it pulls in most of multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        try:
+            return ProcessPoolExecutor(max_workers=self.max_workers,
+                                       mp_context=multiprocessing.get_context('fork'))
+        except (TypeError, AttributeError):
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+
+
+    def _submit(self, pool, action, input_data, service_object_registry, **kwargs):
+        _process_pool_actions[action.name] = (action, service_object_registry)
+        if kwargs.get('headers') is not None:
+            kwargs['headers'] = dict(kwargs['headers'].items())
+        return pool.submit(_execute_in_process, action.name, input_data, kwargs)
+
+
+    def _wait(self, future, **kwargs):
+        result = PooledExecutor._wait(self, future, **kwargs)
+        if not result[0]:
+            raise RemoteTransformException(result[1], result[2])
+        return result[1]
+
+
+
+def create_executor(transform_name, executor_type='inline', max_workers=None, max_queue=None):
+    if executor_type is None or executor_type == 'inline':
+        return INLINE_EXECUTOR
+    if executor_type == 'thread':
+        return ThreadPoolTransformExecutor(transform_name, max_workers, max_queue)
+    if executor_type == 'process':
+        return ProcessPoolTransformExecutor(transform_name, max_workers, max_queue)
+    raise UnknownExecutorTypeException(executor_type)
+
+
+INLINE_EXECUTOR = InlineExecutor()
+
+
+
+class LazyFunction(object):
+    '''Stands in for a function in a module which is not imported until the
+    function is first called (see the lazy_transform_import global setting).
+    '''
+
+    def __init__(self, module_name, function_name):
+        self.module_name = module_name
+        self.function_name = function_name
+        self.__name__ = function_name
+        self._function = None
+
+
+    def __call__(self, *args, **kwargs):
+        if self._function is None:
+            import importlib
+            self._function = getattr(importlib.import_module(self.module_name), self.function_name)
+        return self._function(*args, **kwargs)
+
+
 class Action():
-    def __init__(self, input_shape, transform_function, mimetype):
+    def __init__(self, input_shape, transform_function, mimetype, **kwargs):
         self.input_shape = input_shape
         self.transform_function = transform_function
-        self.output_mimetype = mimetype
+        # a transform may declare several output mimetypes (see snap.serialization);
+        # the first is its default
+        self.output_mimetypes = serialization.parse_mimetypes(mimetype)
+        self.output_mimetype = self.output_mimetypes[0]
+        self.name = kwargs.get('name')
+        self.executor = kwargs.get('executor') or INLINE_EXECUTOR
+        self.single_flight = kwargs.get('single_flight', False)
+        self.timeout = kwargs.get('timeout')
 
 
     def execute(self, input_data, service_object_registry, **kwargs):
         errors = self.input_shape.scan(input_data)
         if len(errors):
             raise MissingInputFieldException(errors)
-        return self.transform_function(input_data, service_object_registry, **kwargs)
+
+        deadline = kwargs.get('deadline')
+        if deadline is None:
+            return self.transform_function(input_data, service_object_registry, **kwargs)
+
+        # the budget may already be spent waiting in a queue or behind a single-flight leader
+        deadline.check()
+        return run_with_deadline(deadline, lambda: self.transform_function(input_data, service_object_registry, **kwargs))
 
 
 
@@ -216,15 +980,186 @@ class TransformStatus(object):
 
 
 
+def normalize_input(input_data):
+    '''A canonical string form of a transform's input, used as a coalescing
+    (or memoization) key; None if the input is not plain JSON data. Values
+    such as uploaded files have no canonical form (str() of an upload shows
+    only its filename), so calls with them are never coalesced.
+    '''
+    try:
+        return json.dumps(input_data, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+
+class SingleFlightGroup(object):
+    '''Coalesces concurrent calls which share a key: the first caller runs the
+    function, and callers arriving while it runs wait for and share its result
+    (or its exception) instead of running it again.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+
+    def do(self, key, func, *args, **kwargs):
+        '''Run func(*args, **kwargs), or wait for the call already running
+        under <key>. A follower waits no longer than its own kwargs['deadline']
+        allows (its budget may be shorter than the leader's), then raises
+        TransformTimeoutException.
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not is_leader:
+            deadline = kwargs.get('deadline')
+            if not flight.done.wait(deadline.remaining() if deadline is not None else None):
+                raise TransformTimeoutException(deadline.transform_name, deadline.timeout)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+
+def stage_output(stage_name, transform_status):
+    '''A pipeline stage's output as input for the next stage. Output which a
+    transform has already serialized as a JSON object is decoded.
+    '''
+    output = transform_status.output_data
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    if isinstance(output, str):
+        output = json.loads(output) if output.strip() else {}
+    if output is None:
+        return {}
+    if not isinstance(output, dict):
+        raise PipelineStageOutputException(stage_name, output)
+    return output
+
+
+def server_timing(stage_timings):
+    '''A Server-Timing header value for (stage name, seconds) pairs.'''
+    return ', '.join('%s;dur=%.1f' % (name, elapsed * 1000) for name, elapsed in stage_timings)
+
+
+
+class Pipeline(object):
+    '''A transform function which runs registered transforms in-process, each
+    stage's output (a dict) becoming the next stage's input without being
+    re-encoded. A stage is a transform name, or a list of names: a fan-in
+    stage, whose transforms all receive the same input and whose outputs are
+    merged over it, in order, as the input for the next stage.
+
+    Each stage runs as its own transform (input shape check, executor, error
+    codes), within the time left on the pipeline's deadline. The first failed
+    stage's status is returned as the pipeline's; a successful result carries
+    the time spent in each stage as its "stage_timings" user data.
+    '''
+
+    def __init__(self, transformer, name, stages):
+        self.transformer = transformer
+        self.name = name
+        self.stages = [stage if isinstance(stage, (list, tuple)) else [stage] for stage in stages]
+        self.__name__ = '%s_pipeline' % name
+        self._actions = None
+
+
+    def _resolve(self):
+        # stages are looked up on first use, since they may be registered after the pipeline
+        if self._actions is None:
+            actions = []
+            for stage in self.stages:
+                stage_actions = []
+                for stage_name in stage:
+                    action = self.transformer.actions.get(stage_name)
+                    if action is None:
+                        raise UnregisteredTransformException(stage_name)
+                    stage_actions.append(action)
+                actions.append(stage_actions)
+            self._actions = actions
+        return self._actions
+
+
+    def __call__(self, input_data, service_objects, **kwargs):
+        stages = self._resolve()
+        stage_timings = []
+        data = input_data
+        for index, stage_actions in enumerate(stages):
+            results = []
+            for action in stage_actions:
+                started = clock()
+                status = self.transformer.run_action(action, data, **kwargs)
+                stage_timings.append((action.name, clock() - started))
+                if not status.ok:
+                    return status
+                results.append((action.name, status))
+
+            if len(results) > 1:
+                data = dict(data)
+                for stage_name, status in results:
+                    data.update(stage_output(stage_name, status))
+            elif index == len(stages) - 1:
+                # the last stage's output is the pipeline's, whatever its form
+                data = results[0][1].output_data
+            else:
+                data = stage_output(*results[0])
+
+        return TransformStatus(data, True, stage_timings=stage_timings)
+
+
+
 class Transformer():
-    def __init__(self, service_object_tbl):
+    def __init__(self, service_object_tbl, error_table=None):
+        '''error_table: optional mapping of exception type names to HTTP status
+        codes, equivalent to calling register_error_code() for each.
+        '''
         self.services = service_object_tbl
         self.actions = {}
-        self.error_table = {}
+        self.error_table = dict(error_table or {})
+        self.flights = SingleFlightGroup()
+
+
+    def register_transform(self, type_name, input_shape, transform_func, mimetype, **kwargs):
+        '''Register a transform function under <type_name>. Pass an executor (see
+        create_executor) to run the transform somewhere other than the request thread,
+        single_flight=True to coalesce concurrent calls with identical input, and
+        timeout=<seconds> to give each call a time budget (see Deadline).
+        '''
+        action = Action(input_shape, transform_func, mimetype, name=type_name, **kwargs)
+        self.actions[type_name] = action
+        return action
 
 
-    def register_transform(self, type_name, input_shape, transform_func, mimetype):
-        self.actions[type_name] = Action(input_shape, transform_func, mimetype)
+    def register_pipeline(self, type_name, input_shape, stages, mimetype, **kwargs):
+        '''Register a transform which runs other registered transforms in turn
+        (see Pipeline). Takes the same keyword arguments as register_transform.
+        '''
+        return self.register_transform(type_name, input_shape, Pipeline(self, type_name, stages), mimetype, **kwargs)
 
 
     def register_error_code(self, exception_type, code):          
@@ -239,6 +1174,18 @@ class Transformer():
       
           
     def transform(self, type_name, raw_input_data, **kwargs):
+        action = self.actions.get(type_name)
+        if not action:
+            raise UnregisteredTransformException(type_name)
+        return self.run_action(action, raw_input_data, **kwargs)
+
+
+    def run_action(self, action, raw_input_data, **kwargs):
+        '''Like transform(), for callers holding the Action returned by
+        register_transform (as compiled routing modules do), so that no name
+        lookup is needed.
+        '''
+        type_name = action.name
         if raw_input_data is None:
             raise NullTransformInputDataException(type_name)
 
@@ -252,23 +1199,85 @@ class Transformer():
             if encoded_value.__class__.__name__ == 'unicode':
                 encoded_value = encoded_value.encode('utf-8')
             input_data[encoded_key] = encoded_value
-          
-        action = self.actions.get(type_name)          
-        if not action:              
+
+        # the effective budget is the shorter of the transform's and the client's
+        deadline = create_deadline(type_name, action.timeout, requested_timeout(kwargs.get('headers')))
+        enclosing_deadline = kwargs.get('deadline')
+        if enclosing_deadline is not None and (deadline is None or enclosing_deadline.remaining() <= deadline.remaining()):
+            # a pipeline stage never gets more time than the pipeline has left
+            deadline = enclosing_deadline
+        if deadline is not None:
+            kwargs['deadline'] = deadline
+
+        if action.single_flight:
+            # concurrent calls with the same input share one execution (and its
+            # TransformStatus); per-call kwargs such as headers are not part of the key
+            normalized_input = normalize_input(input_data)
+            if normalized_input is not None:
+                try:
+                    return self.flights.do((type_name, normalized_input), self._execute, action, input_data, **kwargs)
+                except TransformTimeoutException as err:
+                    # a follower which gave up waiting for the leader
+                    return self._error_status(err)
+        return self._execute(action, input_data, **kwargs)
+
+
+    def transform_ndjson(self, type_name, stream, base_input_data=None, max_body_size=None, **kwargs):
+        '''Runs the transform once per line of an NDJSON stream, yielding one
+        NDJSON result line per input line. Only one line is held in memory at
+        a time. Each record is merged over base_input_data (e.g. route variables).
+        type_name may also be an Action returned by register_transform.
+
+        Once more than max_body_size bytes have been read, a final 413 error
+        line is sent and the rest of the stream is ignored.
+        '''
+        action = type_name if isinstance(type_name, Action) else self.actions.get(type_name)
+        if not action:
             raise UnregisteredTransformException(type_name)
 
+        records = iter_ndjson(stream, action.name, max_body_size)
+        line_number = 0
+        while True:
+            try:
+                line_number, record = next(records)
+            except StopIteration:
+                return
+            except RequestBodyTooLargeException as err:
+                # the response is already under way, so the limit is reported in-band
+                yield ndjson_line(line_number + 1, TransformStatus(None,
+                                                                   False,
+                                                                   error_message=str(err),
+                                                                   error_code=HTTP_PAYLOAD_TOO_LARGE))
+                return
+            if isinstance(record, ValueError) or not isinstance(record, dict):
+                status = TransformStatus(None,
+                                         False,
+                                         error_message='line %d is not a JSON object' % line_number,
+                                         error_code=HTTP_BAD_REQUEST)
+            else:
+                input_data = dict(base_input_data or {})
+                input_data.update(record)
+                status = self.run_action(action, input_data, **kwargs)
+            yield ndjson_line(line_number, status)
+
+
+    def _execute(self, action, input_data, **kwargs):
         try:
-            return action.execute(input_data, self.services, **kwargs)
+            return action.executor.run(action, input_data, self.services, **kwargs)
         except Exception as err:
-            error_type = err.__class__.__name__              
-            if self.error_table.get(error_type):
-                return TransformStatus(None, 
-                                       False, 
-                                       error_message=str(err),  
-                                       error_code=self.error_table[error_type])
-            # if we don't know what code to return for a given downstream exception, 
-            # re-raise it and assume that someone will handle it upstream
-            raise err
+            return self._error_status(err)
+
+
+    def _error_status(self, err):
+        error_type = getattr(err, 'error_type', err.__class__.__name__)
+        if self.error_table.get(error_type):
+            return TransformStatus(None, 
+                                   False, 
+                                   error_message=str(err),  
+                                   error_code=self.error_table[error_type])
+        # if we don't know what code to return for a given downstream exception, 
+        # re-raise it and assume that someone will handle it upstream
+        raise err
 
 
 
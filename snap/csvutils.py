@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 
-import common
+from snap import common
 import arrow
 from datetime import datetime
 
@@ -128,7 +128,9 @@ class CSVRecordMap(object):
     def format(self, data, field):
         if field.type.__name__ in ['str', 'unicode']:
             #result = '"%s"' % data            
-            return data.encode("utf-8")
+            if data.__class__.__name__ == 'unicode':
+                return data.encode("utf-8")
+            return data
         return str(data)
 
 
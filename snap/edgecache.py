@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+#
+# nginx micro-caching rules for snap transforms
+#
+# A GET transform can opt in to caching at the edge with an edge_cache block in
+# its config:
+#
+#   transforms:
+#       get_widget:
+#           route:          /widgets/<string:id>
+#           method:         GET
+#           ...
+#           edge_cache:
+#               ttl:        5               # seconds, or an nginx time such as 500ms or 1m
+#               vary:       [Accept]        # request headers which are part of the cache key
+#
+# ngen turns each rule into an nginx location which caches responses in a
+# shared zone (see the cache_* tuning settings). Routes without a rule are
+# passed straight through to the app.
+#
+# Requests which carry credentials (an Authorization or Cookie header) are
+# neither answered from the cache nor stored in it, since their responses may
+# be meant for one user only, unless the header is listed in vary and so is
+# part of the cache key.
+#
+
+
+import re
+
+
+EDGE_CACHE_CONFIG_KEYS = ['ttl', 'vary']
+CACHEABLE_METHODS = ['GET']
+CREDENTIAL_HEADERS = ['Authorization', 'Cookie']
+# between the parts of a cache key, so that different header values cannot
+# run together into the same key
+CACHE_KEY_DELIMITER = '|'
+
+ROUTE_VARIABLE_REGEX = re.compile(r'<(?:([a-zA-Z_]+):)?([a-zA-Z_-]+)>')
+
+# regexes for the Flask route converters
+ROUTE_CONVERTER_PATTERNS = {
+    'int': '[0-9]+',
+    'float': '[0-9.]+',
+    'path': '.+'
+}
+DEFAULT_CONVERTER_PATTERN = '[^/]+'
+
+
+class InvalidEdgeCacheConfigException(Exception):
+    def __init__(self, transform_name, message):
+        Exception.__init__(self, 'Bad edge_cache settings for transform "%s": %s' % (transform_name, message))
+
+
+
+def nginx_time(value):
+    '''nginx reads a bare number as seconds, but be explicit.'''
+    if isinstance(value, (int, float)):
+        return '%ds' % value
+    return str(value)
+
+
+def header_variable(header_name):
+    return '$http_%s' % header_name.lower().replace('-', '_')
+
+
+def route_to_location(route):
+    '''The nginx location modifier and match for a Flask route.'''
+    if not ROUTE_VARIABLE_REGEX.search(route):
+        return ('=', route)
+
+    pattern = []
+    position = 0
+    for match in ROUTE_VARIABLE_REGEX.finditer(route):
+        pattern.append(re.escape(route[position:match.start()]))
+        pattern.append(ROUTE_CONVERTER_PATTERNS.get(match.group(1), DEFAULT_CONVERTER_PATTERN))
+        position = match.end()
+    pattern.append(re.escape(route[position:]))
+    return ('~', '^%s$' % ''.join(pattern))
+
+
+
+class EdgeCacheRule(object):
+    def __init__(self, transform_name, route, ttl, vary=None):
+        self.transform_name = transform_name
+        self.route = route
+        self.ttl = nginx_time(ttl)
+        self.vary = list(vary or [])
+        self.location_modifier, self.location_match = route_to_location(route)
+
+
+    @property
+    def cache_key(self):
+        # the query string is part of $request_uri
+        return CACHE_KEY_DELIMITER.join(['$scheme', '$request_method', '$host', '$request_uri']
+                                        + [header_variable(h) for h in self.vary])
+
+
+    @property
+    def bypass_variables(self):
+        '''The variables which, if set, keep a request out of the cache (for
+        the nginx *_cache_bypass and *_no_cache directives).
+        '''
+        varied = set(h.lower() for h in self.vary)
+        return ' '.join(header_variable(h) for h in CREDENTIAL_HEADERS if h.lower() not in varied)
+
+
+
+def load_edge_cache_rules(yaml_config):
+    rules = []
+    transforms = yaml_config.get('transforms') or {}
+    for transform_name in transforms:
+        transform_config = transforms[transform_name]
+        settings = transform_config.get('edge_cache')
+        if not settings:
+            continue
+
+        for key in settings:
+            if key not in EDGE_CACHE_CONFIG_KEYS:
+                raise InvalidEdgeCacheConfigException(transform_name,
+                                                      'unknown setting "%s"; valid settings are %s.'
+                                                      % (key, ', '.join(EDGE_CACHE_CONFIG_KEYS)))
+        if not settings.get('ttl'):
+            raise InvalidEdgeCacheConfigException(transform_name, 'a ttl is required.')
+
+        methods = [m.strip().upper() for m in transform_config['method'].split(',')]
+        if [m for m in methods if m not in CACHEABLE_METHODS]:
+            raise InvalidEdgeCacheConfigException(transform_name, 'only GET transforms can be cached.')
+
+        vary = settings.get('vary') or []
+        if not isinstance(vary, list):
+            vary = [vary]
+        rules.append(EdgeCacheRule(transform_name, transform_config['route'], settings['ttl'], vary))
+
+    # nginx checks regex locations in order; put the most specific routes first
+    rules.sort(key=lambda rule: len(rule.route), reverse=True)
+    return rules
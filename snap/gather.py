@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+#
+# concurrent calls to independent service objects from one transform
+#
+# Transforms reach this through the service object registry they are passed:
+#
+#   def dashboard_func(input_data, service_objects, **kwargs):
+#       result = service_objects.scatter_gather({
+#           'customer': service_objects.call('crm', 'get_customer', input_data['id']),
+#           'orders':   service_objects.call('orders_db', 'recent_orders', input_data['id']),
+#           'stock':    lambda: service_objects.lookup('inventory').levels(input_data['sku'])
+#       }, timeout=0.5)
+#
+#       if 'customer' in result.errors:
+#           ...
+#
+# The calls run at the same time on a pool shared by every transform in the
+# process, so the total wait is the slowest call's rather than the sum of all.
+#
+
+
+from concurrent.futures import wait
+from snap import core
+
+
+class CallTimeoutException(Exception):
+    def __init__(self, call_name, timeout):
+        Exception.__init__(self, 'Service call "%s" did not complete within %.3f seconds.' % (call_name, timeout))
+        self.call_name = call_name
+        self.timeout = timeout
+
+
+
+class GatherResult(object):
+    '''The outcome of scatter_gather: results maps each call that succeeded to
+    its return value, errors each call that failed (or ran out of time) to its
+    exception.
+    '''
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.elapsed = 0.0
+
+
+    @property
+    def complete(self):
+        return not self.errors
+
+
+    def get(self, call_name, default=None):
+        return self.results.get(call_name, default)
+
+
+    def raise_first_error(self):
+        '''For callers which need every result: raises the first error, if any.'''
+        for call_name in sorted(self.errors):
+            raise self.errors[call_name]
+
+
+
+def scatter_gather(pool, calls, timeout=None):
+    '''Run the zero-argument callables in calls (a dict of name: callable)
+    concurrently on pool, and wait for them until timeout seconds have passed,
+    or until the calling transform's deadline, whichever is sooner.
+
+    Calls see that same deadline through core.current_deadline(), so service
+    objects which honor it (such as snap.http_services.HTTPService) cut their
+    own timeouts short. Calls still running when time is up are reported as
+    CallTimeoutException errors, and their results are discarded.
+    '''
+    started = core.clock()
+    enclosing_deadline = core.current_deadline()
+    budget = timeout
+    if enclosing_deadline is not None:
+        budget = enclosing_deadline.timeout_for(timeout)
+    deadline = core.Deadline('scatter_gather', budget) if budget is not None else None
+
+    futures = {}
+    for call_name, call in calls.items():
+        futures[pool.submit(core.run_with_deadline, deadline, call)] = call_name
+
+    done, not_done = wait(futures, timeout=budget)
+
+    result = GatherResult()
+    for future in done:
+        call_name = futures[future]
+        if future.exception() is not None:
+            result.errors[call_name] = future.exception()
+        else:
+            result.results[call_name] = future.result()
+    for future in not_done:
+        # calls which have not started yet never will
+        future.cancel()
+        result.errors[futures[future]] = CallTimeoutException(futures[future], budget)
+
+    result.elapsed = core.clock() - started
+    return result
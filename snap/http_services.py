@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+#
+# keep-alive HTTP client service object for calls from snap transforms to
+# other (snap or third-party) services
+#
+# Usage in the service_objects section of the config file:
+#
+#   service_objects:
+#       inventory:
+#           class:  HTTPService
+#           module: snap.http_services
+#           init_params:
+#               - name: base_url
+#                 value: http://inventory.internal:8080
+#               - name: max_connections_per_host
+#                 value: 20
+#               - name: hedge_after
+#                 value: 0.05
+#
+
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from snap import core
+
+
+DEFAULT_MAX_HOSTS = 10
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 2
+DEFAULT_RETRY_STATUSES = [502, 503, 504]
+
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+
+
+def as_list(value):
+    if isinstance(value, str):
+        return [int(v) for v in value.split(',') if v.strip()]
+    return list(value)
+
+
+
+class HTTPService(object):
+    '''An HTTP client which reuses connections through a shared keep-alive
+    pool. At most max_connections_per_host connections are open to any one
+    host; further concurrent calls wait for a free connection rather than
+    opening more.
+
+    Idempotent requests are retried after connection errors and on
+    retry_statuses, sleeping a random ("full jitter") fraction of an
+    exponential backoff between attempts. When called from a transform with a
+    deadline (see core.Deadline), timeouts and retries are capped to the time
+    remaining.
+
+    If hedge_after is set, get(..., hedge=True) sends a second copy of a GET
+    which has not completed after hedge_after seconds, and returns whichever
+    response arrives first.
+    '''
+
+    def __init__(self, **kwargs):
+        self.base_url = (kwargs.get('base_url') or '').rstrip('/')
+        self.max_hosts = int(kwargs.get('max_hosts') or DEFAULT_MAX_HOSTS)
+        self.max_connections_per_host = int(kwargs.get('max_connections_per_host') or DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        self.connect_timeout = float(kwargs.get('connect_timeout') or DEFAULT_CONNECT_TIMEOUT)
+        self.read_timeout = float(kwargs.get('read_timeout') or DEFAULT_READ_TIMEOUT)
+        retries = kwargs.get('retries')
+        self.retries = DEFAULT_RETRIES if retries is None else int(retries)
+        self.backoff = float(kwargs.get('backoff') or DEFAULT_BACKOFF)
+        self.max_backoff = float(kwargs.get('max_backoff') or DEFAULT_MAX_BACKOFF)
+        self.retry_statuses = as_list(kwargs.get('retry_statuses') or DEFAULT_RETRY_STATUSES)
+        hedge_after = kwargs.get('hedge_after')
+        self.hedge_after = float(hedge_after) if hedge_after else None
+        self.default_headers = kwargs.get('headers') or {}
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._hedge_pool = None
+        self._pid = None
+
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_hosts,
+                              pool_maxsize=self.max_connections_per_host,
+                              pool_block=True,
+                              max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.default_headers)
+        return session
+
+
+    @property
+    def session(self):
+        # created on first use, and again in a forked child, so that prefork
+        # workers never share the master's sockets
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = self._create_session()
+                self._hedge_pool = None
+                self._pid = os.getpid()
+            return self._session
+
+
+    def _get_hedge_pool(self):
+        self.session    # resets the hedge pool too, after a fork
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=2 * self.max_connections_per_host)
+            return self._hedge_pool
+
+
+    def url_for(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return '%s/%s' % (self.base_url, path.lstrip('/'))
+
+
+    def _timeout(self, deadline):
+        if deadline is None:
+            return (self.connect_timeout, self.read_timeout)
+        deadline.check()
+        return (deadline.timeout_for(self.connect_timeout), deadline.timeout_for(self.read_timeout))
+
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+    def request(self, method, path, **kwargs):
+        '''Send a request (with requests' keyword arguments) and return the
+        requests.Response. Connection errors are raised once retries run out;
+        error statuses are returned as they are.
+        '''
+        method = method.upper()
+        url = self.url_for(path)
+        deadline = core.current_deadline()
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            if 'timeout' not in kwargs or deadline is not None:
+                kwargs['timeout'] = self._timeout(deadline)
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in self.retry_statuses or attempt >= retries:
+                    return response
+                response.close()
+            except (requests.ConnectionError, requests.Timeout):
+                if deadline is not None:
+                    # out of time: report the transform's timeout, not the socket's
+                    deadline.check()
+                if attempt >= retries:
+                    raise
+
+            delay = self._backoff_delay(attempt)
+            if deadline is not None and delay >= deadline.remaining():
+                deadline.check()
+                delay = 0
+            time.sleep(delay)
+            attempt += 1
+
+
+    def get(self, path, hedge=False, **kwargs):
+        if hedge and self.hedge_after:
+            return self._hedged_get(path, **kwargs)
+        return self.request('GET', path, **kwargs)
+
+
+    def _hedged_get(self, path, **kwargs):
+        # both copies run on pool threads, which do not see the caller's
+        # deadline, so pass the caller's remaining budget on as a timeout
+        deadline = core.current_deadline()
+        if deadline is not None:
+            kwargs['timeout'] = self._timeout(deadline)
+
+        pool = self._get_hedge_pool()
+        pending = set([pool.submit(self.request, 'GET', path, **kwargs)])
+        done, pending = wait(pending, timeout=self.hedge_after)
+        if done:
+            # answered (or failed) before the hedge was due
+            return done.pop().result()
+        pending.add(pool.submit(self.request, 'GET', path, **kwargs))
+
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # the slower copy finishes in the background and is dropped
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+                if self._hedge_pool is not None:
+                    self._hedge_pool.shutdown(wait=False)
+            self._session = None
+            self._hedge_pool = None
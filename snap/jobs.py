@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+#
+# asynchronous jobs for long-running transforms
+#
+# A transform configured with "mode: async" does not run while the client
+# waits. Its endpoint validates the input, queues a job in a local SQLite
+# database and answers 202 Accepted with the job's id; background worker
+# threads run the job, and the client polls /smp/jobs/<id> for the outcome:
+#
+#   jobs:
+#       path:           /var/tmp/myservice-jobs.db
+#       workers:        2
+#       retention:      3600
+#
+#   transforms:
+#       rebuild_index:
+#           route:              /index/rebuild
+#           method:             POST
+#           input_shape:        rebuild
+#           output_mimetype:    application/json
+#           mode:               async
+#
+# Polling a job which has not finished yet answers 202 with its status and a
+# Retry-After header; a finished job answers with the transform's output (or
+# its error code), as the synchronous endpoint would have.
+#
+# Every worker process runs its own job threads against the shared database,
+# so a job is picked up by whichever process is free. Jobs left running by a
+# process which has since died are queued again. Finished jobs are kept for
+# <retention> seconds, after which their ids answer 404.
+#
+# Job input must be JSON data: file uploads are refused with a 400. Only the
+# request headers named in JOB_HEADERS (and in the optional "headers" setting)
+# are saved with a job and passed to the transform; credentials such as
+# Authorization and Cookie are never written to the database.
+#
+
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from snap import core
+from snap import common
+from snap import serialization
+
+
+HTTP_OK = 200
+HTTP_ACCEPTED = 202
+HTTP_NOT_FOUND = 404
+HTTP_INTERNAL_ERROR = 500
+
+JOB_CONFIG_KEYS = ['path', 'workers', 'retention', 'poll_interval', 'headers']
+JOB_ROUTE_PREFIX = '/smp/jobs'
+TRANSFORM_MODES = ['sync', 'async']
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_RETENTION = 3600
+DEFAULT_POLL_INTERVAL = 1.0
+BUSY_TIMEOUT_MS = 5000
+# expired jobs are purged by each process at most this often (seconds)
+PURGE_INTERVAL = 60
+# request headers saved with a job
+JOB_HEADERS = ['Accept', 'Accept-Language', 'Content-Type', 'User-Agent', 'X-Request-Id']
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snap_jobs (
+    id              TEXT PRIMARY KEY,
+    transform       TEXT NOT NULL,
+    input           TEXT NOT NULL,
+    headers         TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    owner_pid       INTEGER,
+    result          BLOB,
+    mimetype        TEXT,
+    error_code      INTEGER,
+    error_message   TEXT,
+    created_at      REAL NOT NULL,
+    started_at      REAL,
+    finished_at     REAL,
+    expires_at      REAL
+);
+CREATE INDEX IF NOT EXISTS snap_jobs_status ON snap_jobs (status, created_at);
+'''
+
+
+class InvalidJobConfigException(Exception):
+    def __init__(self, key):
+        Exception.__init__(self, 'Unrecognized setting "%s" in the jobs section; valid settings are %s.'
+                           % (key, ', '.join(JOB_CONFIG_KEYS)))
+
+
+class MissingJobStoreException(Exception):
+    def __init__(self, transform_name):
+        Exception.__init__(self, 'Transform "%s" runs in async mode, which requires a jobs section with a "path" setting.'
+                           % transform_name)
+
+
+class UnsupportedJobInputException(Exception):
+    def __init__(self, transform_name, reason):
+        Exception.__init__(self, 'Input for async transform "%s" cannot be queued: %s. '
+                           'Async transforms take JSON input only; file uploads are not supported.'
+                           % (transform_name, reason))
+
+
+class UnknownTransformModeException(Exception):
+    def __init__(self, transform_name, mode):
+        Exception.__init__(self, 'Unknown mode "%s" for transform "%s". Valid modes are %s.'
+                           % (mode, transform_name, ', '.join(TRANSFORM_MODES)))
+
+
+def load_job_settings(yaml_config):
+    '''Validate the jobs section, returning the job queue settings, or None
+    if no transform runs in async mode.
+    '''
+    async_transforms = sorted(name for name, transform_config in (yaml_config.get('transforms') or {}).items()
+                              if transform_config.get('mode') == 'async')
+    if not async_transforms:
+        return None
+
+    jobs_segment = yaml_config.get('jobs') or {}
+    for key in jobs_segment:
+        if key not in JOB_CONFIG_KEYS:
+            raise InvalidJobConfigException(key)
+    if not jobs_segment.get('path'):
+        raise MissingJobStoreException(async_transforms[0])
+    return dict(jobs_segment)
+
+
+
+def job_href(job_id):
+    return '%s/%s' % (JOB_ROUTE_PREFIX, job_id)
+
+
+
+class JobReply(object):
+    '''The HTTP response for a job submission or a poll.'''
+
+    def __init__(self, status_code, body, mimetype='application/json', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+
+    @staticmethod
+    def pending(job, retry_after, location=False):
+        body = json.dumps({'job_id': job['job_id'],
+                           'transform': job['transform'],
+                           'status': job['status'],
+                           'href': job_href(job['job_id'])})
+        headers = {'Retry-After': str(retry_after)}
+        if location:
+            headers['Location'] = job_href(job['job_id'])
+        return JobReply(HTTP_ACCEPTED, body, headers=headers)
+
+
+    @staticmethod
+    def error(error_code, error_message, job_id):
+        return JobReply(error_code, json.dumps({'error_message': error_message,
+                                                'error_code': error_code,
+                                                'job_id': job_id}))
+
+
+
+class JobQueue(object):
+    '''A durable queue of transform calls, run by <workers> background threads
+    in each process which uses it. Threads are started on first use in each
+    process (so after a prefork server has forked its workers).
+    '''
+
+    def __init__(self, transformer, path, workers=DEFAULT_JOB_WORKERS, retention=DEFAULT_RETENTION,
+                 poll_interval=DEFAULT_POLL_INTERVAL, headers=None):
+        self.transformer = transformer
+        self.path = path
+        self.workers = int(workers)
+        self.retention = float(retention)
+        self.poll_interval = float(poll_interval)
+        self.saved_headers = set(name.lower() for name in JOB_HEADERS + list(headers or []))
+        # the client's time budget covers the submission, not the job
+        self.saved_headers.discard(core.DEADLINE_HEADER.lower())
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads_pid = None
+        self._last_purge = 0
+
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+
+    def start_in_workers(self, start_now=False):
+        '''Start job threads in each snap server worker as soon as it is
+        forked, and in this process too if start_now, so that jobs queued
+        before a restart run without waiting for a submission or a poll.
+        Other forked processes (a transform's process pool, say) never start
+        them; workers of other servers start them on first use.
+        '''
+        def start_in_worker():
+            self._lock = threading.Lock()
+            self._wakeup = threading.Condition(self._lock)
+            self.start()
+
+        common.on_worker_start(start_in_worker)
+        if start_now:
+            self.start()
+
+
+    def start(self):
+        '''Start this process's job threads, if they are not running yet.'''
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            self._threads_pid = os.getpid()
+        self.recover()
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name='snap-job-%d' % index, daemon=True).start()
+
+
+    def submit(self, action, input_data, headers=None):
+        '''Queue a call of a registered transform (its Action). The input is
+        checked against the transform's shape first, so that bad requests are
+        refused now rather than failing later. Returns the new job's record.
+        '''
+        errors = action.input_shape.scan(input_data)
+        if errors:
+            raise core.MissingInputFieldException(errors)
+        try:
+            input_json = json.dumps(input_data)
+        except (TypeError, ValueError) as err:
+            raise UnsupportedJobInputException(action.name, err)
+        self.start()
+
+        job_headers = dict((name, value) for name, value in (headers or {}).items()
+                           if name.lower() in self.saved_headers)
+        job = {'job_id': uuid.uuid4().hex,
+               'transform': action.name,
+               'status': JOB_QUEUED,
+               'error_code': None,
+               'error_message': None,
+               'created_at': time.time(),
+               'started_at': None,
+               'finished_at': None,
+               'expires_at': None}
+        self._connection().execute('INSERT INTO snap_jobs (id, transform, input, headers, status, created_at) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   (job['job_id'], action.name, input_json, json.dumps(job_headers), JOB_QUEUED,
+                                    job['created_at']))
+        with self._wakeup:
+            self._wakeup.notify()
+        # the record as queued: a worker thread may already have run the job
+        # and, with a short retention, expired it
+        return job
+
+
+    def get(self, job_id):
+        '''A job's record (a dict, without its result), or None if there is no
+        such job or it has expired.
+        '''
+        row = self._connection().execute('SELECT id, transform, status, error_code, error_message, created_at, '
+                                         'started_at, finished_at, expires_at FROM snap_jobs WHERE id = ?',
+                                         (job_id,)).fetchone()
+        if row is None or (row[8] is not None and row[8] <= time.time()):
+            return None
+        return {'job_id': row[0],
+                'transform': row[1],
+                'status': row[2],
+                'error_code': row[3],
+                'error_message': row[4],
+                'created_at': row[5],
+                'started_at': row[6],
+                'finished_at': row[7],
+                'expires_at': row[8]}
+
+
+    def result(self, job_id):
+        '''The encoded result and its mimetype for a finished job.'''
+        return self._connection().execute('SELECT result, mimetype FROM snap_jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+    @property
+    def retry_after(self):
+        return max(1, int(round(self.poll_interval)))
+
+
+    def accepted(self, job):
+        '''The 202 reply to a submission, pointing the client at the job.'''
+        return JobReply.pending(job, self.retry_after, location=True)
+
+
+    def poll(self, job_id):
+        '''The reply for GET /smp/jobs/<job_id>.'''
+        # a process which only answers polls still runs (and recovers) jobs
+        self.start()
+        job = self.get(job_id)
+        if job is None:
+            return JobReply.error(HTTP_NOT_FOUND, 'No job with the id "%s" (it may have expired).' % job_id, job_id)
+        if job['status'] == JOB_DONE:
+            body, mimetype = self.result(job_id)
+            return JobReply(HTTP_OK, bytes(body), mimetype)
+        if job['status'] == JOB_FAILED:
+            return JobReply.error(job['error_code'], job['error_message'], job_id)
+        return JobReply.pending(job, self.retry_after)
+
+
+    def _claim(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT id, transform, input, headers FROM snap_jobs WHERE status = ? '
+                                     'ORDER BY created_at LIMIT 1', (JOB_QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE snap_jobs SET status = ?, owner_pid = ?, started_at = ? WHERE id = ?',
+                                   (JOB_RUNNING, os.getpid(), time.time(), row[0]))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return row
+
+
+    def _finish(self, job_id, status, result=None, mimetype=None, error_code=None, error_message=None):
+        now = time.time()
+        self._connection().execute('UPDATE snap_jobs SET status = ?, result = ?, mimetype = ?, error_code = ?, '
+                                   'error_message = ?, finished_at = ?, expires_at = ? WHERE id = ?',
+                                   (status, result, mimetype, error_code, error_message, now, now + self.retention, job_id))
+
+
+    def run_job(self, job_id, transform_name, input_json, headers_json):
+        action = self.transformer.actions.get(transform_name)
+        if action is None:
+            return self._finish(job_id, JOB_FAILED, error_code=HTTP_INTERNAL_ERROR,
+                                error_message=str(core.UnregisteredTransformException(transform_name)))
+        try:
+            status = self.transformer.run_action(action, json.loads(input_json), headers=json.loads(headers_json))
+            if status.ok:
+                result = as_bytes(serialization.encode(status.output_data, action.output_mimetype))
+                self._finish(job_id, JOB_DONE, sqlite3.Binary(result), action.output_mimetype)
+            else:
+                self._finish(job_id, JOB_FAILED,
+                             error_code=status.get_error_code() or core.HTTP_DEFAULT_ERRORCODE,
+                             error_message=status.user_data.get('error_message'))
+        except Exception as err:
+            # exceptions with no registered error code are server errors, as on the synchronous route
+            self._finish(job_id, JOB_FAILED, error_code=HTTP_INTERNAL_ERROR, error_message=str(err))
+
+
+    def _work(self):
+        while True:
+            try:
+                self.purge()
+                job = self._claim()
+            except sqlite3.OperationalError:
+                # the database stayed locked past the busy timeout; try again later
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self.run_job(*job)
+
+
+    def recover(self):
+        '''Queue again any job left running by a process which no longer exists.'''
+        connection = self._connection()
+        rows = connection.execute('SELECT id, owner_pid FROM snap_jobs WHERE status = ?', (JOB_RUNNING,)).fetchall()
+        for job_id, owner_pid in rows:
+            if owner_pid != os.getpid() and not process_exists(owner_pid):
+                connection.execute('UPDATE snap_jobs SET status = ?, owner_pid = NULL, started_at = NULL '
+                                   'WHERE id = ? AND status = ?', (JOB_QUEUED, job_id, JOB_RUNNING))
+
+
+    def purge(self):
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        self._connection().execute('DELETE FROM snap_jobs WHERE expires_at <= ?', (now,))
+
+
+
+def as_bytes(body):
+    '''An encoded result as bytes; streamed output is collected in full.'''
+    if body is None:
+        return b''
+    if isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return b''.join(as_bytes(chunk) for chunk in body)
+
+
+
+def process_exists(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -1,16 +1,48 @@
 import logging
 import logging.config
-import pkgutil
-import yaml
+import threading
 
 log_config_filename = 'logging_config.yaml'
-yaml_config = yaml.load(pkgutil.get_data('snap', log_config_filename))
 
-logging.config.dictConfig(yaml_config)
-root_logger = logging.getLogger()
-root_logger.debug('SNAP logging config loaded from %s.' % log_config_filename)
+_config_lock = threading.Lock()
+_configured = False
 
-request_logger = logging.getLogger('request')
-init_logger = logging.getLogger('init')
-service_logger = logging.getLogger('service')
-transform_logger = logging.getLogger('transform')
+
+def configure():
+    '''Load the snap logging config. snap.setup applies it while configuring
+    the app; code which only imports snap gets it on first use of one of the
+    loggers below. It is not applied at import, since parsing the YAML is one
+    of the larger costs of importing snap.
+    '''
+    global _configured
+    with _config_lock:
+        if _configured:
+            return
+        import pkgutil
+        import yaml
+        yaml_config = yaml.safe_load(pkgutil.get_data('snap', log_config_filename))
+        logging.config.dictConfig(yaml_config)
+        _configured = True
+    logging.getLogger().debug('SNAP logging config loaded from %s.' % log_config_filename)
+
+
+
+class LazyLogger(object):
+    def __init__(self, name):
+        self._name = name
+        self._logger = None
+
+
+    def __getattr__(self, attribute):
+        if self._logger is None:
+            configure()
+            self._logger = logging.getLogger(self._name)
+        return getattr(self._logger, attribute)
+
+
+
+request_logger = LazyLogger('request')
+init_logger = LazyLogger('init')
+service_logger = LazyLogger('service')
+transform_logger = LazyLogger('transform')
+server_logger = LazyLogger('server')
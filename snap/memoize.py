@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+#
+# memoization for transform functions and service-object methods, backed by a
+# cache which every worker process on a host shares
+#
+# The cache is a local SQLite database in WAL mode, so readers in one worker
+# never block on a writer in another. In a transform module:
+#
+#   from snap import memoize
+#
+#   results_cache = memoize.SharedCache('/var/cache/myservice/results.db', max_entries=50000)
+#
+#   @memoize.memoize(results_cache, ttl=300)
+#   def price_lookup_func(input_data, service_objects, **kwargs):
+#       ...
+#
+# Cached values are pickled, so anyone who can write the database can run code
+# in the service. The database must be in a directory which only its owner can
+# write (not a shared one such as /tmp or /var/tmp); it is created with mode
+# 0600, and a database which other users can write is refused.
+#
+# Only plain JSON input is memoized: calls whose input cannot be normalized
+# (such as file uploads) always run.
+#
+
+
+import os
+import stat
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from snap import core
+
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 300
+BUSY_TIMEOUT_MS = 5000
+# eviction runs after every EVICTION_INTERVAL writes from a process
+EVICTION_INTERVAL = 32
+# a hit only records its access time if the recorded one is older than this,
+# so that reads rarely need a write
+ACCESS_RESOLUTION = 1.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snap_cache (
+    key         TEXT PRIMARY KEY,
+    value       BLOB NOT NULL,
+    expires_at  REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snap_cache_last_access ON snap_cache (last_access);
+'''
+
+
+class UnsafeCacheFileException(Exception):
+    def __init__(self, path, reason):
+        Exception.__init__(self, 'Refusing to use the shared cache at %s: %s. Cached values are unpickled, '
+                           'so the cache must be writable only by the user running the service.' % (path, reason))
+
+
+
+def cache_key(name, input_data):
+    '''The transform (or method) name and a digest of its normalized input,
+    or None if the input is not plain JSON data.
+    '''
+    normalized = core.normalize_input(input_data)
+    if normalized is None:
+        return None
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return '%s:%s' % (name, digest)
+
+
+
+def check_private_path(path):
+    '''Create the database file (mode 0600) if it is missing, and make sure no
+    other user can write it, its WAL files or its directory.
+    '''
+    def check(st, what):
+        if st.st_uid not in (os.getuid(), 0):
+            raise UnsafeCacheFileException(path, '%s is owned by another user' % what)
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise UnsafeCacheFileException(path, '%s is writable by other users' % what)
+
+    check(os.stat(os.path.dirname(os.path.abspath(path))), 'its directory')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        check(os.fstat(fd), 'the file')
+    finally:
+        os.close(fd)
+    for suffix in ['-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            check(os.stat(path + suffix), 'the %s file' % suffix)
+
+
+
+class SharedCache(object):
+    '''A TTL cache shared by all processes using the same database file. When
+    it holds more than max_entries, the least recently used entries are evicted.
+    Connections are opened per thread, and again after a fork.
+
+    It can also be configured as a service object (class SharedCache, module
+    snap.memoize) with init params path, max_entries and ttl.
+    '''
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            check_private_path(self.path)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+    def get(self, key, default=None):
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute('SELECT value, expires_at, last_access FROM snap_cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= now:
+            self._count('misses')
+            return default
+
+        self._count('hits')
+        if now - row[2] > ACCESS_RESOLUTION:
+            connection.execute('UPDATE snap_cache SET last_access = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+
+    def set(self, key, value, ttl=None):
+        connection = self._connection()
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else float(ttl))
+        connection.execute('INSERT OR REPLACE INTO snap_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                           (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), expires_at, now))
+        with self._stats_lock:
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM snap_cache WHERE key = ?', (key,))
+
+
+    def evict(self):
+        '''Drop expired entries, then the least recently used ones over max_entries.'''
+        connection = self._connection()
+        removed = connection.execute('DELETE FROM snap_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+        removed += connection.execute('''DELETE FROM snap_cache WHERE key IN
+                                         (SELECT key FROM snap_cache ORDER BY last_access
+                                          LIMIT MAX(0, (SELECT COUNT(*) FROM snap_cache) - ?))''',
+                                      (self.max_entries,)).rowcount
+        with self._stats_lock:
+            self.evictions += removed
+
+
+    def clear(self):
+        self._connection().execute('DELETE FROM snap_cache')
+
+
+    def stats(self):
+        '''Hit and miss counts are per process (tagged with its pid); the entry
+        count is for the shared cache.
+        '''
+        lookups = self.hits + self.misses
+        entries = self._connection().execute('SELECT COUNT(*) FROM snap_cache').fetchone()[0]
+        return {'pid': os.getpid(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries}
+
+
+
+def memoize(cache, ttl=None, name=None):
+    '''Decorator for transform functions. Results are keyed on the transform
+    name (the function name, unless given) and the normalized input data;
+    per-request kwargs such as headers are not part of the key. Only
+    successful TransformStatus results are stored, and calls whose input is
+    not plain JSON data are not memoized.
+    '''
+    def decorator(transform_function):
+        cache_name = name or transform_function.__name__
+
+        def memoized(input_data, service_objects, **kwargs):
+            key = cache_key(cache_name, input_data)
+            if key is None:
+                return transform_function(input_data, service_objects, **kwargs)
+            status = cache.get(key)
+            if status is not None:
+                return status
+            status = transform_function(input_data, service_objects, **kwargs)
+            if getattr(status, 'ok', False):
+                cache.set(key, status, ttl)
+            return status
+
+        memoized.__name__ = transform_function.__name__
+        memoized.__doc__ = transform_function.__doc__
+        memoized.cache = cache
+        return memoized
+    return decorator
+
+
+
+def memoize_method(cache, ttl=None, name=None):
+    '''Decorator for service-object methods, keyed on the class and method name
+    and the normalized arguments. None results are not stored, and calls
+    whose arguments are not plain JSON data are not memoized.
+    '''
+    def decorator(method):
+        def memoized(self, *args, **kwargs):
+            cache_name = name or '%s.%s' % (self.__class__.__name__, method.__name__)
+            key = cache_key(cache_name, [args, kwargs])
+            if key is None:
+                return method(self, *args, **kwargs)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            value = method(self, *args, **kwargs)
+            if value is not None:
+                cache.set(key, value, ttl)
+            return value
+
+        memoized.__name__ = method.__name__
+        memoized.__doc__ = method.__doc__
+        memoized.cache = cache
+        return memoized
+    return decorator
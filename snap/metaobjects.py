@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import routegen as rg
-import copy
 import re
 
 valid_function_name_rx = re.compile(r'^(?![0-9])((?!-).)*$')
@@ -13,6 +12,8 @@ class InvalidTransformNameException(Exception):
 
 
 class TransformMeta(object):
+    __slots__ = ('_name', '_route', '_routevars', '_method', '_mime_type', '_input_shape_ref')
+
     def __init__(self,
                  name,
                  route,
@@ -68,13 +69,19 @@ class TransformMeta(object):
         return self._route
 
 
+    def _copy_with(self, **changes):
+        # the route variables only depend on the route, so a copy which keeps
+        # the route can share them instead of re-parsing
+        clone = object.__new__(TransformMeta)
+        for attr in TransformMeta.__slots__:
+            setattr(clone, attr, changes.get(attr, getattr(self, attr)))
+        return clone
+
+
     def set_name(self, name):
-        return TransformMeta(name,
-                             self._route,
-                             self._method,
-                             self._mime_type,
-                             None,
-                             input_shape_name=self._input_shape_ref)
+        if not valid_function_name_rx.match(name):
+            raise InvalidTransformNameException(name)
+        return self._copy_with(_name=name)
 
 
     def set_route(self, route):
@@ -87,20 +94,11 @@ class TransformMeta(object):
 
 
     def set_input_shape(self, input_shape):
-        return TransformMeta(self._name,
-                             self._route,
-                             self._method,
-                             self._mime_type,
-                             input_shape)
+        return self._copy_with(_input_shape_ref=input_shape.name if input_shape else None)
 
 
     def set_method(self, method):
-        return TransformMeta(self._name,
-                             self._route,
-                             method,
-                             self._mime_type,
-                             None,
-                             input_shape_name=self._input_shape_ref)
+        return self._copy_with(_method=method)
 
 
     def data(self, config_data):
@@ -116,6 +114,8 @@ class TransformMeta(object):
 
 
 class DataShapeFieldMeta(object):
+    __slots__ = ('name', 'data_type', 'required')
+
     def __init__(self, name, data_type, is_required=False):
         self.name = name
         self.data_type = data_type
@@ -132,9 +132,15 @@ class DataShapeFieldMeta(object):
 
 
 class DataShapeMeta(object):
+    '''An immutable datashape. Field metaobjects are never modified once created,
+    so every derived shape shares them with the shape it was derived from.
+    '''
+
+    __slots__ = ('_name', '_fields')
+
     def __init__(self, name, field_array):
         self._name = name
-        self._fields = field_array
+        self._fields = tuple(field_array)
 
 
     @property
@@ -153,22 +159,15 @@ class DataShapeMeta(object):
 
 
     def set_name(self, name):
-        fields = copy.deepcopy(self.fields)
-        return DataShapeMeta(name, fields)
+        return DataShapeMeta(name, self._fields)
 
 
     def add_field(self, f_name, f_type, is_required=False):
-        fields = copy.deepcopy(self._fields)
-        fields.append(DataShapeFieldMeta(f_name, f_type, is_required))
-        return DataShapeMeta(self._name, fields)
+        return DataShapeMeta(self._name, self._fields + (DataShapeFieldMeta(f_name, f_type, is_required),))
 
 
     def replace_field(self, name, datashape_field):
-        field_array = copy.deepcopy(self._fields)
-        for i in range(0, len(field_array)):
-            if field_array[i].name == name:
-                field_array[i] = datashape_field
-        return DataShapeMeta(self._name, field_array)
+        return DataShapeMeta(self._name, [datashape_field if f.name == name else f for f in self._fields])
 
 
     def data(self):
@@ -177,12 +176,21 @@ class DataShapeMeta(object):
 
 
 class ServiceObjectMeta(object):
+    __slots__ = ('_name', '_classname', '_init_params')
+
     def __init__(self, name, class_name, **kwargs):
         self._name = name
         self._classname = class_name
-        self._init_params = []
-        for param_name, param_value in kwargs.iteritems():
-            self._init_params.append({'name': param_name, 'value': param_value})
+        self._init_params = tuple({'name': param_name, 'value': param_value}
+                                  for param_name, param_value in kwargs.items())
+
+
+    @classmethod
+    def _from_param_tuple(cls, name, class_name, param_tuple):
+        # param dictionaries are never mutated, so derived objects share them
+        so_meta = cls(name, class_name)
+        so_meta._init_params = param_tuple
+        return so_meta
 
 
     @property
@@ -197,7 +205,7 @@ class ServiceObjectMeta(object):
 
     @property
     def init_params(self):
-        return self._init_params
+        return list(self._init_params)
 
 
     def _params_to_dict(self, param_array):
@@ -217,24 +225,25 @@ class ServiceObjectMeta(object):
 
 
     def set_name(self, name):
-        return ServiceObjectMeta(name, self._classname, **self._params_to_dict(self._init_params))
+        return ServiceObjectMeta._from_param_tuple(name, self._classname, self._init_params)
 
 
     def set_classname(self, classname):
-        return ServiceObjectMeta(self._name, classname, **self._params_to_dict(self._init_params))
+        return ServiceObjectMeta._from_param_tuple(self._name, classname, self._init_params)
 
 
     def add_param(self, name, value):
-        new_param_list = copy.deepcopy(self._init_params)
-        new_param_list.append({'name': name, 'value': value})
-        params = self._params_to_dict(new_param_list)
-
-        return ServiceObjectMeta(self._name, self._classname, **params)
+        new_param = {'name': name, 'value': value}
+        if self.find_param_by_name(name):
+            params = tuple(new_param if p['name'] == name else p for p in self._init_params)
+        else:
+            params = self._init_params + (new_param,)
+        return ServiceObjectMeta._from_param_tuple(self._name, self._classname, params)
 
 
     def add_params(self, **kwargs):
         updated_so = self
-        for name, value in kwargs.iteritems():
+        for name, value in kwargs.items():
             updated_so = updated_so.add_param(name, value)
         return updated_so
 
@@ -244,24 +253,22 @@ class ServiceObjectMeta(object):
         if not param:
             return self
 
-        new_param_list = copy.deepcopy(self._init_params)
-        new_param_list.remove(param)
-        params = {}
-        for p in new_param_list:
-            params[p['name']] = p['value']
-
-        return ServiceObjectMeta(self._name, self._classname, **params)
+        params = tuple(p for p in self._init_params if p is not param)
+        return ServiceObjectMeta._from_param_tuple(self._name, self._classname, params)
 
 
     def data(self):
         result = {'name': self._name,
                   'class': self._classname,
-                  'init_params': self._init_params}
+                  'init_params': list(self._init_params)}
         return result
 
 
 
 class GlobalSettingsMeta(object):
+    __slots__ = ('_app_name', '_bind_host', '_port', '_debug', '_transform_module', '_service_module',
+                 '_preprocessor_module', '_project_directory', '_logfile')
+
     def __init__(self, app_name, **kwargs):
         self._app_name = app_name
         self._bind_host = kwargs.get('bind_host') or '127.0.0.1'
@@ -276,66 +283,125 @@ class GlobalSettingsMeta(object):
 
     @property
     def current_values(self):
-        original_attrs = self.__dict__
         attrs = {}
-        for key in original_attrs:
+        for key in GlobalSettingsMeta.__slots__:
             if key != '_app_name':
-                attrs[key.lstrip('_')] = original_attrs[key]
+                attrs[key.lstrip('_')] = getattr(self, key)
         return attrs
 
 
-    def set_bind_host(self, host):
+    def _set(self, setting_name, value):
         new_attrs = self.current_values
-        new_attrs['bind_host'] = host
+        new_attrs[setting_name] = value
         return GlobalSettingsMeta(self._app_name, **new_attrs)
 
 
+    def set_bind_host(self, host):
+        return self._set('bind_host', host)
+
+
     def set_app_name(self, name):
         new_attrs = self.current_values
         return GlobalSettingsMeta(name, **new_attrs)
 
 
     def set_port(self, port):
-        new_attrs = self.current_values
-        new_attrs['port'] = port
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('port', port)
 
 
     def set_debug(self, debug_status):
-        new_attrs = self.current_values
-        new_attrs['debug'] = debug_status
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('debug', debug_status)
 
 
     def set_transform_module(self, transform_module_name):
-        new_attrs = self.current_values
-        new_attrs['transform_module'] = transform_module_name
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('transform_module', transform_module_name)
 
 
     def set_service_module(self, service_module_name):
-        new_attrs = self.current_values
-        new_attrs['service_module'] = service_module_name
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('service_module', service_module_name)
 
 
     def set_preprocessor_module(self, preprocessor_module_name):
-        new_attrs = self.current_values
-        new_attrs['preprocessor_module'] = preprocessor_module_name
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('preprocessor_module', preprocessor_module_name)
 
 
     def set_project_directory(self, project_directory):
-        new_attrs = self.current_values
-        new_attrs['project_directory'] = project_directory
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('project_directory', project_directory)
 
 
     def set_logfile(self, logfile):
-        new_attrs = self.current_values
-        new_attrs['logfile'] = logfile
-        return GlobalSettingsMeta(self._app_name, **new_attrs)
+        return self._set('logfile', logfile)
 
 
     def data(self):
         return self.current_values
+
+
+
+class MetaObjectCollection(object):
+    '''An ordered collection of named metaobjects with a name index, so that
+    lookups and single-item replacements don't scan the whole config.
+    '''
+
+    __slots__ = ('_items', '_index')
+
+    def __init__(self, metaobjects=None):
+        self._items = []
+        self._index = {}
+        for obj in metaobjects or []:
+            self.append(obj)
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+    def __getitem__(self, position):
+        return self._items[position]
+
+
+    def __setitem__(self, position, obj):
+        previous = self._items[position]
+        if position < 0:
+            position += len(self._items)
+        if self._index.get(previous.name) == position:
+            del self._index[previous.name]
+        self._items[position] = obj
+        self._index[obj.name] = position
+
+
+    @property
+    def names(self):
+        return [obj.name for obj in self._items]
+
+
+    def append(self, obj):
+        self._index[obj.name] = len(self._items)
+        self._items.append(obj)
+
+
+    def find(self, name):
+        position = self._index.get(name)
+        if position is None:
+            return None
+        return self._items[position]
+
+
+    def index_of(self, name):
+        return self._index.get(name, -1)
+
+
+    def replace(self, name, obj):
+        position = self.index_of(name)
+        if position < 0:
+            self.append(obj)
+        else:
+            self[position] = obj
+
+
+    def as_dict(self):
+        return dict((obj.name, obj) for obj in self._items)
@@ -16,6 +16,9 @@ Arguments:
 Options:
         --env=<environment>             named execution context in config file
 
+Sizing (workers, connections, keepalive, backlog, upstream protocol) comes from
+the "tuning" section of the config file; see snap/tuning.py for the defaults.
+GET transforms with an "edge_cache" block are cached by nginx (snap/edgecache.py).
 """
 
 
@@ -23,7 +26,10 @@ from docopt import docopt
 import yaml
 import jinja2
 import os, sys
-import common
+from snap import common
+from snap import config_templates
+from snap import tuning
+from snap import edgecache
 
 
 class NginxConfig():
@@ -63,14 +69,15 @@ def main():
     config_filename = common.full_path(args['<configfile>'])
     yaml_config = common.read_config_file(config_filename)
     configs = load_nginx_config_table(yaml_config)
-    template_mgr = common.get_template_mgr_for_location('templates')
-    config_template = template_mgr.get_template('nginx_config.j2')
+    tuning_settings = tuning.load_tuning_settings(yaml_config)
+    edge_cache_rules = edgecache.load_edge_cache_rules(yaml_config)
+    config_template = jinja2.Environment().from_string(config_templates.NGINX_CONFIG)
 
     # show all the configurations
     #
     if args['-l'] or args['--list']:        
         for key in configs.keys():
-            print configs[key]
+            print(configs[key])
 
         exit(0)
         
@@ -81,17 +88,19 @@ def main():
 
     if args['<configfile>'] and not config_name:
         if len(configs.keys()) > 1:
-            print 'Multiple configurations found. Please specify one.'
+            print('Multiple configurations found. Please specify one.')
             exit(0)        
-        output = config_template.render(nginx_config=configs.values()[0])
+        output = config_template.render(nginx_config=list(configs.values())[0], tuning=tuning_settings,
+                                        edge_cache_rules=edge_cache_rules)
         
     else:
         if not configs.get(config_name):
-            print 'No nginx configuration labeled "%s" in %s.' % (config_name, config_filename)
+            print('No nginx configuration labeled "%s" in %s.' % (config_name, config_filename))
             exit(0)
-        output = config_template.render(nginx_config=configs[config_name])
+        output = config_template.render(nginx_config=configs[config_name], tuning=tuning_settings,
+                                        edge_cache_rules=edge_cache_rules)
         
-    print output
+    print(output)
     exit(0)
         
 
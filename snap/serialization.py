@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#
+# response encoding for snap transforms
+#
+# A transform may return its output already serialized (a str or bytes), which
+# is sent as it is, or as plain Python data, which the framework encodes for the
+# response mimetype. A transform which declares more than one output mimetype:
+#
+#   transforms:
+#       report:
+#           route:              /report
+#           method:             GET
+#           input_shape:        report
+#           output_mimetype:    application/json, text/csv
+#
+# responds in whichever of them the request's Accept header prefers (the first
+# one if it has no preference).
+#
+# JSON is encoded with orjson and MessagePack with msgpack when those packages
+# are installed (pip install snap-micro[orjson,msgpack]); without orjson, the
+# standard library's json is used, with the same compact separators.
+#
+# Output which is an iterator (a generator, or the stream returned by
+# JinjaTemplateManager.stream) is sent as it is, chunk by chunk.
+#
+
+
+import io
+import csv
+import collections.abc
+import json
+import decimal
+import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MIMETYPE_JSON = 'application/json'
+MIMETYPE_CSV = 'text/csv'
+MIMETYPE_TEXT = 'text/plain'
+MIMETYPE_MSGPACK = 'application/msgpack'
+MIMETYPE_X_MSGPACK = 'application/x-msgpack'
+
+
+class NoEncoderException(Exception):
+    def __init__(self, mimetype):
+        Exception.__init__(self, 'Transform output is not serialized, and there is no encoder for mimetype "%s".' % mimetype)
+
+
+def parse_mimetypes(output_mimetype):
+    '''The output_mimetype setting of a transform, as a list: either a list
+    already, or a comma-separated string.
+    '''
+    if isinstance(output_mimetype, (list, tuple)):
+        return [m.strip() for m in output_mimetype]
+    return [m.strip() for m in output_mimetype.split(',') if m.strip()]
+
+
+def encodable_value(obj):
+    '''Stand-ins for values which have no JSON (or MessagePack) form.'''
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, complex):
+        return [obj.real, obj.imag]
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('Object of type %s is not serializable' % obj.__class__.__name__)
+
+
+
+class JSONEncoder(object):
+    mimetype = MIMETYPE_JSON
+
+    def __init__(self):
+        # one encoder instance for every call; json.dumps(..., default=...)
+        # would build a new one each time
+        self._encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=encodable_value)
+
+
+    def encode(self, data):
+        if orjson is not None:
+            return orjson.dumps(data, default=encodable_value, option=orjson.OPT_NON_STR_KEYS)
+        return self._encoder.encode(data).encode('utf-8')
+
+
+
+class MessagePackEncoder(object):
+    mimetype = MIMETYPE_MSGPACK
+
+    def encode(self, data):
+        # (msgpack.Packer instances are not thread-safe, so none is shared)
+        return msgpack.packb(data, default=encodable_value, use_bin_type=True)
+
+
+
+class CSVEncoder(object):
+    '''Encodes a list of dicts (one row each, with a header row of every key in
+    order of first appearance), a list of lists, or a single dict.
+    '''
+    mimetype = MIMETYPE_CSV
+
+    def encode(self, data):
+        if isinstance(data, dict):
+            data = [data]
+        output = io.StringIO()
+        if data and isinstance(data[0], dict):
+            fieldnames = []
+            seen = set()
+            for record in data:
+                for key in record:
+                    if key not in seen:
+                        seen.add(key)
+                        fieldnames.append(key)
+            writer = csv.DictWriter(output, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(data)
+        else:
+            csv.writer(output).writerows(data)
+        return output.getvalue().encode('utf-8')
+
+
+
+class TextEncoder(object):
+    mimetype = MIMETYPE_TEXT
+
+    def encode(self, data):
+        return str(data).encode('utf-8')
+
+
+
+_encoders = {}
+
+
+def register_encoder(mimetype, encoder):
+    '''Use encoder (an object with an encode(data) method returning bytes) for
+    unserialized output sent as mimetype.
+    '''
+    _encoders[mimetype] = encoder
+
+
+def encoder_for(mimetype):
+    encoder = _encoders.get(mimetype)
+    if encoder is None:
+        raise NoEncoderException(mimetype)
+    return encoder
+
+
+register_encoder(MIMETYPE_JSON, JSONEncoder())
+register_encoder(MIMETYPE_CSV, CSVEncoder())
+register_encoder(MIMETYPE_TEXT, TextEncoder())
+if msgpack is not None:
+    register_encoder(MIMETYPE_MSGPACK, MessagePackEncoder())
+    register_encoder(MIMETYPE_X_MSGPACK, _encoders[MIMETYPE_MSGPACK])
+
+
+def negotiate(http_request, mimetypes):
+    '''The one of a transform's mimetypes which the request's Accept header
+    prefers; the first of them if the header is missing or matches none.
+    '''
+    return http_request.accept_mimetypes.best_match(mimetypes, default=mimetypes[0]) or mimetypes[0]
+
+
+def encode(output_data, mimetype):
+    '''Response body for a transform's output: serialized output (str or
+    bytes), streamed output (an iterator) and None are sent as they are,
+    anything else is encoded.
+    '''
+    if output_data is None or isinstance(output_data, (str, bytes, collections.abc.Iterator)):
+        return output_data
+    return encoder_for(mimetype).encode(output_data)
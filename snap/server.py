@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+#
+# prefork WSGI server for snap microservices
+#
+# The master process loads the app (and with it the snap config) once, binds a
+# single listening socket and forks N workers which share it. Each worker serves
+# requests from a bounded thread pool with HTTP keep-alive. A connection holds
+# a thread while it is open, so keep-alive is only offered while the worker has
+# a thread to spare: the response which fills the last free thread closes its
+# connection rather than letting it sit idle in the only free slot.
+#
+# Signals handled by the master:
+#
+#   TERM, INT   graceful shutdown (workers finish in-flight requests)
+#   HUP         graceful worker restart (fresh workers are forked, old ones are
+#               drained); the new workers are forked from the master, so they
+#               run the app and config it loaded at startup. To deploy new
+#               code or config, restart the master.
+#   QUIT        immediate shutdown
+#
+
+
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from snap import common
+from snap.loggers import server_logger as log
+
+
+DEFAULT_THREADS = 2
+DEFAULT_KEEPALIVE = 5
+DEFAULT_MAX_REQUESTS = 0
+DEFAULT_BACKLOG = 1024
+DEFAULT_GRACEFUL_TIMEOUT = 30
+WORKER_POLL_INTERVAL = 0.5
+
+
+def default_worker_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def create_listening_socket(host, port, backlog=DEFAULT_BACKLOG):
+    address_family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(address_family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # lets a restarted master bind while old workers are still draining
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    return sock
+
+
+
+class SnapRequestHandler(WSGIRequestHandler):
+    def setup(self):
+        keepalive = self.server.keepalive
+        if keepalive:
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = keepalive
+        else:
+            self.protocol_version = 'HTTP/1.0'
+        WSGIRequestHandler.setup(self)
+
+
+    def run_wsgi(self):
+        try:
+            return WSGIRequestHandler.run_wsgi(self)
+        finally:
+            self.server.request_completed()
+            if not self.server.accepting or self.server.saturated:
+                self.close_connection = True
+
+
+
+class WorkerServer(BaseWSGIServer):
+    '''A WSGI server bound to an inherited listening socket, which hands
+    connections to a bounded thread pool.
+    '''
+
+    def __init__(self, listen_socket, app, threads=DEFAULT_THREADS, keepalive=DEFAULT_KEEPALIVE,
+                 max_requests=DEFAULT_MAX_REQUESTS):
+        self.multithread = threads > 1
+        self.keepalive = keepalive
+        self.max_requests = max_requests
+        self.accepting = True
+        self.requests_handled = 0
+        self.threads = threads
+        self.open_connections = 0
+        self._count_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        host, port = listen_socket.getsockname()[:2]
+        BaseWSGIServer.__init__(self, host, port, app, handler=SnapRequestHandler, fd=listen_socket.fileno())
+        self.timeout = WORKER_POLL_INTERVAL
+
+
+    def process_request(self, request, client_address):
+        # block the accept loop while every thread is busy, so that pending
+        # connections stay in the shared backlog for the other workers
+        self._slots.acquire()
+        with self._count_lock:
+            self.open_connections += 1
+        self._pool.submit(self._process_request_in_thread, request, client_address)
+
+
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._count_lock:
+                self.open_connections -= 1
+            self._slots.release()
+
+
+    @property
+    def saturated(self):
+        '''True when every thread is holding a connection.'''
+        return self.open_connections >= self.threads
+
+
+    def request_completed(self):
+        with self._count_lock:
+            self.requests_handled += 1
+            if self.max_requests and self.requests_handled >= self.max_requests:
+                self.accepting = False
+
+
+    def stop_accepting(self, signum=None, frame=None):
+        self.accepting = False
+
+
+    def run(self):
+        while self.accepting:
+            self.handle_request()
+        # drain in-flight requests before the worker exits
+        self._pool.shutdown(wait=True)
+        self.server_close()
+
+
+
+class PreforkServer(object):
+    def __init__(self, app, host, port, **kwargs):
+        self.app = app
+        self.host = host
+        self.port = int(port)
+        self.num_workers = int(kwargs.get('workers') or default_worker_count())
+        self.threads = int(kwargs.get('threads') or DEFAULT_THREADS)
+        keepalive = kwargs.get('keepalive')
+        self.keepalive = DEFAULT_KEEPALIVE if keepalive is None else float(keepalive)
+        self.max_requests = int(kwargs.get('max_requests') or DEFAULT_MAX_REQUESTS)
+        self.backlog = int(kwargs.get('backlog') or DEFAULT_BACKLOG)
+        self.graceful_timeout = float(kwargs.get('graceful_timeout') or DEFAULT_GRACEFUL_TIMEOUT)
+        self.workers = {}
+        self.retiring_workers = {}
+        self.listen_socket = None
+        self._stopping = False
+        self._restart_requested = False
+
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return pid
+
+        # --- in the worker process ---
+        # drop the master's handlers at once: its QUIT handler would kill this
+        # worker's siblings, and its TERM/INT handlers would be ignored here
+        for sig in (signal.SIGHUP, signal.SIGCHLD, signal.SIGQUIT, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            common.run_worker_start_hooks()
+            server = WorkerServer(self.listen_socket,
+                                  self.app,
+                                  threads=self.threads,
+                                  keepalive=self.keepalive,
+                                  max_requests=self.max_requests)
+            signal.signal(signal.SIGTERM, server.stop_accepting)
+            signal.signal(signal.SIGINT, server.stop_accepting)
+            server.run()
+        except Exception:
+            log.error('snap worker %d failed:', os.getpid(), exc_info=1)
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+
+    def handle_stop(self, signum, frame):
+        self._stopping = True
+
+
+    def handle_restart(self, signum, frame):
+        self._restart_requested = True
+
+
+    def handle_quit(self, signum, frame):
+        self.signal_workers(signal.SIGKILL, list(self.workers) + list(self.retiring_workers))
+        sys.exit(1)
+
+
+    def signal_workers(self, sig, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError as err:
+                if err.errno != errno.ESRCH:
+                    raise
+
+
+    def reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            self.workers.pop(pid, None)
+            self.retiring_workers.pop(pid, None)
+
+
+    def restart_workers(self):
+        log.info('graceful restart: replacing %d worker(s).' % len(self.workers))
+        now = time.time()
+        for pid in list(self.workers):
+            self.retiring_workers[pid] = now
+            del self.workers[pid]
+        self.signal_workers(signal.SIGTERM, list(self.retiring_workers))
+
+
+    def kill_stragglers(self):
+        deadline = time.time() - self.graceful_timeout
+        stragglers = [pid for pid, retired_at in self.retiring_workers.items() if retired_at < deadline]
+        self.signal_workers(signal.SIGKILL, stragglers)
+
+
+    def run(self):
+        self.listen_socket = create_listening_socket(self.host, self.port, self.backlog)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+        signal.signal(signal.SIGQUIT, self.handle_quit)
+
+        log.info('snap master %d listening on %s:%d with %d worker(s) x %d thread(s).'
+                 % (os.getpid(), self.host, self.port, self.num_workers, self.threads))
+        try:
+            while not self._stopping:
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self.restart_workers()
+
+                self.reap_workers()
+                # replaces workers which were recycled (max_requests) or crashed
+                while len(self.workers) < self.num_workers:
+                    self.spawn_worker()
+
+                self.kill_stragglers()
+                time.sleep(WORKER_POLL_INTERVAL)
+        finally:
+            self.shutdown()
+
+
+    def shutdown(self):
+        active_workers = list(self.workers) + list(self.retiring_workers)
+        self.signal_workers(signal.SIGTERM, active_workers)
+        deadline = time.time() + self.graceful_timeout
+        while (self.workers or self.retiring_workers) and time.time() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        self.signal_workers(signal.SIGKILL, list(self.workers) + list(self.retiring_workers))
+        self.reap_workers()
+        if self.listen_socket:
+            self.listen_socket.close()
+
+
+
+def serve(app, host, port, **kwargs):
+    '''Serve a WSGI app (normally a generated snap routing module's "app") with
+    the prefork server. Keyword args are the settings from the "server" section
+    of the snap config: workers, threads, keepalive, max_requests, backlog and
+    graceful_timeout.
+    '''
+    if not hasattr(os, 'fork'):
+        # no prefork on this platform; fall back to one threaded process
+        from werkzeug.serving import run_simple
+        run_simple(host, int(port), app, threaded=True)
+        return
+    PreforkServer(app, host, port, **kwargs).run()
@@ -5,19 +5,21 @@
 #
 # 
 
-from flask import Flask
-import argparse
 import sys, os
-import yaml
 from snap import core
 from snap import common
+from snap import startup
+from snap import loggers
 
 
 HTTP_OK = 200
 HTTP_BAD_REQUEST = 400
 HTTP_NOT_FOUND = 404
+HTTP_PAYLOAD_TOO_LARGE = 413
 HTTP_DEFAULT_ERRORCODE = 400
 HTTP_NOT_IMPLEMENTED = 500
+HTTP_SERVICE_UNAVAILABLE = 503
+HTTP_GATEWAY_TIMEOUT = 504
 
 MIMETYPE_JSON = 'application/json'
 CONFIG_FILE_ENV_VAR = 'BUTTONIZE_CFG'
@@ -56,6 +58,7 @@ class TransformNotImplementedException(Exception):
 def load_snap_config(mode, app):
     config_file_path = None
     if mode == 'standalone':
+        import argparse
         parser = argparse.ArgumentParser()
         parser.add_argument("--configfile",
                             metavar='<configfile>',
@@ -82,49 +85,80 @@ def load_snap_config(mode, app):
 
 
 def initialize_services(yaml_config_obj):
-    service_objects = {}
+    service_specs = {}
     configured_services = yaml_config_obj.get('service_objects')
     if configured_services is None:
         configured_services = []
     for service_object_name in configured_services:
         config_segment = yaml_config_obj['service_objects'][service_object_name]
         service_object_classname = config_segment['class']
-        service_module_name = yaml_config_obj['globals']['service_module']
+        # built-in service classes (e.g. snap.sql_services) name their own module
+        service_module_name = config_segment.get('module') or yaml_config_obj['globals']['service_module']
         parameter_array = config_segment['init_params'] or []
 
+        raw_params = dict((param['name'], param['value']) for param in parameter_array)
+        klass = common.load_class(service_object_classname, service_module_name)
+        service_specs[service_object_name] = (klass, raw_params)
+
+    return create_services(service_specs)
+
+
+def create_services(service_specs):
+    '''Instantiate service objects from {name: (class, init params)}. Param
+    values naming environment variables ($VAR) are read from the environment here.
+    '''
+    service_objects = {}
+    for service_object_name, (klass, raw_params) in service_specs.items():
         param_tbl = {}
-        for param in parameter_array:
-            param_name = param['name']
-            raw_param_value = param['value']
+        for param_name, raw_param_value in raw_params.items():
+            param_tbl[param_name] = common.load_config_var(raw_param_value)
 
-            param_value = common.load_config_var(raw_param_value)
-            param_tbl[param_name] = param_value
+        service_objects[service_object_name] = klass(**param_tbl)
 
-        klass = common.load_class(service_object_classname, service_module_name)
-        service_object = klass(**param_tbl)
-        service_objects[service_object_name] = service_object
-        
     return service_objects
-    
 
-def setup(app):
-    if app.config.get('initialized'):
-        return app
-        
+
+def configure_app(app, yaml_config, service_object_tbl):
+    with startup.phase('configure logging'):
+        loggers.configure()
     mode = app.config.get('startup_mode')
-    yaml_config = load_snap_config(mode, app)
     app.debug = yaml_config['globals']['debug']
-    service_object_tbl = initialize_services(yaml_config)
+    common.set_production_mode(mode == 'server' and not app.debug)
     #
     # load the service objects into the app
     #
-    app.config['services'] = common.ServiceObjectRegistry(service_object_tbl) 
+    app.config['services'] = common.ServiceObjectRegistry(service_object_tbl,
+                                                          yaml_config['globals'].get('gather_workers'))
+    #
+    # settings for the prefork server (see snap.server)
+    #
+    app.config['bind_host'] = yaml_config['globals'].get('bind_host', '127.0.0.1')
+    app.config['port'] = yaml_config['globals'].get('port')
+    app.config['server_settings'] = yaml_config.get('server') or {}
     app.config['initialized'] = True
     return app
-    
-
-
-
 
 
+def setup(app):
+    if app.config.get('initialized'):
+        return app
+        
+    mode = app.config.get('startup_mode')
+    with startup.phase('load config'):
+        yaml_config = load_snap_config(mode, app)
+    with startup.phase('initialize services'):
+        service_object_tbl = initialize_services(yaml_config)
+    return configure_app(app, yaml_config, service_object_tbl)
+
+
+def setup_compiled(app, compiled_config, service_specs):
+    '''setup() for compiled routing modules (routegen --compiled), which embed
+    their config and import their service classes directly, so nothing is
+    read from disk here.
+    '''
+    if app.config.get('initialized'):
+        return app
 
+    with startup.phase('initialize services'):
+        service_object_tbl = create_services(service_specs)
+    return configure_app(app, compiled_config, service_object_tbl)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+#
+# stock SQLAlchemy service object for snap microservices
+#
+# Usage in the service_objects section of the config file:
+#
+#   service_objects:
+#       db:
+#           class:  SQLService
+#           module: snap.sql_services
+#           init_params:
+#               - name: url
+#                 value: $DATABASE_URL
+#               - name: pool_size
+#                 value: 10
+#
+# Requires SQLAlchemy 1.4.33 or later.
+#
+
+
+import os
+import weakref
+from contextlib import contextmanager
+import sqlalchemy
+from sqlalchemy import text, table, column
+
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_BATCH_SIZE = 1000
+
+
+class MissingDatabaseURLException(Exception):
+    def __init__(self):
+        Exception.__init__(self, 'SQLService requires a "url" init param (an SQLAlchemy database URL).')
+
+
+class UnsupportedUpsertDialectException(Exception):
+    def __init__(self, dialect_name):
+        Exception.__init__(self, 'Upserts are not supported for the "%s" dialect; use postgresql, sqlite or mysql.'
+                           % dialect_name)
+
+
+# every live SQLService, for the fork hook below
+_services = weakref.WeakSet()
+
+
+def _reset_pools():
+    # prefork workers must not share the master's pooled sockets
+    for service in list(_services):
+        service._reset_pool()
+
+
+if hasattr(os, 'register_at_fork'):
+    # one hook for all services: a hook per service would keep each one (and
+    # its engine) alive for the life of the process
+    os.register_at_fork(after_in_child=_reset_pools)
+
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', '1')
+    return bool(value)
+
+
+
+class SQLService(object):
+    '''A database service object with a tuned connection pool.
+
+    Pool settings (init params): pool_size, max_overflow, pool_timeout,
+    pool_recycle (seconds before a connection is replaced, which should be
+    shorter than the server's idle timeout) and pool_pre_ping (check each
+    connection on checkout, so that dropped connections are replaced instead
+    of failing the request). query_cache_size sizes SQLAlchemy's compiled
+    statement cache.
+
+    SQLite databases are pooled by SQLAlchemy's own per-dialect rules, so the
+    sizing settings are ignored for them.
+    '''
+
+    def __init__(self, **kwargs):
+        self.url = kwargs.get('url')
+        if not self.url:
+            raise MissingDatabaseURLException()
+
+        engine_args = {
+            'pool_pre_ping': as_bool(kwargs.get('pool_pre_ping', True)),
+            'pool_recycle': int(kwargs.get('pool_recycle') or DEFAULT_POOL_RECYCLE),
+            'echo': as_bool(kwargs.get('echo', False))
+        }
+        if not self.url.startswith('sqlite'):
+            engine_args['pool_size'] = int(kwargs.get('pool_size') or DEFAULT_POOL_SIZE)
+            engine_args['max_overflow'] = int(kwargs.get('max_overflow') or DEFAULT_MAX_OVERFLOW)
+            engine_args['pool_timeout'] = int(kwargs.get('pool_timeout') or DEFAULT_POOL_TIMEOUT)
+        if kwargs.get('query_cache_size') is not None:
+            engine_args['query_cache_size'] = int(kwargs['query_cache_size'])
+
+        self.batch_size = int(kwargs.get('batch_size') or DEFAULT_BATCH_SIZE)
+        self.engine = sqlalchemy.create_engine(self.url, **engine_args)
+        _services.add(self)
+
+
+    def _reset_pool(self):
+        self.engine.dispose(close=False)
+
+
+    @contextmanager
+    def connect(self):
+        '''A connection in a transaction, committed on success and rolled back on error.'''
+        with self.engine.begin() as connection:
+            yield connection
+
+
+    def execute(self, sql, params=None):
+        '''Run a statement; returns the rows (as dicts) if it produced any.'''
+        with self.connect() as connection:
+            result = connection.execute(text(sql), params or {})
+            if result.returns_rows:
+                return [dict(row._mapping) for row in result]
+            return []
+
+
+    def stream_query(self, sql, params=None, batch_size=None):
+        '''Yields rows (as dicts) from a query using a server-side cursor where the
+        driver supports one, fetching batch_size rows at a time, so a large
+        result is never held in memory all at once.
+        '''
+        batch_size = batch_size or self.batch_size
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, max_row_buffer=batch_size)\
+                               .execute(text(sql), params or {})
+            try:
+                for batch in result.partitions(batch_size):
+                    for row in batch:
+                        yield dict(row._mapping)
+            finally:
+                result.close()
+
+
+    def _batches(self, records, batch_size):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+    def _table(self, table_name, records):
+        return table(table_name, *[column(name) for name in records[0]])
+
+
+    def insert_many(self, table_name, records, batch_size=None):
+        '''Insert an iterable of dicts (all with the same keys) with one
+        executemany per batch, in a single transaction. Returns the row count.
+        '''
+        count = 0
+        with self.connect() as connection:
+            for batch in self._batches(records, batch_size or self.batch_size):
+                connection.execute(self._table(table_name, batch).insert(), batch)
+                count += len(batch)
+        return count
+
+
+    def _upsert_statement(self, target, key_columns, update_columns):
+        dialect_name = self.engine.dialect.name
+        if dialect_name in ('postgresql', 'sqlite'):
+            if dialect_name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            statement = insert(target)
+            return statement.on_conflict_do_update(index_elements=key_columns,
+                                                   set_=dict((c, statement.excluded[c]) for c in update_columns))
+        if dialect_name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(target)
+            return statement.on_duplicate_key_update(dict((c, statement.inserted[c]) for c in update_columns))
+        raise UnsupportedUpsertDialectException(dialect_name)
+
+
+    def upsert_many(self, table_name, records, key_columns, update_columns=None, batch_size=None):
+        '''Insert or update an iterable of dicts, matching existing rows on
+        key_columns (which need a unique index). By default every non-key
+        column is updated. Returns the number of records written.
+        '''
+        count = 0
+        with self.connect() as connection:
+            for batch in self._batches(records, batch_size or self.batch_size):
+                target = self._table(table_name, batch)
+                columns = update_columns or [c for c in batch[0] if c not in key_columns]
+                connection.execute(self._upsert_statement(target, key_columns, columns), batch)
+                count += len(batch)
+        return count
+
+
+    def dispose(self):
+        self.engine.dispose()
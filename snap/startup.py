@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+#
+# startup profiling for snap apps: import-time costs by module, and the time
+# spent in each phase of snap.setup
+#
+# Used by "snapserve --startup-profile", which loads the app under the profiler,
+# prints the report and exits instead of serving.
+#
+
+
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+
+DEFAULT_REPORT_SIZE = 25
+
+# (phase name, seconds) in the order the phases ran
+_phases = []
+
+
+@contextmanager
+def phase(name):
+    '''Time one step of app startup. Cheap enough to leave in place whether or
+    not a profile is being taken.
+    '''
+    started = time.time()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.time() - started))
+
+
+def setup_phases():
+    return list(_phases)
+
+
+
+class _TimedLoader(object):
+    '''Wraps a module loader to time exec_module, which is where an import
+    spends its time (running the module body and its own imports).
+    '''
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+
+    def exec_module(self, module):
+        self._profiler.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.exit(module.__name__)
+
+
+
+class ImportProfiler(object):
+    '''A meta path finder which records, for every module imported while it is
+    installed, the total import time and the time excluding nested imports.
+    '''
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+        self._local = threading.local()
+
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self._local, 'finding', False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                        spec.loader = _TimedLoader(spec.loader, self)
+                    return spec
+            return None
+        finally:
+            self._local.finding = False
+
+
+    def enter(self, module_name):
+        self._stack.append([module_name, time.time(), 0.0])
+
+
+    def exit(self, module_name):
+        name, started, nested = self._stack.pop()
+        total = time.time() - started
+        self.timings[name] = (total, total - nested)
+        if self._stack:
+            self._stack[-1][2] += total
+
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+
+
+def format_report(import_profiler, total_time, size=DEFAULT_REPORT_SIZE):
+    lines = ['snap startup profile: %.1f ms total' % (total_time * 1000), '',
+             'slowest imports (ms, excluding nested imports / including them):']
+    ranked = sorted(import_profiler.timings.items(), key=lambda item: item[1][1], reverse=True)
+    for module_name, (total, own) in ranked[:size]:
+        lines.append('    %8.1f %8.1f  %s' % (own * 1000, total * 1000, module_name))
+
+    lines.extend(['', 'setup phases (ms):'])
+    for name, elapsed in setup_phases():
+        lines.append('    %8.1f  %s' % (elapsed * 1000, name))
+    return '\n'.join(lines)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#
+# tuning settings for the nginx and uWSGI configs generated by ngen and uwsgen
+#
+# Both generators read the same "tuning" section of the snap config, so the
+# front end and the app server are sized against each other: the nginx workers
+# together keep no more idle upstream connections than uWSGI has request slots
+# (nginx's keepalive is per worker, so each gets its share), and the nginx and
+# uWSGI listen backlogs match.
+#
+
+
+import multiprocessing
+
+
+UPSTREAM_PROTOCOLS = ['uwsgi', 'http']
+
+
+class InvalidTuningSettingException(Exception):
+    def __init__(self, key):
+        Exception.__init__(self, 'Unknown setting "%s" in the tuning section. Valid settings are %s.'
+                           % (key, ', '.join(sorted(TUNING_DEFAULTS))))
+
+
+class UnknownUpstreamProtocolException(Exception):
+    def __init__(self, protocol):
+        Exception.__init__(self, 'Unknown upstream protocol "%s". Valid protocols are %s.'
+                           % (protocol, ', '.join(UPSTREAM_PROTOCOLS)))
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+# settings whose defaults are None are derived from the others (see TuningSettings)
+TUNING_DEFAULTS = {
+    # nginx
+    'nginx_worker_processes': None,         # one per CPU
+    'worker_connections': 4096,
+    'worker_rlimit_nofile': None,           # 2 x worker_connections (client + upstream side)
+    'keepalive_timeout': 65,
+    'keepalive_requests': 1000,
+    'upstream_keepalive': None,             # idle upstream connections cached per nginx worker
+    'client_max_body_size': '75M',
+    'cache_path': '/var/cache/nginx/snap',  # edge cache (see snap/edgecache.py)
+    'cache_zone_size': '10m',
+    'cache_max_size': '1g',
+    'cache_inactive': '10m',
+    'cache_lock_timeout': '5s',
+    # shared
+    'backlog': 1024,
+    'protocol': 'uwsgi',                    # uwsgi, or http to keep upstream connections alive
+    # uWSGI
+    'processes': None,                      # one per CPU
+    'threads': 2,
+    'buffer_size': 32768,
+    'harakiri': 30,
+    'max_requests': 5000,
+    'lazy_apps': True,
+}
+
+
+class TuningSettings(object):
+    def __init__(self, **kwargs):
+        for key in kwargs:
+            if key not in TUNING_DEFAULTS:
+                raise InvalidTuningSettingException(key)
+
+        settings = dict(TUNING_DEFAULTS)
+        settings.update((key, value) for key, value in kwargs.items() if value is not None)
+
+        if settings['protocol'] not in UPSTREAM_PROTOCOLS:
+            raise UnknownUpstreamProtocolException(settings['protocol'])
+
+        cpus = cpu_count()
+        if settings['nginx_worker_processes'] is None:
+            settings['nginx_worker_processes'] = cpus
+        if settings['processes'] is None:
+            settings['processes'] = cpus
+        if settings['worker_rlimit_nofile'] is None:
+            settings['worker_rlimit_nofile'] = 2 * settings['worker_connections']
+        if settings['upstream_keepalive'] is None:
+            request_slots = settings['processes'] * settings['threads']
+            # worker_processes may also be nginx's "auto" (one per CPU)
+            nginx_workers = settings['nginx_worker_processes']
+            nginx_workers = nginx_workers if isinstance(nginx_workers, int) else cpus
+            settings['upstream_keepalive'] = max(1, request_slots // nginx_workers)
+
+        self._settings = settings
+
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_settings'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+    @property
+    def keepalive_upstream(self):
+        '''nginx can only reuse upstream connections over HTTP/1.1; the uwsgi
+        protocol closes the connection after every request.
+        '''
+        return self.protocol == 'http'
+
+
+    def data(self):
+        return dict(self._settings)
+
+
+
+def load_tuning_settings(yaml_config):
+    return TuningSettings(**(yaml_config.get('tuning') or {}))
@@ -27,9 +27,10 @@ setup(
     author='Dexter Taylor',
     author_email='binarymachineshop@gmail.com',
     platforms=['any'],
-    scripts=['scripts/routegen', 'scripts/uwsgen', 'scripts/snapconfig'],
+    scripts=['scripts/routegen', 'scripts/uwsgen', 'scripts/snapconfig', 'scripts/snapserve', 'scripts/snapreplay'],
     packages=find_packages(),
     install_requires=reqs,                    
+    extras_require={'orjson': ['orjson'], 'msgpack': ['msgpack']},
     test_suite='tests',
     description=('Small Network Applications in Python: a microservices toolkit'),
     license='MIT',
@@ -0,0 +1,64 @@
+import unittest
+from context import snap
+from snap import admission
+
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def test_requests_over_the_concurrency_limit_get_a_503(self):
+        controller = admission.AdmissionController('widgets', max_concurrency=2, retry_after=3)
+        self.assertIsNone(controller.admit())
+        self.assertIsNone(controller.admit())
+
+        rejection = controller.admit()
+        self.assertEqual(rejection.status_code, 503)
+        self.assertEqual(rejection.headers['Retry-After'], '3')
+
+        controller.release()
+        self.assertIsNone(controller.admit())
+        self.assertEqual(controller.stats()['rejected_over_capacity'], 1)
+
+
+    def test_requests_over_the_rate_limit_get_a_429(self):
+        controller = admission.AdmissionController('widgets', rate=1, burst=2)
+        self.assertIsNone(controller.admit())
+        self.assertIsNone(controller.admit())
+
+        rejection = controller.admit()
+        self.assertEqual(rejection.status_code, 429)
+        self.assertGreaterEqual(int(rejection.headers['Retry-After']), 1)
+        self.assertEqual(controller.stats()['rejected_rate_limited'], 1)
+
+
+    def test_requests_over_capacity_do_not_use_up_rate_tokens(self):
+        controller = admission.AdmissionController('widgets', max_concurrency=1, rate=1, burst=2)
+        self.assertIsNone(controller.admit())
+        for _ in range(3):
+            self.assertEqual(controller.admit().status_code, 503)
+
+        controller.release()
+        self.assertIsNone(controller.admit())
+        self.assertEqual(controller.stats()['rejected_rate_limited'], 0)
+
+
+    def test_streamed_bodies_hold_their_slot_until_sent(self):
+        controller = admission.AdmissionController('widgets', max_concurrency=1)
+        self.assertIsNone(controller.admit())
+        body = controller.release_after(iter([b'a', b'b']))
+        self.assertIsNotNone(controller.admit())
+        self.assertEqual(b''.join(body), b'ab')
+        body.close()
+        self.assertEqual(controller.stats()['in_flight'], 0)
+
+
+    def test_registry_rejects_unknown_settings(self):
+        registry = admission.AdmissionRegistry()
+        with self.assertRaises(admission.InvalidAdmissionConfigException):
+            registry.register('widgets', max_connections=10)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
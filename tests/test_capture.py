@@ -0,0 +1,128 @@
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+from context import snap
+from snap import core
+from snap import capture
+
+
+class StandInRequest(object):
+    def __init__(self, method, path, headers):
+        self.method = method
+        self.path = path
+        self.headers = headers
+
+
+
+class TrafficCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.capture_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.capture_dir)
+
+
+    def test_sampled_calls_are_recorded_and_rotated(self):
+        recorder = capture.TrafficRecorder(self.capture_dir, sample_rate=1, max_bytes=600, backup_count=2)
+        http_request = StandInRequest('GET', '/widget/7', {'Accept': 'application/json', 'Cookie': 'secret'})
+        for n in range(12):
+            recorder.record('widget', http_request, {'id': n}, core.TransformStatus('{}'), 0.0125)
+        recorder.close()
+
+        # only backup_count rotated files are kept, so the oldest records are gone
+        filenames = set(os.listdir(self.capture_dir))
+        rotated = set('capture.%d.ndjson.%d' % (os.getpid(), n) for n in [1, 2])
+        self.assertTrue(rotated <= filenames)
+        self.assertLessEqual(len(filenames), 3)
+
+        records = capture.read_capture([self.capture_dir])
+        ids = [record['input']['id'] for record in records]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(ids[-1], 11)
+        self.assertLess(len(ids), 12)
+        self.assertEqual(records[0]['headers'], {'Accept': 'application/json'})
+        self.assertEqual((records[0]['status'], records[0]['latency_ms']), (200, 12.5))
+
+
+    def test_unsampled_calls_are_not_recorded(self):
+        recorder = capture.TrafficRecorder(self.capture_dir, sample_rate=0)
+        recorder.record('widget', StandInRequest('GET', '/widget', {}), {}, core.TransformStatus('{}'), 0.01)
+        self.assertEqual(os.listdir(self.capture_dir), [])
+
+
+    def test_replay_reports_latency_percentiles(self):
+        records = [{'time': n, 'transform': 'slow' if n % 2 else 'fast', 'method': 'GET', 'path': '/',
+                    'input': {}, 'latency_ms': 5} for n in range(20)]
+
+        def send(record):
+            if record['transform'] == 'slow':
+                time.sleep(0.02)
+                return 200
+            raise IOError('connection refused')
+
+        started = time.time()
+        summary = capture.replay(records, send, rate=200, concurrency=4).summary()
+        self.assertGreaterEqual(time.time() - started, 19 / 200.0)
+
+        self.assertEqual(summary['requests'], 20)
+        self.assertEqual(summary['errors'], 10)
+        self.assertEqual(summary['statuses'], {'200': 10, 'None': 10})
+        self.assertGreaterEqual(summary['transforms']['slow']['replayed']['p50'], 20)
+        self.assertEqual(summary['recorded']['p99'], 5)
+        self.assertIn('slow (replayed)', capture.format_report(summary))
+
+
+    def test_a_disabled_capture_section_turns_capture_off(self):
+        section = {'enabled': False, 'directory': self.capture_dir, 'sample_rate': 1}
+        self.assertIsNone(capture.load_capture_settings({'capture': section}))
+        section['enabled'] = True
+        self.assertEqual(capture.load_capture_settings({'capture': section}),
+                         {'directory': self.capture_dir, 'sample_rate': 1})
+
+
+    def test_bodies_are_replayed_in_their_recorded_content_type(self):
+        received = []
+
+        @Request.application
+        def echo_app(request):
+            received.append((request.mimetype, request.form.to_dict(), request.get_data(as_text=True)))
+            return Response('ok')
+
+        http_server = make_server('127.0.0.1', 0, echo_app)
+        thread = threading.Thread(target=http_server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(http_server.shutdown)
+
+        send = capture.http_sender('http://127.0.0.1:%d' % http_server.server_port, timeout=5)
+        record = {'method': 'POST', 'path': '/orders', 'input': {'id': '7'}}
+        for content_type in ('application/x-www-form-urlencoded', 'multipart/form-data; boundary=recorded',
+                             'text/plain', None):
+            record['headers'] = {'Content-Type': content_type} if content_type else {}
+            self.assertEqual(send(record), 200)
+
+        form, multipart, text, default = received
+        self.assertEqual(form[:2], ('application/x-www-form-urlencoded', {'id': '7'}))
+        self.assertEqual(multipart[:2], ('multipart/form-data', {'id': '7'}))
+        self.assertEqual((text[0], json.loads(text[2])), ('text/plain', {'id': '7'}))
+        self.assertEqual((default[0], json.loads(default[2])), ('application/json', {'id': '7'}))
+
+
+    def test_nearest_rank_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual([capture.percentile(values, pct) for pct in [50, 90, 99, 100]], [50, 90, 99, 100])
+        self.assertIsNone(capture.percentile([], 50))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import jinja2
+from context import snap
+from snap import edgecache
+from snap import tuning
+from snap import config_templates
+from test_tuning import NginxConfig
+
+
+TRANSFORMS = {
+    'get_widget': {
+        'route': '/widgets/<int:id>',
+        'method': 'GET',
+        'edge_cache': {'ttl': 5, 'vary': ['Accept']}
+    },
+    'list_widgets': {
+        'route': '/widgets',
+        'method': 'GET'
+    }
+}
+
+
+class EdgeCacheTest(unittest.TestCase):
+
+    def test_routes_become_nginx_locations(self):
+        self.assertEqual(edgecache.route_to_location('/widgets'), ('=', '/widgets'))
+        self.assertEqual(edgecache.route_to_location('/widgets/<int:id>/parts/<string:name>'),
+                         ('~', '^/widgets/[0-9]+/parts/[^/]+$'))
+
+
+    def test_only_cacheable_transforms_get_cache_rules(self):
+        rules = edgecache.load_edge_cache_rules({'transforms': TRANSFORMS})
+        self.assertEqual([r.transform_name for r in rules], ['get_widget'])
+        self.assertEqual(rules[0].ttl, '5s')
+        self.assertEqual(rules[0].cache_key, '$scheme|$request_method|$host|$request_uri|$http_accept')
+
+        config = jinja2.Environment().from_string(config_templates.NGINX_CONFIG).render(
+            nginx_config=NginxConfig(),
+            tuning=tuning.load_tuning_settings({}),
+            edge_cache_rules=rules)
+        self.assertIn('uwsgi_cache_path', config)
+        self.assertIn('location ~ ^/widgets/[0-9]+$ {', config)
+        self.assertIn('uwsgi_cache_lock on;', config)
+        self.assertIn('uwsgi_cache_background_update on;', config)
+        self.assertEqual(config.count('uwsgi_cache snap_cache;'), 1)
+        self.assertIn('uwsgi_cache_bypass $http_authorization $http_cookie;', config)
+        self.assertIn('uwsgi_no_cache $http_authorization $http_cookie;', config)
+
+
+    def test_credentials_only_reach_the_cache_as_part_of_the_key(self):
+        rule = edgecache.EdgeCacheRule('get_widget', '/widgets', 5, vary=['authorization'])
+        self.assertEqual(rule.bypass_variables, '$http_cookie')
+        self.assertTrue(rule.cache_key.endswith('|$http_authorization'))
+
+
+    def test_non_get_transforms_cannot_be_cached(self):
+        config = {'transforms': {'add_widget': {'route': '/widgets', 'method': 'POST', 'edge_cache': {'ttl': 5}}}}
+        with self.assertRaises(edgecache.InvalidEdgeCacheConfigException):
+            edgecache.load_edge_cache_rules(config)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+
+import time
+import unittest
+from context import snap
+from snap import core
+from snap import common
+from snap import gather
+
+
+class Inventory(object):
+    def levels(self, sku, delay=0.1):
+        time.sleep(delay)
+        return {sku: 3}
+
+
+    def budget(self):
+        return core.current_deadline().remaining()
+
+
+    def broken(self):
+        raise KeyError('no such warehouse')
+
+
+
+class ScatterGatherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.services = common.ServiceObjectRegistry({'inventory': Inventory()}, max_gather_workers=4)
+
+
+    def test_calls_run_concurrently_and_errors_are_reported_per_call(self):
+        started = time.time()
+        result = self.services.scatter_gather({
+            'a': self.services.call('inventory', 'levels', 'a1'),
+            'b': self.services.call('inventory', 'levels', 'b1'),
+            'c': self.services.call('inventory', 'levels', 'c1'),
+            'broken': self.services.call('inventory', 'broken')
+        })
+        elapsed = time.time() - started
+
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(result.results, {'a': {'a1': 3}, 'b': {'b1': 3}, 'c': {'c1': 3}})
+        self.assertIsInstance(result.errors['broken'], KeyError)
+        self.assertFalse(result.complete)
+        self.assertRaises(KeyError, result.raise_first_error)
+
+
+    def test_slow_calls_time_out_with_partial_results(self):
+        result = self.services.scatter_gather({
+            'fast': self.services.call('inventory', 'levels', 'a1', delay=0),
+            'slow': self.services.call('inventory', 'levels', 'b1', delay=1)
+        }, timeout=0.1)
+
+        self.assertEqual(result.get('fast'), {'a1': 3})
+        self.assertIsInstance(result.errors['slow'], gather.CallTimeoutException)
+        self.assertLess(result.elapsed, 0.5)
+
+
+    def test_calls_inherit_the_transform_deadline(self):
+        deadline = core.Deadline('dashboard', 0.2)
+        calls = {'budget': self.services.call('inventory', 'budget')}
+        result = core.run_with_deadline(deadline, lambda: self.services.scatter_gather(calls, timeout=5))
+        self.assertLessEqual(result.get('budget'), 0.2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
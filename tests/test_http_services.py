@@ -0,0 +1,123 @@
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from context import snap
+from snap import core
+from snap import http_services
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.client_ports.add(self.client_address[1])
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+
+        if self.path == '/flaky' and hits <= 2:
+            return self.reply(503, {'error': 'try again'})
+        if self.path == '/slow-first' and hits == 1:
+            time.sleep(1)
+        if self.path == '/slow':
+            time.sleep(1)
+        self.reply(200, {'path': self.path, 'hit': hits})
+
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.client_ports = set()
+        self.hits = {}
+
+
+
+class HTTPServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        threading.Thread(target=self.server.serve_forever).start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_sequential_calls_reuse_one_connection(self):
+        client = http_services.HTTPService(base_url=self.base_url)
+        for i in range(5):
+            self.assertEqual(client.get('/ok').status_code, 200)
+        self.assertEqual(len(self.server.client_ports), 1)
+        client.close()
+
+
+    def test_idempotent_calls_are_retried_on_retry_statuses(self):
+        client = http_services.HTTPService(base_url=self.base_url, retries=3, backoff=0.01)
+        response = client.get('/flaky')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits['/flaky'], 3)
+        client.close()
+
+
+    def test_slow_gets_are_hedged(self):
+        client = http_services.HTTPService(base_url=self.base_url, hedge_after=0.05)
+        started = time.time()
+        response = client.get('/slow-first', hedge=True)
+        self.assertLess(time.time() - started, 0.9)
+        self.assertEqual(response.json()['hit'], 2)
+        client.close()
+
+
+    def test_fast_gets_are_not_hedged(self):
+        client = http_services.HTTPService(base_url=self.base_url, hedge_after=0.5)
+        response = client.get('/ok', hedge=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits['/ok'], 1)
+        client.close()
+
+
+    def test_timeouts_are_capped_by_the_transform_deadline(self):
+        client = http_services.HTTPService(base_url=self.base_url, retries=0)
+
+        def fetch(input_data, service_objects, **kwargs):
+            client.get('/slow')
+            return core.TransformStatus('too late')
+
+        xformer = core.Transformer(None)
+        xformer.register_error_code(core.TransformTimeoutException, core.HTTP_GATEWAY_TIMEOUT)
+        xformer.register_transform('fetch', core.InputShape('empty'), fetch, 'text/plain', timeout=0.2)
+        started = time.time()
+        status = xformer.transform('fetch', {})
+        self.assertLess(time.time() - started, 0.9)
+        self.assertEqual(status.get_error_code(), core.HTTP_GATEWAY_TIMEOUT)
+        client.close()
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
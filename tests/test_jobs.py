@@ -0,0 +1,141 @@
+
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from werkzeug.datastructures import FileStorage
+from context import snap
+from snap import core
+from snap import common
+from snap import jobs
+
+
+def reindex_func(input_data, service_objects, **kwargs):
+    if input_data['index'] == 'missing':
+        return core.TransformStatus(None, False, error_code=404, error_message='no such index')
+    return core.TransformStatus({'index': input_data['index'],
+                                 'timeout': kwargs['deadline'].timeout,
+                                 'headers': sorted(kwargs['headers'])})
+
+
+def wait_for(queue, job_id, timeout=5):
+    stop = time.time() + timeout
+    while time.time() < stop:
+        reply = queue.poll(job_id)
+        if reply.status_code != jobs.HTTP_ACCEPTED:
+            return reply
+        time.sleep(0.02)
+    raise AssertionError('job %s did not finish' % job_id)
+
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.xformer = core.Transformer(common.ServiceObjectRegistry({}))
+        shape = core.InputShape('index', [('index', True)])
+        self.action = self.xformer.register_transform('reindex', shape, reindex_func, 'application/json', timeout=60)
+        self.queue = jobs.JobQueue(self.xformer, os.path.join(self.directory, 'jobs.db'), poll_interval=0.05)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_submitted_job_runs_in_the_background_and_keeps_its_result(self):
+        job = self.queue.submit(self.action, {'index': 'orders'}, headers={core.DEADLINE_HEADER: '0.5',
+                                                                           'Authorization': 'Bearer secret',
+                                                                           'Cookie': 'session=1',
+                                                                           'X-Request-Id': 'r1'})
+        accepted = self.queue.accepted(job)
+        self.assertEqual(accepted.status_code, jobs.HTTP_ACCEPTED)
+        self.assertEqual(accepted.headers['Location'], '/smp/jobs/%s' % job['job_id'])
+
+        reply = wait_for(self.queue, job['job_id'])
+        self.assertEqual(reply.status_code, jobs.HTTP_OK)
+        self.assertEqual(reply.mimetype, 'application/json')
+        # the client's timeout applied to the submission, not to the job, and
+        # credentials were not saved with it
+        self.assertEqual(json.loads(reply.body), {'index': 'orders', 'timeout': 60, 'headers': ['X-Request-Id']})
+        saved = self.queue._connection().execute('SELECT headers FROM snap_jobs').fetchone()[0]
+        self.assertNotIn('secret', saved)
+
+
+    def test_failed_job_reports_the_transform_error_code(self):
+        job = self.queue.submit(self.action, {'index': 'missing'})
+        reply = wait_for(self.queue, job['job_id'])
+        self.assertEqual(reply.status_code, 404)
+        self.assertEqual(json.loads(reply.body)['error_message'], 'no such index')
+
+
+    def test_invalid_input_is_refused_at_submission(self):
+        with self.assertRaises(core.MissingInputFieldException):
+            self.queue.submit(self.action, {})
+        upload = FileStorage(io.BytesIO(b'a,b\n'), filename='x.csv')
+        with self.assertRaises(jobs.UnsupportedJobInputException):
+            self.queue.submit(self.action, {'index': 'orders', 'file': upload})
+
+
+    def test_expired_and_unknown_jobs_are_not_found(self):
+        self.queue.retention = 0
+        job = self.queue.submit(self.action, {'index': 'orders'})
+        self.assertEqual(wait_for(self.queue, job['job_id']).status_code, jobs.HTTP_NOT_FOUND)
+        self.assertEqual(self.queue.poll('no-such-job').status_code, jobs.HTTP_NOT_FOUND)
+
+
+    def test_jobs_of_a_dead_process_are_queued_again(self):
+        connection = self.queue._connection()
+        connection.execute("INSERT INTO snap_jobs (id, transform, input, headers, status, owner_pid, created_at) "
+                           "VALUES ('orphan', 'reindex', '{\"index\": \"orders\"}', '{}', 'running', 999999999, 0)")
+        connection.execute("INSERT INTO snap_jobs (id, transform, input, headers, status, created_at) "
+                           "VALUES ('waiting', 'reindex', '{\"index\": \"orders\"}', '{}', 'queued', 0)")
+        # a restarted process which is only polled still runs the jobs
+        self.assertEqual(wait_for(self.queue, 'orphan').status_code, jobs.HTTP_OK)
+        self.assertEqual(wait_for(self.queue, 'waiting').status_code, jobs.HTTP_OK)
+
+
+    def test_server_workers_start_their_own_job_threads(self):
+        hooks = list(common._worker_start_hooks)
+        self.addCleanup(setattr, common, '_worker_start_hooks', hooks)
+        self.queue.start_in_workers()
+        self.assertIsNone(self.queue._threads_pid)
+
+        # a server worker (which runs the worker start hooks) starts them;
+        # any other child, such as a process pool's, does not
+        for run_hooks, expected_status in ((True, 0), (False, 1)):
+            pid = os.fork()
+            if pid == 0:
+                if run_hooks:
+                    common.run_worker_start_hooks()
+                os._exit(0 if self.queue._threads_pid == os.getpid() else 1)
+            self.assertEqual(os.WEXITSTATUS(os.waitpid(pid, 0)[1]), expected_status)
+
+
+    def test_submission_returns_the_queued_record(self):
+        self.queue.retention = 0
+        for _ in range(20):
+            job = self.queue.submit(self.action, {'index': 'orders'})
+            self.assertEqual(job['status'], jobs.JOB_QUEUED)
+            self.assertEqual(self.queue.accepted(job).status_code, jobs.HTTP_ACCEPTED)
+
+
+
+class JobSettingsTest(unittest.TestCase):
+
+    def test_async_transforms_require_a_job_store(self):
+        config = {'transforms': {'reindex': {'mode': 'async'}, 'lookup': {}}}
+        self.assertRaises(jobs.MissingJobStoreException, jobs.load_job_settings, config)
+        config['jobs'] = {'path': '/tmp/jobs.db', 'workers': 4}
+        self.assertEqual(jobs.load_job_settings(config), {'path': '/tmp/jobs.db', 'workers': 4})
+        config['jobs']['threads'] = 2
+        self.assertRaises(jobs.InvalidJobConfigException, jobs.load_job_settings, config)
+        self.assertIsNone(jobs.load_job_settings({'transforms': {'lookup': {}}, 'jobs': {'threads': 2}}))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
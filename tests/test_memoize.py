@@ -0,0 +1,119 @@
+import io
+import os
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from werkzeug.datastructures import FileStorage
+from context import snap
+from snap import core
+from snap import memoize
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache = memoize.SharedCache(os.path.join(self.work_dir, 'memo.db'), max_entries=10, ttl=60)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+
+    def test_results_are_shared_across_processes(self):
+        calls = []
+
+        @memoize.memoize(self.cache)
+        def lookup_func(input_data, service_objects, **kwargs):
+            calls.append(os.getpid())
+            return core.TransformStatus('price for %s' % input_data['sku'])
+
+        worker = multiprocessing.get_context('fork').Process(target=lookup_func, args=({'sku': 'a1'}, None))
+        worker.start()
+        worker.join()
+
+        status = lookup_func({'sku': 'a1'}, None, headers={'X-Request': '1'})
+        self.assertEqual(status.output_data, 'price for a1')
+        self.assertEqual(calls, [])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+
+    def test_failed_statuses_are_not_cached(self):
+        @memoize.memoize(self.cache)
+        def failing_func(input_data, service_objects, **kwargs):
+            return core.TransformStatus(None, False, error_code=404)
+
+        failing_func({'sku': 'b2'}, None)
+        failing_func({'sku': 'b2'}, None)
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+
+    def test_entries_expire_after_their_ttl(self):
+        self.cache.set('key', 'value', ttl=0.05)
+        self.assertEqual(self.cache.get('key'), 'value')
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for i in range(15):
+            self.cache.set('key_%d' % i, i)
+        self.cache.evict()
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 10)
+        self.assertEqual(stats['evictions'], 5)
+        self.assertIsNone(self.cache.get('key_0'))
+        self.assertEqual(self.cache.get('key_14'), 14)
+
+
+    def test_service_object_methods_can_be_memoized(self):
+        cache = self.cache
+
+        class Catalog(object):
+            def __init__(self):
+                self.queries = 0
+
+            @memoize.memoize_method(cache, ttl=10)
+            def product(self, sku):
+                self.queries += 1
+                return {'sku': sku}
+
+        catalog = Catalog()
+        self.assertEqual(catalog.product('c3'), {'sku': 'c3'})
+        self.assertEqual(catalog.product('c3'), {'sku': 'c3'})
+        self.assertEqual(catalog.queries, 1)
+
+
+    def test_uploads_are_never_memoized(self):
+        calls = []
+
+        @memoize.memoize(self.cache)
+        def import_func(input_data, service_objects, **kwargs):
+            calls.append(input_data['file'].read())
+            return core.TransformStatus('imported')
+
+        import_func({'file': FileStorage(io.BytesIO(b'a,b'), filename='x.csv')}, None)
+        import_func({'file': FileStorage(io.BytesIO(b'c,d'), filename='x.csv')}, None)
+        self.assertEqual(calls, [b'a,b', b'c,d'])
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+    def test_database_is_private_to_its_owner(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache.path).st_mode), 0o600)
+
+        shared_dir = os.path.join(self.work_dir, 'shared')
+        os.mkdir(shared_dir)
+        os.chmod(shared_dir, 0o777)
+        shared_cache = memoize.SharedCache(os.path.join(shared_dir, 'memo.db'))
+        self.assertRaises(memoize.UnsafeCacheFileException, shared_cache.get, 'key')
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
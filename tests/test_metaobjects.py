@@ -0,0 +1,153 @@
+
+import os
+import sys
+import unittest
+import importlib.util
+import importlib.machinery
+import jinja2
+import yaml
+from context import snap
+from snap import config_templates
+
+
+def load_routegen():
+    # metaobjects imports the routegen script as a module, as snapconfig does
+    # when it runs from the scripts directory
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'routegen')
+    loader = importlib.machinery.SourceFileLoader('routegen', script_path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader('routegen', loader))
+    loader.exec_module(module)
+    return module
+
+sys.modules.setdefault('routegen', load_routegen())
+from snap.metaobjects import *
+
+
+def write_config(app_name, settings, shapes, transforms, services):
+    # renders the init file the way snapconfig's SnapConfigWriter does
+    template = jinja2.Environment().from_string(config_templates.INIT_FILE)
+    return template.render(name=app_name,
+                           global_settings=settings,
+                           transforms=transforms,
+                           data_shapes=shapes,
+                           service_objects=services)
+
+
+def read_config(yaml_config):
+    # reads the init file back the way snapconfig -i does
+    yaml_cfg = yaml.safe_load(yaml_config)
+    shapes = [DataShapeMeta(name, [DataShapeFieldMeta(f['name'], f['type'], f['required'])
+                                   for f in yaml_cfg['data_shapes'][name].get('fields') or []])
+              for name in yaml_cfg['data_shapes']]
+    transforms = [TransformMeta(name, t['route'], t['method'], t['output_mimetype'],
+                                input_shape_name=t.get('input_shape'))
+                  for name, t in yaml_cfg['transforms'].items()]
+    services = [ServiceObjectMeta(name, so['class'],
+                                  **dict((p['name'], p['value']) for p in so.get('init_params') or []))
+                for name, so in (yaml_cfg.get('service_objects') or {}).items()]
+    return MetaObjectCollection(shapes), MetaObjectCollection(transforms), MetaObjectCollection(services)
+
+
+
+class TransformMetaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = DataShapeMeta('order', [DataShapeFieldMeta('id', 'int', True)])
+        self.transform = TransformMeta('get_order', '/order/<int:id>', 'GET', 'application/json', self.shape)
+
+
+    def test_edits_return_a_new_transform_and_leave_the_original_alone(self):
+        renamed = self.transform.set_name('find_order')
+        posted = self.transform.set_method('POST')
+        unshaped = self.transform.set_input_shape(None)
+
+        self.assertEqual((renamed.name, renamed.method, renamed.route), ('find_order', 'GET', '/order/<int:id>'))
+        self.assertEqual(posted.method, 'POST')
+        self.assertIsNone(unshaped.input_shape)
+        self.assertEqual((self.transform.name, self.transform.method, self.transform.input_shape),
+                         ('get_order', 'GET', 'order'))
+        # copies which keep the route keep its variables
+        self.assertEqual(renamed._routevars, ['id'])
+
+
+    def test_a_new_route_is_parsed_again(self):
+        moved = self.transform.set_route('/orders/<string:region>/<int:id>')
+        self.assertEqual(moved._routevars, ['region', 'id'])
+        self.assertEqual(moved.input_shape, 'order')
+        self.assertEqual(self.transform._routevars, ['id'])
+        self.assertRaises(InvalidTransformNameException, self.transform.set_name, '1st_order')
+
+
+
+class ServiceObjectMetaTest(unittest.TestCase):
+
+    def test_param_edits_return_a_new_service_object(self):
+        original = ServiceObjectMeta('db', 'PostgresServiceObject', host='localhost')
+        updated = original.add_params(port=5432).add_param('host', 'db.internal')
+        trimmed = updated.remove_param('port').set_name('orders_db')
+
+        self.assertEqual(original.init_params, [{'name': 'host', 'value': 'localhost'}])
+        self.assertEqual(updated.find_param_by_name('host')['value'], 'db.internal')
+        self.assertEqual(updated.find_param_by_name('port')['value'], 5432)
+        self.assertEqual((trimmed.name, trimmed.classname), ('orders_db', 'PostgresServiceObject'))
+        self.assertEqual(trimmed.init_params, [{'name': 'host', 'value': 'db.internal'}])
+        self.assertEqual(updated.name, 'db')
+        self.assertIs(updated.remove_param('no_such_param'), updated)
+
+
+
+class MetaObjectCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shapes = MetaObjectCollection([DataShapeMeta('order', []), DataShapeMeta('customer', [])])
+
+
+    def test_lookups_follow_replacements(self):
+        self.assertEqual(self.shapes.names, ['order', 'customer'])
+        self.assertEqual(self.shapes.index_of('customer'), 1)
+
+        original = self.shapes.find('order')
+        self.shapes.replace('order', original.add_field('id', 'int', True).set_name('purchase'))
+        self.assertIsNone(self.shapes.find('order'))
+        self.assertEqual(self.shapes.index_of('order'), -1)
+        self.assertEqual(self.shapes.find('purchase').field_names, ['id'])
+        self.assertEqual(original.field_names, [])
+
+        self.shapes[-1] = DataShapeMeta('client', [])
+        self.assertEqual(self.shapes.names, ['purchase', 'client'])
+        self.assertEqual(self.shapes.index_of('client'), 1)
+        self.assertIsNone(self.shapes.find('customer'))
+
+        self.shapes.replace('invoice', DataShapeMeta('invoice', []))
+        self.assertEqual(len(self.shapes), 3)
+        self.assertEqual(sorted(self.shapes.as_dict()), ['client', 'invoice', 'purchase'])
+
+
+
+class SnapConfigRoundTripTest(unittest.TestCase):
+
+    def test_edited_metaobjects_survive_a_round_trip_through_the_init_file(self):
+        shape = DataShapeMeta('order', []).add_field('id', 'int', True).add_field('note', 'string')
+        shapes = MetaObjectCollection([shape])
+        transforms = MetaObjectCollection([TransformMeta('get_order', '/order', 'GET', 'application/json', shape)
+                                           .set_method('POST')])
+        services = MetaObjectCollection([ServiceObjectMeta('db', 'PostgresServiceObject', host='localhost')
+                                         .add_param('port', 5432)])
+        settings = GlobalSettingsMeta('orders').set_port(8080)
+
+        yaml_config = write_config('orders', settings, shapes, transforms, services)
+        read_shapes, read_transforms, read_services = read_config(yaml_config)
+
+        self.assertEqual([s.data() for s in read_shapes], [s.data() for s in shapes])
+        self.assertEqual(read_transforms.find('get_order').data({'data_shapes': read_shapes.as_dict()}),
+                         transforms.find('get_order').data({'data_shapes': shapes.as_dict()}))
+        self.assertEqual(sorted(read_services.find('db').init_params, key=lambda p: p['name']),
+                         sorted(services.find('db').init_params, key=lambda p: p['name']))
+        self.assertEqual(yaml.safe_load(yaml_config)['globals']['port'], 8080)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import json
+import codecs
+import unittest
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+from context import snap
+from snap import core
+
+
+def make_request(data, content_type):
+    return Request(EnvironBuilder(method='POST', data=data, content_type=content_type).get_environ())
+
+
+class ProjectedJSONTest(unittest.TestCase):
+
+    DOCUMENT = {
+        'skipped_nested': [{'a': 'x]}"\\', 'b': [1, 2.5e3, None, True, {'c': '{['}]}] * 3,
+        'id': 'w1',
+        'trailing_backslash': '\\',
+        'skipped_scalar': -12.5,
+        'tags': ['a', 'b'],
+        'after': {'q': '}'}
+    }
+
+
+    def test_only_declared_fields_are_decoded(self):
+        text = json.dumps(self.DOCUMENT)
+        self.assertEqual(core.project_json(text, ['id', 'tags', 'missing']), {'id': 'w1', 'tags': ['a', 'b']})
+        self.assertEqual(core.project_json(text, ['after']), {'after': {'q': '}'}})
+        self.assertEqual(core.project_json(json.dumps(self.DOCUMENT, indent=4), ['after', 'skipped_scalar']),
+                         {'after': {'q': '}'}, 'skipped_scalar': -12.5})
+
+
+    def test_malformed_documents_are_rejected(self):
+        self.assertRaises(ValueError, core.project_json, '[1, 2]', ['id'])
+        # documents json.loads rejects
+        for text in ['{"id": ', '{"skipped": [1, 2, "id": 1', '{"id": 1} trailing', '{"x": nul, "id": 1}',
+                     '{"x": 1e, "id": 1}', '{"x": [1 2], "id": 1}', '{"id": 1,}', '{"x": "\\q", "id": 1}']:
+            self.assertRaises(ValueError, json.loads, text)
+            with self.assertRaises(ValueError):
+                core.project_json(text, ['id'])
+
+
+    def test_duplicate_fields_take_their_last_value(self):
+        text = '{"id": 1, "id": 2}'
+        self.assertEqual(core.project_json(text, ['id']), json.loads(text))
+
+
+    def test_large_unwanted_values_are_skipped(self):
+        document = {'long_escaped': 'a\\"\n' * 5000,
+                    'long_array': list(range(5000)) + [{'k': 'x\\' * 3000}] * 3,
+                    'deep': [[[[{'a': [{'b': [1] * 100}] * 70}]]]],
+                    'id': 'w1'}
+        for text in (json.dumps(document), json.dumps(document, indent=2)):
+            for body in (text, text.encode('utf-8')):
+                self.assertEqual(core.project_json(body, ['id']), {'id': 'w1'})
+                with self.assertRaises(ValueError):
+                    core.project_json(body[:-2], ['id'])
+
+
+    def test_utf8_bodies_are_projected_without_decoding_them_whole(self):
+        text = json.dumps({'skipped': u'caf\u00e9 \u2603', u'\u00e9t\u00e9': [1]}, ensure_ascii=False)
+        self.assertEqual(core.project_json(codecs.BOM_UTF8 + text.encode('utf-8'), [u'\u00e9t\u00e9']),
+                         {u'\u00e9t\u00e9': [1]})
+        self.assertRaises(ValueError, core.check_utf8, b'{"skipped": "\xff"}')
+
+
+    def test_spooled_bodies_are_projected_from_the_spool_file(self):
+        document = dict(self.DOCUMENT, padding='x' * 4096)
+        request = make_request(json.dumps(document), 'application/json')
+        with core.SpooledRequest(request, 'upload', spool_threshold=1024) as body:
+            with body.buffer() as buffer:
+                self.assertNotIsInstance(buffer, bytes)
+            self.assertEqual(core.map_content(body, projection=['id', 'tags']), {'id': 'w1', 'tags': ['a', 'b']})
+
+
+    def test_malformed_json_requests_are_refused(self):
+        for data in ['{"id": 1,,}', b'{"id": "\xff"}']:
+            request = make_request(data, 'application/json')
+            with core.SpooledRequest(request, 'upload') as body:
+                self.assertRaises(core.MalformedRequestBodyException, core.map_content, body, projection=['id'])
+
+
+    def test_projection_applies_to_json_requests(self):
+        request = make_request(json.dumps(self.DOCUMENT), 'application/json')
+        with core.SpooledRequest(request, 'upload') as body:
+            self.assertEqual(core.map_content(body, projection=['id']), {'id': 'w1'})
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
+import os
+import shutil
+import tempfile
 import unittest
+import importlib.util
+import importlib.machinery
 from context import snap
+from snap import config_templates
 
 
 class RouteGenerationTest(unittest.TestCase):
@@ -28,6 +34,102 @@ class RouteGenerationTest(unittest.TestCase):
         self.assertTrue(False)
 
 
+def load_routegen():
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'routegen')
+    loader = importlib.machinery.SourceFileLoader('routegen', script_path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader('routegen', loader))
+    loader.exec_module(module)
+    return module
+
+
+def sample_config():
+    return {'globals': {'port': 5000, 'project_directory': '/tmp', 'transform_function_module': 'test_transforms',
+                        'service_module': 'test_services'},
+            'service_objects': {},
+            'data_shapes': {'order': {'fields': [{'name': 'id', 'required': True}]},
+                            'empty': {'fields': []}},
+            'transforms': {'get_order': {'route': '/order', 'method': 'GET', 'input_shape': 'order',
+                                         'output_mimetype': 'application/json'},
+                           'ping': {'route': '/ping', 'method': 'GET', 'input_shape': 'empty',
+                                    'output_mimetype': 'application/json'}}}
+
+
+
+class IncrementalGenerationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.routegen = load_routegen()
+        self.work_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+
+    def digests(self, yaml_config):
+        return self.routegen.RouteGenerator(yaml_config).transform_digests(yaml_config)
+
+
+    def test_manifest_reports_changed_and_removed_transforms(self):
+        yaml_config = sample_config()
+        manifest_file = os.path.join(self.work_dir, 'manifest.json')
+        manifest = self.routegen.GenerationManifest(manifest_file)
+        self.assertEqual(manifest.changed_transforms(self.digests(yaml_config)), ['get_order', 'ping'])
+        manifest.save(self.digests(yaml_config))
+
+        manifest = self.routegen.GenerationManifest(manifest_file)
+        self.assertEqual(manifest.changed_transforms(self.digests(yaml_config)), [])
+
+        # a transform changes through its shape as well as its own settings
+        yaml_config['data_shapes']['order']['fields'].append({'name': 'region', 'required': False})
+        del yaml_config['transforms']['ping']
+        self.assertEqual(manifest.changed_transforms(self.digests(yaml_config)), ['get_order'])
+        self.assertEqual(manifest.removed_transforms(self.digests(yaml_config)), ['ping'])
+
+
+    def test_routing_module_is_regenerated_when_its_inputs_change(self):
+        yaml_config = sample_config()
+        generator = self.routegen.RouteGenerator(yaml_config)
+        routing_module = os.path.join(self.work_dir, 'routes.py')
+        manifest = self.routegen.GenerationManifest(os.path.join(self.work_dir, 'manifest.json'))
+        digest = generator.routing_module_digest(yaml_config)
+
+        self.assertFalse(manifest.routing_module_is_current(routing_module, digest))
+        self.routegen.write_if_changed(routing_module, generator.render_routing_module(yaml_config))
+        manifest.save(self.digests(yaml_config), routing_module, digest)
+        self.assertTrue(manifest.routing_module_is_current(routing_module, generator.routing_module_digest(yaml_config)))
+        self.assertNotEqual(generator.routing_module_digest(yaml_config, compiled=True), digest)
+
+        error_codes = config_templates.ROUTE_ERROR_CODES
+        config_templates.ROUTE_ERROR_CODES = error_codes + [('KeyError', 'HTTP_NOT_FOUND')]
+        try:
+            self.assertFalse(manifest.routing_module_is_current(routing_module, generator.routing_module_digest(yaml_config)))
+        finally:
+            config_templates.ROUTE_ERROR_CODES = error_codes
+
+
+    def test_unchanged_files_are_not_rewritten(self):
+        filename = os.path.join(self.work_dir, 'routes.py')
+        self.assertTrue(self.routegen.write_if_changed(filename, 'x = 1\n'))
+        os.utime(filename, (0, 0))
+        self.assertFalse(self.routegen.write_if_changed(filename, 'x = 1\n'))
+        self.assertEqual(os.stat(filename).st_mtime, 0)
+        self.assertTrue(self.routegen.write_if_changed(filename, 'x = 2\n'))
+
+
+    def test_defined_functions_are_found_without_importing_the_module(self):
+        filename = os.path.join(self.work_dir, 'test_transforms.py')
+        with open(filename, 'w') as f:
+            f.write('raise ImportError("never imported")\n\n'
+                    'def get_order_func(input_data, service_objects, **kwargs):\n'
+                    '    def helper():\n'
+                    '        pass\n\n'
+                    'class Helper(object):\n'
+                    '    def ping_func(self):\n'
+                    '        pass\n')
+        self.assertEqual(self.routegen.find_defined_functions(filename), set(['get_order_func']))
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,67 @@
+
+import json
+import decimal
+import datetime
+import unittest
+import jinja2
+from werkzeug.test import EnvironBuilder
+from context import snap
+from snap import core
+from snap import common
+from snap import serialization
+
+
+def request_accepting(accept=None):
+    headers = {'Accept': accept} if accept else {}
+    return EnvironBuilder(path='/report', headers=headers).get_request()
+
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_unserialized_output_is_encoded_for_the_mimetype(self):
+        records = [{'id': 1, 'when': datetime.date(2026, 1, 2), 'amount': decimal.Decimal('2.5')},
+                   {'id': 2, 'note': 'a, b'}]
+
+        self.assertEqual(json.loads(serialization.encode(records, 'application/json').decode()),
+                         [{'id': 1, 'when': '2026-01-02', 'amount': 2.5}, {'id': 2, 'note': 'a, b'}])
+        self.assertEqual(serialization.encode(records, 'text/csv').decode().splitlines(),
+                         ['id,when,amount,note', '1,2026-01-02,2.5,', '2,,,"a, b"'])
+
+
+    def test_serialized_output_is_sent_as_it_is(self):
+        self.assertEqual(serialization.encode('{"id": 1}', 'text/csv'), '{"id": 1}')
+        self.assertEqual(serialization.encode(b'\x00\x01', 'application/octet-stream'), b'\x00\x01')
+        self.assertRaises(serialization.NoEncoderException, serialization.encode, {'id': 1}, 'image/png')
+
+
+    def test_streamed_output_is_sent_as_it_is(self):
+        chunks = (line for line in ['<p>1</p>', '<p>2</p>'])
+        self.assertIs(serialization.encode(chunks, 'text/html'), chunks)
+        self.assertIs(serialization.encode(chunks, 'application/json'), chunks)
+
+        j2env = jinja2.Environment(loader=jinja2.DictLoader({'rows.html': '{% for r in rows %}<p>{{ r }}</p>{% endfor %}'}))
+        template_stream = common.JinjaTemplateManager(j2env).stream('rows.html', rows=[1, 2])
+        self.assertEqual(''.join(serialization.encode(template_stream, 'text/html')), '<p>1</p><p>2</p>')
+
+
+    def test_accept_header_picks_among_declared_mimetypes(self):
+        action = core.Action(core.InputShape('report'), None, 'application/json, text/csv')
+        self.assertEqual(action.output_mimetype, 'application/json')
+
+        negotiate = lambda accept: serialization.negotiate(request_accepting(accept), action.output_mimetypes)
+        self.assertEqual(negotiate(None), 'application/json')
+        self.assertEqual(negotiate('text/csv'), 'text/csv')
+        self.assertEqual(negotiate('text/csv;q=0.4, application/json;q=0.6'), 'application/json')
+        self.assertEqual(negotiate('text/*'), 'text/csv')
+        self.assertEqual(negotiate('image/png'), 'application/json')
+
+
+    def test_ndjson_lines_use_the_json_encoder(self):
+        status = core.TransformStatus({'when': datetime.date(2026, 1, 2)})
+        self.assertEqual(core.ndjson_line(1, status), b'{"when":"2026-01-02"}\n')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import time
+import signal
+import socket
+import threading
+import unittest
+from unittest import mock
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+from context import snap
+from snap import server
+from snap import loggers
+
+
+def pid_app(environ, start_response):
+    body = str(os.getpid()).encode()
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def keep_logging_unconfigured(test):
+    # the server logs through snap's loggers, whose config would write an
+    # info.log file into the working directory
+    patcher = mock.patch.object(loggers, '_configured', True)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+
+class WorkerServerTest(unittest.TestCase):
+
+    def setUp(self):
+        keep_logging_unconfigured(self)
+
+
+    def start_worker(self, threads):
+        listen_socket = server.create_listening_socket('127.0.0.1', 0)
+        worker = server.WorkerServer(listen_socket, pid_app, threads=threads, keepalive=5)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+
+        def stop():
+            worker.stop_accepting()
+            thread.join(5)
+            listen_socket.close()
+
+        self.addCleanup(stop)
+        return listen_socket.getsockname()[1]
+
+
+    def test_an_idle_connection_does_not_hold_up_other_clients(self):
+        port = self.start_worker(threads=server.DEFAULT_THREADS)
+        idle = socket.create_connection(('127.0.0.1', port))
+        self.addCleanup(idle.close)
+        # let the worker hand the idle connection a thread
+        time.sleep(0.2)
+
+        started = time.time()
+        connection = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        response.read()
+        connection.close()
+        self.assertLess(time.time() - started, 2)
+
+
+    def test_connection_holding_the_last_thread_is_closed(self):
+        # an idle keep-alive connection would otherwise hold the worker's only thread
+        port = self.start_worker(threads=1)
+        client = socket.create_connection(('127.0.0.1', port), timeout=5)
+        client.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        received = b''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            received += chunk
+        client.close()
+        self.assertTrue(received.startswith(b'HTTP/1.1 200'))
+
+
+    def test_threads_default_to_more_than_one(self):
+        self.assertGreater(server.DEFAULT_THREADS, 1)
+
+
+
+class PreforkServerTest(unittest.TestCase):
+
+    def setUp(self):
+        keep_logging_unconfigured(self)
+
+
+    def test_forked_workers_share_the_listening_socket(self):
+        port = free_port()
+        master_pid = os.fork()
+        if master_pid == 0:
+            exit_code = 0
+            try:
+                server.serve(pid_app, '127.0.0.1', port, workers=2, threads=2, keepalive=0, graceful_timeout=5)
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        try:
+            worker_pids = set()
+            stop = time.time() + 10
+            while len(worker_pids) < 2 and time.time() < stop:
+                try:
+                    connection = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+                    connection.request('GET', '/')
+                    response = connection.getresponse()
+                    self.assertEqual(response.status, 200)
+                    worker_pids.add(int(response.read()))
+                    connection.close()
+                except (socket.error, httplib.HTTPException):
+                    time.sleep(0.05)
+            self.assertEqual(len(worker_pids), 2)
+            self.assertNotIn(master_pid, worker_pids)
+        finally:
+            os.kill(master_pid, signal.SIGTERM)
+            _, status = os.waitpid(master_pid, 0)
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+
+    def test_quitting_one_worker_leaves_its_siblings_alone(self):
+        port = free_port()
+        master_pid = os.fork()
+        if master_pid == 0:
+            try:
+                server.serve(pid_app, '127.0.0.1', port, workers=2, threads=2, keepalive=0, graceful_timeout=5)
+            finally:
+                os._exit(0)
+
+        def worker_pid():
+            connection = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            pid = int(connection.getresponse().read())
+            connection.close()
+            return pid
+
+        try:
+            worker_pids = set()
+            stop = time.time() + 10
+            while len(worker_pids) < 2 and time.time() < stop:
+                try:
+                    worker_pids.add(worker_pid())
+                except (socket.error, httplib.HTTPException):
+                    time.sleep(0.05)
+            self.assertEqual(len(worker_pids), 2)
+
+            # the worker forked second inherited the master's record of the first
+            sibling_pid, quit_pid = sorted(worker_pids)
+            os.kill(quit_pid, signal.SIGQUIT)
+            time.sleep(0.5)
+            # the sibling is still running (signal 0 only checks that it exists)
+            os.kill(sibling_pid, 0)
+        finally:
+            os.kill(master_pid, signal.SIGTERM)
+            os.waitpid(master_pid, 0)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import io
+import json
+import unittest
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+from context import snap
+from snap import core
+from snap import common
+
+
+def make_request(data, content_type):
+    return Request(EnvironBuilder(method='POST', data=data, content_type=content_type).get_environ())
+
+
+class SpooledRequestTest(unittest.TestCase):
+
+    def test_oversized_bodies_are_rejected_from_content_length(self):
+        request = make_request(b'x' * 100, 'application/json')
+        with self.assertRaises(core.RequestBodyTooLargeException):
+            core.SpooledRequest(request, 'upload', max_body_size=10)
+        # nothing was read from the client
+        self.assertEqual(len(request.stream.read()), 100)
+
+
+    def test_large_bodies_roll_over_to_disk(self):
+        payload = {'id': 'x' * 2048}
+        request = make_request(json.dumps(payload), 'application/json')
+        with core.SpooledRequest(request, 'upload', spool_threshold=1024) as body:
+            self.assertTrue(body.stream._rolled)
+            self.assertEqual(core.map_content(body), payload)
+
+
+    def test_multipart_uploads_decode_from_the_spool(self):
+        request = make_request({'id': '7', 'attachment': (io.BytesIO(b'contents'), 'notes.txt')},
+                               'multipart/form-data')
+        with core.SpooledRequest(request, 'upload') as body:
+            input_data = core.map_content(body)
+            self.assertEqual(input_data['id'], '7')
+            self.assertEqual(input_data['attachment'].filename, 'notes.txt')
+            self.assertEqual(input_data['attachment'].read(), b'contents')
+
+
+    def test_sizes_can_be_given_with_units(self):
+        self.assertEqual(core.parse_size('512K'), 512 * 1024)
+        self.assertEqual(core.parse_size('10M'), 10 * 1024 * 1024)
+        self.assertEqual(core.parse_size(4096), 4096)
+
+
+    def test_flask_request_api_for_custom_decoders(self):
+        request = Request(EnvironBuilder(method='POST', path='/upload?batch=b1', data='{"id": 7}',
+                                         content_type='application/json').get_environ())
+        with core.SpooledRequest(request, 'upload') as body:
+            self.assertEqual(body.args['batch'], 'b1')
+            self.assertEqual(body.get_data(), b'{"id": 7}')
+            self.assertEqual(body.get_data(as_text=True), '{"id": 7}')
+            self.assertEqual(body.get_json(), {'id': 7})
+
+        with core.SpooledRequest(make_request('{"id": 7', 'text/plain'), 'upload') as body:
+            self.assertIsNone(body.get_json())
+            self.assertIsNone(body.get_json(force=True, silent=True))
+
+
+    def test_chunked_ndjson_bodies_are_held_to_the_size_limit(self):
+        def echo_func(input_data, service_objects, **kwargs):
+            return core.TransformStatus(dict(input_data))
+
+        xformer = core.Transformer(common.ServiceObjectRegistry({}))
+        xformer.register_transform('echo', core.InputShape('any'), echo_func, core.MIMETYPE_NDJSON)
+        # a stream with no Content-Length, as a chunked upload arrives
+        stream = io.BytesIO(b'{"id": 1}\n' * 10)
+        lines = [json.loads(line.decode()) for line in xformer.transform_ndjson('echo', stream, max_body_size=25)]
+
+        self.assertEqual(lines[:2], [{'id': 1}, {'id': 1}])
+        self.assertEqual(lines[2]['error_code'], core.HTTP_PAYLOAD_TOO_LARGE)
+        self.assertEqual(len(lines), 3)
+        self.assertLess(stream.tell(), 40)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import gc
+import shutil
+import tempfile
+import unittest
+from context import snap
+from snap import sql_services
+
+
+class SQLServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        url = 'sqlite:///%s' % os.path.join(self.work_dir, 'test.db')
+        self.db = sql_services.SQLService(url=url, pool_size='3', pool_pre_ping='true', batch_size=10)
+        self.db.execute('CREATE TABLE widgets (id INTEGER PRIMARY KEY, name TEXT, color TEXT)')
+
+
+    def tearDown(self):
+        self.db.dispose()
+        shutil.rmtree(self.work_dir)
+
+
+    def test_insert_many_writes_in_batches(self):
+        records = ({'id': i, 'name': 'widget_%d' % i, 'color': 'red'} for i in range(25))
+        self.assertEqual(self.db.insert_many('widgets', records), 25)
+        rows = self.db.execute('SELECT COUNT(*) AS n FROM widgets')
+        self.assertEqual(rows[0]['n'], 25)
+
+
+    def test_upsert_many_updates_existing_rows(self):
+        self.db.insert_many('widgets', [{'id': 1, 'name': 'one', 'color': 'red'}])
+        self.db.upsert_many('widgets',
+                            [{'id': 1, 'name': 'one', 'color': 'blue'}, {'id': 2, 'name': 'two', 'color': 'green'}],
+                            key_columns=['id'])
+        rows = self.db.execute('SELECT id, color FROM widgets ORDER BY id')
+        self.assertEqual(rows, [{'id': 1, 'color': 'blue'}, {'id': 2, 'color': 'green'}])
+
+
+    def test_stream_query_yields_every_row(self):
+        self.db.insert_many('widgets', [{'id': i, 'name': 'w', 'color': 'red'} for i in range(35)])
+        streamed = self.db.stream_query('SELECT id FROM widgets WHERE color = :color ORDER BY id',
+                                        {'color': 'red'},
+                                        batch_size=8)
+        self.assertEqual([row['id'] for row in streamed], list(range(35)))
+
+
+    def test_forked_processes_get_fresh_pools_and_services_are_not_kept_alive(self):
+        self.db.execute('SELECT 1')
+        pool = self.db.engine.pool
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if self.db.engine.pool is not pool else 1)
+        self.assertEqual(os.WEXITSTATUS(os.waitpid(pid, 0)[1]), 0)
+
+        service_count = len(sql_services._services)
+        service = sql_services.SQLService(url='sqlite://')
+        self.assertIn(service, sql_services._services)
+        del service
+        gc.collect()
+        self.assertEqual(len(sql_services._services), service_count)
+
+
+    def test_a_database_url_is_required(self):
+        with self.assertRaises(sql_services.MissingDatabaseURLException):
+            sql_services.SQLService(pool_size=5)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
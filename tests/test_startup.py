@@ -0,0 +1,88 @@
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from context import snap
+from snap import core
+from snap import startup
+from snap import loggers
+from snap import snap as snap_app
+
+
+TRANSFORM_MODULE = '''
+import time
+time.sleep(0.02)
+
+calls = []
+
+def ping_func(input_data, service_objects, **kwargs):
+    calls.append(input_data)
+    return 'pong'
+'''
+
+
+class LazyStartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.work_dir, 'lazy_xforms.py'), 'w') as f:
+            f.write(TRANSFORM_MODULE)
+        sys.path.insert(0, self.work_dir)
+
+
+    def tearDown(self):
+        sys.path.remove(self.work_dir)
+        sys.modules.pop('lazy_xforms', None)
+        shutil.rmtree(self.work_dir)
+
+
+    def test_lazy_function_imports_its_module_on_first_call(self):
+        ping = core.LazyFunction('lazy_xforms', 'ping_func')
+        self.assertNotIn('lazy_xforms', sys.modules)
+
+        self.assertEqual(ping({'n': 1}, None), 'pong')
+        self.assertEqual(ping({'n': 2}, None), 'pong')
+        self.assertEqual(sys.modules['lazy_xforms'].calls, [{'n': 1}, {'n': 2}])
+        self.assertEqual(ping.__name__, 'ping_func')
+
+
+    def test_import_profiler_records_module_import_time(self):
+        profiler = startup.ImportProfiler().install()
+        try:
+            with startup.phase('import transforms'):
+                import lazy_xforms
+        finally:
+            profiler.uninstall()
+
+        total, own = profiler.timings['lazy_xforms']
+        self.assertGreaterEqual(own, 0.02)
+        self.assertGreaterEqual(total, own)
+        self.assertNotIn(profiler, sys.meta_path)
+
+        report = startup.format_report(profiler, total)
+        self.assertIn('lazy_xforms', report)
+        self.assertIn('import transforms', report)
+
+
+
+    def test_app_setup_applies_the_logging_config(self):
+        # the real config would install handlers (and an info.log file) for
+        # the rest of the test run
+        with mock.patch.object(loggers, '_configured', False), \
+             mock.patch('logging.config.dictConfig') as dict_config:
+            app = Flask(__name__)
+            config = {'globals': {'debug': False, 'port': 5000}}
+            snap_app.setup_compiled(app, config, {})
+            self.assertTrue(loggers._configured)
+
+        self.assertEqual(dict_config.call_count, 1)
+        self.assertIn('request', dict_config.call_args[0][0]['loggers'])
+        self.assertIn('configure logging', [name for name, _ in startup.setup_phases()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from context import snap
+from snap import common
+
+
+class TemplateManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.template_dir = os.path.join(self.work_dir, 'templates')
+        os.makedirs(self.template_dir)
+        with open(os.path.join(self.template_dir, 'rows.html'), 'w') as f:
+            f.write('<ul>{% for row in rows %}<li>{{ row }}</li>{% endfor %}</ul>')
+
+
+    def tearDown(self):
+        common.set_production_mode(False)
+        shutil.rmtree(self.work_dir)
+
+
+    def test_compiled_templates_are_cached_on_disk(self):
+        cache_dir = os.path.join(self.work_dir, 'bytecode')
+        manager = common.get_template_mgr_for_location(self.template_dir, bytecode_cache_dir=cache_dir)
+        self.assertEqual(manager.render('rows.html', rows=[1]), '<ul><li>1</li></ul>')
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # a second worker loads the cached bytecode instead of compiling
+        other_worker = common.get_template_mgr_for_location(self.template_dir, bytecode_cache_dir=cache_dir)
+        self.assertEqual(other_worker.render('rows.html', rows=[2]), '<ul><li>2</li></ul>')
+
+
+    def test_precompiled_templates_are_used(self):
+        compiled_dir = common.precompile_templates(self.template_dir, os.path.join(self.work_dir, 'compiled'))
+        os.remove(os.path.join(self.template_dir, 'rows.html'))
+        manager = common.get_template_mgr_for_location(self.template_dir, precompiled_dir=compiled_dir)
+        self.assertEqual(manager.render('rows.html', rows=['a']), '<ul><li>a</li></ul>')
+
+
+    def test_auto_reload_is_off_in_production_mode(self):
+        manager = common.get_template_mgr_for_location(self.template_dir)
+        common.set_production_mode(True)
+        manager.get_template('rows.html')
+        self.assertFalse(manager.environment.auto_reload)
+
+
+    def test_streamed_rendering_yields_chunks(self):
+        manager = common.get_template_mgr_for_location(self.template_dir)
+        chunks = list(manager.stream('rows.html', buffer_size=2, rows=range(10)))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), manager.render('rows.html', rows=range(10)))
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
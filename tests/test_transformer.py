@@ -0,0 +1,318 @@
+import io
+import json
+import unittest
+import time
+import threading
+from context import snap
+from snap import core
+from snap import common
+
+
+def echo_func(input_data, service_objects, **kwargs):
+    return core.TransformStatus(dict(input_data))
+
+
+def failing_func(input_data, service_objects, **kwargs):
+    raise KeyError('no such widget')
+
+
+class TransformerExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = core.InputShape('test_shape')
+        self.shape.add_field('id', True)
+        self.xformer = core.Transformer(common.ServiceObjectRegistry({}))
+        self.xformer.register_error_code(core.TransformQueueFullException, 503)
+        self.xformer.register_error_code(KeyError, 404)
+
+
+    def test_inline_executor_is_the_default(self):
+        action = self.xformer.register_transform('echo', self.shape, echo_func, 'application/json')
+        self.assertIs(action.executor, core.INLINE_EXECUTOR)
+        status = self.xformer.transform('echo', {'id': 1})
+        self.assertTrue(status.ok)
+        self.assertEqual(status.output_data, {'id': 1})
+
+
+    def test_thread_executor_runs_transform_off_the_request_thread(self):
+        caller = threading.current_thread()
+        ran_on = []
+
+        def record_thread(input_data, service_objects, **kwargs):
+            ran_on.append(threading.current_thread())
+            return core.TransformStatus('ok')
+
+        executor = core.create_executor('threaded', 'thread', max_workers=2, max_queue=2)
+        self.xformer.register_transform('threaded', self.shape, record_thread, 'text/plain', executor=executor)
+        status = self.xformer.transform('threaded', {'id': 1})
+        self.assertTrue(status.ok)
+        self.assertIsNot(ran_on[0], caller)
+        executor.shutdown()
+
+
+    def test_full_queue_maps_to_registered_error_code(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_func(input_data, service_objects, **kwargs):
+            started.set()
+            release.wait(5)
+            return core.TransformStatus('done')
+
+        executor = core.create_executor('blocking', 'thread', max_workers=1, max_queue=0)
+        self.xformer.register_transform('blocking', self.shape, blocking_func, 'text/plain', executor=executor)
+
+        worker = threading.Thread(target=self.xformer.transform, args=('blocking', {'id': 1}))
+        worker.start()
+        started.wait(5)
+        status = self.xformer.transform('blocking', {'id': 2})
+        release.set()
+        worker.join()
+
+        self.assertFalse(status.ok)
+        self.assertEqual(status.get_error_code(), 503)
+        executor.shutdown()
+
+
+    def test_process_executor_maps_remote_exceptions_by_type_name(self):
+        executor = core.create_executor('failing', 'process', max_workers=1)
+        self.xformer.register_transform('failing', self.shape, failing_func, 'text/plain', executor=executor)
+        status = self.xformer.transform('failing', {'id': 1})
+        self.assertFalse(status.ok)
+        self.assertEqual(status.get_error_code(), 404)
+        executor.shutdown()
+
+
+    def test_unknown_executor_type_is_rejected(self):
+        with self.assertRaises(core.UnknownExecutorTypeException):
+            core.create_executor('echo', 'greenlet')
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = core.InputShape('test_shape')
+        self.xformer = core.Transformer(common.ServiceObjectRegistry({}))
+
+
+    def test_concurrent_identical_calls_share_one_execution(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_lookup(input_data, service_objects, **kwargs):
+            calls.append(input_data)
+            release.wait(5)
+            return core.TransformStatus('result')
+
+        self.xformer.register_transform('lookup', self.shape, slow_lookup, 'text/plain', single_flight=True)
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(self.xformer.transform('lookup', {'key': 'a'})))
+                   for i in range(5)]
+        for caller in callers:
+            caller.start()
+        while not calls:
+            release.wait(0.01)
+        # give the followers time to join the in-flight call
+        release.wait(0.2)
+        release.set()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r is results[0] for r in results))
+
+
+    def test_calls_with_different_input_are_not_coalesced(self):
+        calls = []
+
+        def lookup(input_data, service_objects, **kwargs):
+            calls.append(input_data)
+            return core.TransformStatus('result')
+
+        self.xformer.register_transform('lookup', self.shape, lookup, 'text/plain', single_flight=True)
+        self.xformer.transform('lookup', {'key': 'a'})
+        self.xformer.transform('lookup', {'key': 'b'})
+        self.assertEqual(len(calls), 2)
+
+
+    def test_followers_stop_waiting_at_their_own_deadline(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_lookup(input_data, service_objects, **kwargs):
+            started.set()
+            release.wait(5)
+            return core.TransformStatus('result')
+
+        self.xformer.register_error_code(core.TransformTimeoutException, core.HTTP_GATEWAY_TIMEOUT)
+        self.xformer.register_transform('lookup', self.shape, slow_lookup, 'text/plain', single_flight=True)
+        leader = threading.Thread(target=self.xformer.transform, args=('lookup', {'key': 'a'}))
+        leader.start()
+        started.wait(5)
+        began = time.time()
+        status = self.xformer.transform('lookup', {'key': 'a'}, headers={core.DEADLINE_HEADER: '0.1'})
+        elapsed = time.time() - began
+        release.set()
+        leader.join()
+
+        self.assertEqual(status.get_error_code(), core.HTTP_GATEWAY_TIMEOUT)
+        self.assertLess(elapsed, 2)
+
+
+    def test_calls_with_uploads_are_not_coalesced(self):
+        self.assertIsNone(core.normalize_input({'file': io.BytesIO(b'a,b')}))
+        self.assertEqual(core.normalize_input({'b': 1, 'a': [2]}), '{"a": [2], "b": 1}')
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = core.InputShape('test_shape')
+        self.xformer = core.Transformer(common.ServiceObjectRegistry({}))
+        self.xformer.register_error_code(core.TransformTimeoutException, core.HTTP_GATEWAY_TIMEOUT)
+
+
+    def test_transform_sees_the_shorter_of_its_own_and_the_client_budget(self):
+        budgets = []
+
+        def record_budget(input_data, service_objects, **kwargs):
+            budgets.append(kwargs['deadline'].timeout)
+            self.assertIs(core.current_deadline(), kwargs['deadline'])
+            return core.TransformStatus('ok')
+
+        self.xformer.register_transform('budgeted', self.shape, record_budget, 'text/plain', timeout=10)
+        self.xformer.transform('budgeted', {}, headers={core.DEADLINE_HEADER: '0.5'})
+        self.xformer.transform('budgeted', {}, headers={core.DEADLINE_HEADER: '30'})
+        self.assertEqual(budgets, [0.5, 10])
+        self.assertIsNone(core.current_deadline())
+
+
+    def test_cooperative_check_maps_to_a_timeout_status(self):
+        def slow_func(input_data, service_objects, **kwargs):
+            time.sleep(0.05)
+            kwargs['deadline'].check()
+            return core.TransformStatus('too late')
+
+        self.xformer.register_transform('slow', self.shape, slow_func, 'text/plain', timeout=0.01)
+        status = self.xformer.transform('slow', {})
+        self.assertFalse(status.ok)
+        self.assertEqual(status.get_error_code(), 504)
+
+
+    def test_pooled_transform_stops_waiting_at_the_deadline(self):
+        release = threading.Event()
+
+        def stuck_func(input_data, service_objects, **kwargs):
+            release.wait(5)
+            return core.TransformStatus('done')
+
+        executor = core.create_executor('stuck', 'thread', max_workers=1)
+        self.xformer.register_transform('stuck', self.shape, stuck_func, 'text/plain', executor=executor)
+        started = time.time()
+        status = self.xformer.transform('stuck', {}, headers={core.DEADLINE_HEADER: '0.1'})
+        elapsed = time.time() - started
+        release.set()
+        executor.shutdown()
+
+        self.assertEqual(status.get_error_code(), 504)
+        self.assertLess(elapsed, 2)
+
+
+class NDJSONStreamTest(unittest.TestCase):
+
+    def test_each_line_is_transformed_and_streamed_back(self):
+        shape = core.InputShape('test_shape')
+        shape.add_field('id', True)
+        xformer = core.Transformer(common.ServiceObjectRegistry({}))
+        xformer.register_error_code(core.MissingInputFieldException, core.HTTP_BAD_REQUEST)
+        xformer.register_transform('echo', shape, echo_func, core.MIMETYPE_NDJSON)
+
+        body = io.BytesIO(b'{"id": 1}\n\n{"name": "x"}\nnot json\n{"id": 2}\n')
+        lines = list(xformer.transform_ndjson('echo', body, {'batch': 'b1'}))
+
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0].decode()), {'id': 1, 'batch': 'b1'})
+        self.assertEqual(json.loads(lines[1].decode())['line'], 3)
+        self.assertEqual(json.loads(lines[2].decode())['error_code'], 400)
+        self.assertEqual(json.loads(lines[3].decode()), {'id': 2, 'batch': 'b1'})
+        self.assertTrue(all(line.endswith(b'\n') and line.count(b'\n') == 1 for line in lines))
+
+
+class CompiledRegistrationTest(unittest.TestCase):
+
+    def test_prebuilt_shape_and_error_table_with_bound_action(self):
+        shape = core.InputShape('test_shape', [('id', True), ('name', False)])
+        self.assertEqual([(f.name, f.is_required) for f in shape.fields], [('id', True), ('name', False)])
+
+        xformer = core.Transformer(common.ServiceObjectRegistry({}),
+                                   error_table={'MissingInputFieldException': 400, 'KeyError': 404})
+        echo_action = xformer.register_transform('echo', shape, echo_func, 'application/json')
+        failing_action = xformer.register_transform('fail', shape, failing_func, 'application/json')
+
+        self.assertEqual(xformer.run_action(echo_action, {'id': 1}).output_data, {'id': 1})
+        self.assertEqual(xformer.run_action(echo_action, {'name': 'x'}).get_error_code(), 400)
+        self.assertEqual(xformer.run_action(failing_action, {'id': 1}).get_error_code(), 404)
+        lines = list(xformer.transform_ndjson(echo_action, io.BytesIO(b'{"id": 3}\n')))
+        self.assertEqual(json.loads(lines[0].decode()), {'id': 3})
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.xformer = core.Transformer(common.ServiceObjectRegistry({}), error_table={'TransformTimeoutException': 504})
+        any_shape = core.InputShape('any')
+        sku_shape = core.InputShape('sku', [('sku', True)])
+
+        def price_func(input_data, service_objects, **kwargs):
+            return core.TransformStatus(json.dumps({'price': 2.5}))
+
+        def stock_func(input_data, service_objects, **kwargs):
+            if input_data['sku'] == 'GONE':
+                return core.TransformStatus(None, False, error_code=404)
+            return core.TransformStatus({'in_stock': True})
+
+        def slow_func(input_data, service_objects, **kwargs):
+            time.sleep(0.1)
+            return core.TransformStatus({})
+
+        self.xformer.register_pipeline('quote', sku_shape, ['normalize', ['price', 'stock'], 'total'], 'application/json')
+        self.xformer.register_transform('normalize', sku_shape,
+                                        lambda data, services, **kwargs: core.TransformStatus({'sku': data['sku'].upper()}),
+                                        'application/json')
+        self.xformer.register_transform('price', sku_shape, price_func, 'application/json')
+        self.xformer.register_transform('stock', sku_shape, stock_func, 'application/json')
+        self.xformer.register_transform('total', any_shape,
+                                        lambda data, services, **kwargs: core.TransformStatus(sorted(data.items())),
+                                        'application/json')
+        self.xformer.register_transform('slow', any_shape, slow_func, 'application/json')
+        self.xformer.register_pipeline('slow_chain', any_shape, ['slow', 'slow', 'slow'], 'application/json', timeout=0.15)
+
+
+    def test_stage_outputs_feed_the_next_stage_and_fan_in_merges(self):
+        status = self.xformer.transform('quote', {'sku': 'ab1'})
+        self.assertTrue(status.ok)
+        self.assertEqual(status.output_data, [('in_stock', True), ('price', 2.5), ('sku', 'AB1')])
+        self.assertEqual([name for name, elapsed in status.user_data['stage_timings']],
+                         ['normalize', 'price', 'stock', 'total'])
+        self.assertTrue(core.server_timing(status.user_data['stage_timings']).startswith('normalize;dur='))
+
+
+    def test_first_failed_stage_ends_the_pipeline(self):
+        status = self.xformer.transform('quote', {'sku': 'gone'})
+        self.assertFalse(status.ok)
+        self.assertEqual(status.get_error_code(), 404)
+
+
+    def test_stages_share_the_pipeline_deadline(self):
+        # the third stage would start after the pipeline's budget is spent
+        status = self.xformer.transform('slow_chain', {})
+        self.assertFalse(status.ok)
+        self.assertEqual(status.get_error_code(), 504)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
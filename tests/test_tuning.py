@@ -0,0 +1,80 @@
+import unittest
+import jinja2
+from context import snap
+from snap import tuning
+from snap import config_templates
+
+
+class NginxConfig(object):
+    name = 'snap'
+    hostname = 'localhost'
+    port = 8080
+    uwsgi_sockfile = '/tmp/snap.sock'
+
+
+class UWSGIEnvironment(object):
+    base_dir = '/opt/snap'
+    python_home = '/opt/snap/venv'
+    socket_dir = '/tmp'
+    log_dir = '/var/log/snap'
+
+
+def render(template, **kwargs):
+    return jinja2.Environment().from_string(template).render(**kwargs)
+
+
+class TuningTest(unittest.TestCase):
+
+    def test_defaults_are_derived_from_the_cpu_count(self):
+        settings = tuning.load_tuning_settings({})
+        cpus = tuning.cpu_count()
+        self.assertEqual(settings.processes, cpus)
+        self.assertEqual(settings.nginx_worker_processes, cpus)
+        self.assertEqual(settings.upstream_keepalive, settings.threads)
+        self.assertEqual(settings.worker_rlimit_nofile, 2 * settings.worker_connections)
+
+
+    def test_nginx_workers_share_the_upstream_request_slots(self):
+        settings = tuning.load_tuning_settings({'tuning': {'nginx_worker_processes': 4, 'processes': 8, 'threads': 3}})
+        self.assertEqual(settings.upstream_keepalive, 6)
+        settings = tuning.load_tuning_settings({'tuning': {'nginx_worker_processes': 8, 'processes': 2, 'threads': 2}})
+        self.assertEqual(settings.upstream_keepalive, 1)
+
+
+    def test_unknown_settings_are_rejected(self):
+        with self.assertRaises(tuning.InvalidTuningSettingException):
+            tuning.load_tuning_settings({'tuning': {'workers': 4}})
+        with self.assertRaises(tuning.UnknownUpstreamProtocolException):
+            tuning.load_tuning_settings({'tuning': {'protocol': 'fastcgi'}})
+
+
+    def test_http_protocol_keeps_upstream_connections_alive(self):
+        settings = tuning.load_tuning_settings({'tuning': {'protocol': 'http', 'processes': 3, 'threads': 4}})
+        nginx_config = render(config_templates.NGINX_CONFIG, nginx_config=NginxConfig(), tuning=settings)
+        uwsgi_config = render(config_templates.UWSGI, uwsgi_config=UWSGIEnvironment(), tuning=settings)
+
+        self.assertIn('keepalive 12;', nginx_config)
+        self.assertIn('proxy_http_version 1.1;', nginx_config)
+        self.assertIn('backlog=1024', nginx_config)
+        self.assertIn('http11-socket = /tmp/%n.sock', uwsgi_config)
+        self.assertIn('processes = 3', uwsgi_config)
+        self.assertIn('listen = 1024', uwsgi_config)
+        self.assertIn('lazy-apps = true', uwsgi_config)
+
+
+    def test_uwsgi_protocol_passes_through_without_upstream_keepalive(self):
+        settings = tuning.load_tuning_settings({})
+        nginx_config = render(config_templates.NGINX_CONFIG, nginx_config=NginxConfig(), tuning=settings)
+        uwsgi_config = render(config_templates.UWSGI, uwsgi_config=UWSGIEnvironment(), tuning=settings)
+
+        self.assertIn('uwsgi_pass snap_app;', nginx_config)
+        self.assertNotIn('keepalive %d;' % settings.upstream_keepalive, nginx_config)
+        self.assertIn('socket = /tmp/%n.sock', uwsgi_config)
+        self.assertNotIn('http11-socket', uwsgi_config)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()